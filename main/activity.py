@@ -0,0 +1,191 @@
+"""
+Буферизованная запись активности пользователей.
+
+Вместо INSERT в user_activities на каждый запрос записи складываются в
+ограниченную очередь в памяти процесса, а фоновый поток сохраняет их пачками
+через bulk_create — по достижении размера пачки или по таймеру. При
+завершении процесса (atexit) очередь сбрасывается в базу. Если очередь
+переполнена, запись отбрасывается и увеличивается счетчик dropped.
+
+Настройки — settings.USER_ACTIVITY_BUFFER. При ENABLED=False записи
+сохраняются синхронно, как раньше.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'MAX_QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 2.0,
+    'SHUTDOWN_TIMEOUT': 10.0,
+}
+
+
+class ActivityBuffer:
+    """Очередь записей UserActivity с фоновым сохранением через bulk_create"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stop_event = threading.Event()
+        self._flush_event = threading.Event()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def config(self):
+        """Настройки буфера с учетом значений по умолчанию"""
+        return {**DEFAULT_CONFIG, **getattr(settings, 'USER_ACTIVITY_BUFFER', {})}
+
+    def enqueue(self, activity):
+        """
+        Ставит несохраненный экземпляр UserActivity в очередь.
+        Возвращает False, если запись отброшена из-за переполнения.
+        """
+        config = self.config
+        if not config['ENABLED']:
+            activity.save()
+            return True
+
+        self._ensure_worker(config)
+        try:
+            self._queue.put_nowait(activity)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            # Не засоряем лог: предупреждаем на 1, 2, 4, 8... потерянной записи
+            if dropped & (dropped - 1) == 0:
+                logger.warning(
+                    f"Очередь активности переполнена, отброшено записей: {dropped}"
+                )
+            return False
+
+        with self._lock:
+            self.enqueued += 1
+        if self._queue.qsize() >= config['BATCH_SIZE']:
+            self._flush_event.set()
+        return True
+
+    def flush(self):
+        """Синхронно сохраняет все записи, накопленные в очереди"""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        self._drain(self.config['BATCH_SIZE'])
+
+    def shutdown(self):
+        """Останавливает фоновый поток и сбрасывает очередь в базу"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop_event.set()
+        self._flush_event.set()
+        self._thread.join(self.config['SHUTDOWN_TIMEOUT'])
+        # Если поток не успел — дописываем остаток в текущем потоке
+        self.flush()
+
+    def stats(self):
+        """Счетчики буфера для мониторинга"""
+        return {
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+    def _ensure_worker(self, config):
+        """Запускает фоновый поток (заново — после fork воркера gunicorn)"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # Очередь, унаследованная от родительского процесса, сбрасывается им самим
+                self._queue = queue.Queue(maxsize=config['MAX_QUEUE_SIZE'])
+                self._stop_event = threading.Event()
+                self._flush_event = threading.Event()
+                self._pid = pid
+            self._thread = threading.Thread(
+                target=self._run,
+                name='user-activity-writer',
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _run(self):
+        """Основной цикл фонового потока"""
+        try:
+            while not self._stop_event.is_set():
+                config = self.config
+                self._flush_event.wait(config['FLUSH_INTERVAL'])
+                self._flush_event.clear()
+                self._drain(config['BATCH_SIZE'])
+            self._drain(self.config['BATCH_SIZE'])
+        finally:
+            connection.close()
+
+    def _drain(self, batch_size):
+        """Забирает записи из очереди пачками и сохраняет их"""
+        while True:
+            batch = []
+            try:
+                while len(batch) < batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            self._write_batch(batch)
+            if len(batch) < batch_size:
+                return
+
+    def _write_batch(self, batch):
+        """Сохраняет пачку одним INSERT, при ошибке — построчно"""
+        from .models import UserActivity
+
+        # Соединение потока живет между пачками — проверяем его как в конце запроса
+        close_old_connections()
+        try:
+            UserActivity.objects.bulk_create(batch)
+            with self._lock:
+                self.written += len(batch)
+            return
+        except Exception as e:
+            logger.warning(
+                f"Не удалось сохранить пачку активности ({len(batch)} записей), "
+                f"сохраняем построчно: {e}"
+            )
+
+        # Одна некорректная запись (например, объявление уже удалено)
+        # не должна приводить к потере всей пачки
+        for activity in batch:
+            try:
+                activity.pk = None
+                activity._state.adding = True
+                activity.save(force_insert=True)
+                with self._lock:
+                    self.written += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.error(f"Ошибка при сохранении записи активности: {e}")
+
+
+activity_buffer = ActivityBuffer()
+atexit.register(activity_buffer.shutdown)
@@ -11,8 +11,11 @@ from django.utils import timezone
 import csv
 import xlwt
 from datetime import datetime
+from .auth_backends import invalidate_cached_users
+from .autocomplete import bump_autocomplete_version
+from .search_engine import mark_changed, mark_users_changed
 from .models import (
-    Agency, User, UserPhoto, Address, Announcement, Photo, 
+    Agency, User, UserPhoto, Address, Announcement, Photo, PhotoRendition, 
     Collection, CollectionItem, Tariff, Subscription, 
     UserSession, PageView, Landmark, Microdistrict,
     ResidentialComplex, RepairType, BuildingType, UserActivity
@@ -98,7 +101,13 @@ class AgencyAdmin(admin.ModelAdmin):
             users_count = users_to_move.count()
             
             if users_count > 0:
+                user_ids = list(users_to_move.values_list('pk', flat=True))
+                invalidate_cached_users(user_ids)
                 users_to_move.update(agency=other_agency)
+                # update() не вызывает сигналов — число пользователей агентств в подсказках
+                # и агентство авторов объявлений в поиске
+                bump_autocomplete_version()
+                mark_users_changed(user_ids)
                 moved_users_count += users_count
                 
                 # Логируем перенос для каждого пользователя
@@ -146,7 +155,13 @@ class AgencyAdmin(admin.ModelAdmin):
         users_count = users_to_move.count()
         
         if users_count > 0:
+            user_ids = list(users_to_move.values_list('pk', flat=True))
+            invalidate_cached_users(user_ids)
             users_to_move.update(agency=other_agency)
+            # update() не вызывает сигналов — число пользователей агентств в подсказках
+            # и агентство авторов объявлений в поиске
+            bump_autocomplete_version()
+            mark_users_changed(user_ids)
             
             # Логируем перенос для каждого пользователя
             for user in users_to_move:
@@ -498,14 +513,20 @@ class UserAdmin(BaseUserAdmin):
     
     def make_superuser(self, request, queryset):
         """Сделать выбранных пользователей супер-админами"""
+        user_ids = list(queryset.values_list('pk', flat=True))
         updated = queryset.update(is_superuser=True, is_staff=True)
+        # update() не вызывает сигналов — снимки в кэше сохранили бы старые права
+        invalidate_cached_users(user_ids)
         self.message_user(request, f'{updated} пользователей сделаны супер-администраторами.', messages.SUCCESS)
     
     make_superuser.short_description = "👑 Сделать супер-админами"
     
     def make_regular_user(self, request, queryset):
         """Сделать выбранных пользователей обычными"""
+        user_ids = list(queryset.values_list('pk', flat=True))
         updated = queryset.update(is_superuser=False, is_staff=False)
+        # update() не вызывает сигналов — снимки в кэше сохранили бы старые права
+        invalidate_cached_users(user_ids)
         self.message_user(request, f'{updated} пользователей сделаны обычными.', messages.SUCCESS)
     
     make_regular_user.short_description = "👤 Сделать обычными пользователями"
@@ -611,22 +632,33 @@ class AnnouncementAdmin(admin.ModelAdmin):
     price_formatted.short_description = 'Цена'
     
     def archive_announcements(self, request, queryset):
-        updated = queryset.update(is_archived=True)
+        updated = queryset.update(is_archived=True, updated_at=timezone.now())
+        mark_changed()
         self.message_user(request, f'{updated} объявлений архивировано.', messages.SUCCESS)
     
     archive_announcements.short_description = "📦 Архивировать"
     
     def unarchive_announcements(self, request, queryset):
-        updated = queryset.update(is_archived=False)
+        updated = queryset.update(is_archived=False, updated_at=timezone.now())
+        mark_changed()
         self.message_user(request, f'{updated} объявлений восстановлено из архива.', messages.SUCCESS)
     
     unarchive_announcements.short_description = "📤 Восстановить из архива"
 
 
+class PhotoRenditionInline(admin.TabularInline):
+    model = PhotoRendition
+    extra = 0
+    fields = ['width', 'height', 'format', 'file_path', 'file_size']
+    readonly_fields = ['width', 'height', 'format', 'file_path', 'file_size']
+    can_delete = False
+
+
 @admin.register(Photo)
 class PhotoAdmin(admin.ModelAdmin):
-    list_display = ['announcement', 'file_name', 'is_main', 'uploaded_at']
-    list_filter = ['is_main', 'uploaded_at']
+    inlines = [PhotoRenditionInline]
+    list_display = ['announcement', 'file_name', 'is_main', 'status', 'processing_attempts', 'uploaded_at']
+    list_filter = ['is_main', 'status', 'uploaded_at']
     search_fields = ['announcement__user__first_name', 'file_name']
 
 
@@ -680,7 +712,7 @@ class SubscriptionAdmin(admin.ModelAdmin):
 
 @admin.register(UserSession)
 class UserSessionAdmin(admin.ModelAdmin):
-    list_display = ['user', 'login_time', 'logout_time', 'duration_formatted', 'session_key']
+    list_display = ['user', 'login_time', 'last_activity', 'logout_time', 'duration_formatted', 'session_key']
     list_filter = ['login_time', 'logout_time']
     search_fields = ['user__first_name', 'user__last_name', 'session_key']
     ordering = ['-login_time']
@@ -1,6 +1,41 @@
+from django.conf import settings
 from django.contrib.auth.backends import BaseBackend
 from django.contrib.auth.hashers import check_password
-from .models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from .models import User, UserPhoto
+
+
+USER_CACHE_KEY = 'auth_user_{}'
+
+
+def get_user_cache_key(user_id):
+    return USER_CACHE_KEY.format(user_id)
+
+
+def invalidate_cached_users(user_ids):
+    """
+    Удаляет снимки пользователей из кэша — вызывается при изменении профиля,
+    агентства или фото (main.signals).
+    """
+    keys = [get_user_cache_key(user_id) for user_id in user_ids]
+    # После коммита, иначе параллельный запрос может закэшировать старые данные
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def load_user_snapshot(user_id):
+    """
+    Пользователь с агентством и путем главного фото профиля одним запросом.
+    """
+    main_photo = UserPhoto.objects.filter(
+        user_id=OuterRef('pk')
+    ).order_by('-is_main', 'id').values('file_path')[:1]
+    user = User.objects.select_related('agency').annotate(
+        main_photo_file_path=Subquery(main_photo)
+    ).get(pk=user_id)
+    user.profile_photo_path = user.main_photo_file_path
+    return user
 
 
 class PhoneAuthBackend(BaseBackend):
@@ -27,9 +62,19 @@ class PhoneAuthBackend(BaseBackend):
     def get_user(self, user_id):
         """
         Get a user by their ID.
+        Снимок пользователя (с агентством и фото профиля) хранится в общем кэше
+        до изменения профиля, агентства или фото. Администраторы не кэшируются:
+        права должны сниматься сразу, а снимок содержит хэш пароля.
         """
+        cache_key = get_user_cache_key(user_id)
+        user = cache.get(cache_key)
+        if user is not None:
+            return user
         try:
-            return User.objects.get(pk=user_id)
+            user = load_user_snapshot(user_id)
         except User.DoesNotExist:
             return None
-
+        if user.is_staff or user.is_superuser:
+            return user
+        cache.set(cache_key, user, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 300))
+        return user
@@ -0,0 +1,183 @@
+"""
+Индекс автодополнения для жилых комплексов и агентств.
+
+Названия ЖК (справочник и уникальные complex_name из адресов) и агентства
+с заранее посчитанным числом пользователей загружаются в память процесса.
+Поиск не обращается к БД:
+
+- названия и запрос приводятся к ключу без учета регистра и алфавита —
+  кириллица (в т.ч. казахские буквы) транслитерируется в латиницу;
+- запрос дополнительно пробуется в другой раскладке клавиатуры
+  ("ofkrjd" -> "шалков", "Рфшмшдд" -> "haivill");
+- короткие запросы (1-2 символа) ищутся по префиксам слов, длинные — по
+  триграммам с проверкой вхождения подстроки.
+
+Индекс привязан к версии в общем кэше (AUTOCOMPLETE_VERSION_KEY), которую
+меняют сигналы при изменении ЖК, агентств, адресов и состава агентств.
+"""
+import re
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+
+AUTOCOMPLETE_VERSION_KEY = 'autocomplete_index_version'
+
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    'ә': 'a', 'ғ': 'g', 'қ': 'k', 'ң': 'n', 'ө': 'o', 'ұ': 'u', 'ү': 'u',
+    'һ': 'h', 'і': 'i',
+})
+
+LATIN_KEYS = "qwertyuiop[]asdfghjkl;'zxcvbnm,.`"
+CYRILLIC_KEYS = 'йцукенгшщзхъфывапролджэячсмитьбюё'
+LATIN_TO_CYRILLIC = str.maketrans(LATIN_KEYS, CYRILLIC_KEYS)
+CYRILLIC_TO_LATIN = str.maketrans(CYRILLIC_KEYS, LATIN_KEYS)
+
+NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    """Ключ поиска: нижний регистр, транслит кириллицы, только a-z0-9 и пробелы"""
+    text = (text or '').lower().translate(TRANSLIT)
+    return NON_ALNUM_RE.sub(' ', text).strip()
+
+
+def query_variants(query):
+    """Ключи запроса: как введен и в другой раскладке клавиатуры"""
+    query = query.lower()
+    variants = []
+    for text in (query, query.translate(LATIN_TO_CYRILLIC), query.translate(CYRILLIC_TO_LATIN)):
+        key = normalize(text)
+        if key and key not in variants:
+            variants.append(key)
+    return variants
+
+
+def trigrams(key):
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+class SuggestionIndex:
+    """Префиксный и триграммный индекс по списку (название, данные подсказки)"""
+
+    def __init__(self, entries):
+        self.entries = []
+        self.keys = []
+        self.prefixes = {}
+        self.trigrams = {}
+        for name, payload in entries:
+            key = normalize(name)
+            if not key:
+                continue
+            position = len(self.entries)
+            self.entries.append((name, payload))
+            self.keys.append(key)
+            for word in key.split():
+                for length in (1, 2):
+                    self.prefixes.setdefault(word[:length], set()).add(position)
+            for trigram in trigrams(key):
+                self.trigrams.setdefault(trigram, set()).add(position)
+
+    def search(self, query, limit=10):
+        """Подсказки, отсортированные: начало названия, начало слова, вхождение"""
+        ranked = {}
+        for key in query_variants(query):
+            if len(key) < 3:
+                candidates = self.prefixes.get(key, ())
+            else:
+                sets = sorted((self.trigrams.get(trigram, set()) for trigram in trigrams(key)), key=len)
+                candidates = set.intersection(*sets) if sets else ()
+
+            for position in candidates:
+                entry_key = self.keys[position]
+                if entry_key.startswith(key):
+                    rank = 0
+                elif (' ' + key) in (' ' + entry_key):
+                    rank = 1
+                elif len(key) >= 3 and key in entry_key:
+                    rank = 2
+                else:
+                    continue
+                ranked[position] = min(rank, ranked.get(position, rank))
+
+        positions = sorted(ranked, key=lambda p: (ranked[p], len(self.entries[p][0]), self.entries[p][0]))
+        return [self.entries[position][1] for position in positions[:limit]]
+
+
+class AutocompleteIndex:
+    """Снимок индексов ЖК и агентств одной версии"""
+
+    def __init__(self, version):
+        from .models import Address, Agency
+        from .reference_data import get_reference_data
+
+        self.version = version
+
+        # ЖК из справочника, затем названия из адресов, которых нет в справочнике
+        names = list(get_reference_data().residential_complexes.names)
+        known = set(names)
+        address_names = Address.objects.exclude(complex_name__isnull=True).exclude(
+            complex_name__exact=''
+        ).values_list('complex_name', flat=True).distinct()
+        for name in address_names:
+            if name not in known:
+                known.add(name)
+                names.append(name)
+        self.complexes = SuggestionIndex((name, {'name': name}) for name in names)
+
+        agencies = Agency.objects.annotate(users_count=Count('users')).values_list('id', 'name', 'users_count')
+        self.agencies = SuggestionIndex(
+            (name, {'id': pk, 'name': name, 'users_count': users_count})
+            for pk, name, users_count in agencies
+        )
+
+
+_lock = threading.Lock()
+_index = None
+
+
+def get_autocomplete_index():
+    """Актуальный индекс; перестраивается при смене версии"""
+    global _index
+
+    version = cache.get(AUTOCOMPLETE_VERSION_KEY)
+    if version is None:
+        cache.add(AUTOCOMPLETE_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(AUTOCOMPLETE_VERSION_KEY)
+
+    index = _index
+    if index is not None and index.version == version:
+        return index
+
+    with _lock:
+        if _index is None or _index.version != version:
+            _index = AutocompleteIndex(version)
+        return _index
+
+
+def bump_autocomplete_version():
+    """Помечает индекс устаревшим для всех процессов (после коммита транзакции)"""
+    def bump():
+        global _index
+        cache.set(AUTOCOMPLETE_VERSION_KEY, uuid.uuid4().hex, None)
+        _index = None
+
+    transaction.on_commit(bump)
+
+
+def search_complexes(query, limit=10):
+    """Подсказки названий ЖК: [{'name': ...}]"""
+    return get_autocomplete_index().complexes.search(query, limit)
+
+
+def search_agencies(query, limit=10):
+    """Подсказки агентств: [{'id', 'name', 'users_count'}]"""
+    return get_autocomplete_index().agencies.search(query, limit)
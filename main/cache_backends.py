@@ -0,0 +1,364 @@
+"""
+Общий для всех процессов хоста кэш в файле SQLite.
+
+LocMemCache живет в памяти каждого воркера gunicorn: каждый воркер прогревает
+свою копию справочников, а команды manage.py видят пустой кэш. SQLiteCache
+хранит записи в одном файле (LOCATION), поэтому все процессы используют общие
+значения без внешнего сервиса.
+
+- Запись атомарна: каждая операция — отдельная транзакция, файл в режиме WAL
+  (читатели не блокируются писателем).
+- Вытеснение LRU: при превышении MAX_ENTRIES сначала удаляются просроченные
+  записи, затем 1/CULL_FREQUENCY давно не читавшихся. Размер проверяется раз в
+  CULL_EVERY записей процесса, а не на каждой. Время доступа обновляется только
+  у доли чтений (ACCESS_SAMPLE_RATE) — иначе каждое чтение популярного ключа
+  брало бы блокировку записи файла. Записи без срока (версии справочников,
+  поколение объявлений) не вытесняются и время доступа у них не пишется.
+- Счетчики попаданий/промахов копятся в памяти процесса и периодически
+  добавляются в таблицу статистики — см. stats() и cache_management --stats.
+
+Пример настройки:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'main.cache_backends.SQLiteCache',
+            'LOCATION': BASE_DIR / 'cache' / 'django_cache.sqlite3',
+            'OPTIONS': {'MAX_ENTRIES': 5000, 'CULL_EVERY': 50, 'ACCESS_SAMPLE_RATE': 0.1},
+        }
+    }
+"""
+import atexit
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+# Как часто (сек.) сохранять накопленные в процессе счетчики
+STATS_FLUSH_INTERVAL = 5.0
+# Минимальный интервал (сек.) обновления времени доступа записи для LRU
+ACCESS_TIME_RESOLUTION = 1.0
+# Доля чтений, обновляющих время доступа, и через сколько записей проверять размер
+DEFAULT_ACCESS_SAMPLE_RATE = 0.1
+DEFAULT_CULL_EVERY = 50
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache_entries ('
+    ' key TEXT PRIMARY KEY,'
+    ' value BLOB NOT NULL,'
+    ' expires REAL,'
+    ' accessed REAL NOT NULL'
+    ')',
+    'CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires)',
+    'CREATE TABLE IF NOT EXISTS cache_stats ('
+    ' name TEXT PRIMARY KEY,'
+    ' value INTEGER NOT NULL DEFAULT 0'
+    ')',
+)
+
+STAT_NAMES = ('hits', 'misses', 'sets', 'deletes', 'expired', 'evictions')
+
+
+class SQLiteCache(BaseCache):
+    """Кэш Django в файле SQLite с LRU-вытеснением, общий для процессов"""
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = str(location)
+        options = params.get('OPTIONS', {})
+        self.busy_timeout = float(options.get('BUSY_TIMEOUT', 5.0))
+        self.access_sample_rate = float(options.get('ACCESS_SAMPLE_RATE', DEFAULT_ACCESS_SAMPLE_RATE))
+        self.cull_every = max(int(options.get('CULL_EVERY', DEFAULT_CULL_EVERY)), 1)
+        self._writes_since_cull = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._pending = dict.fromkeys(STAT_NAMES, 0)
+        self._flushed_at = time.monotonic()
+        # Счетчики коротких процессов (команды manage.py) сохраняются при выходе
+        atexit.register(self._flush_stats)
+
+    # ===== Соединение =====
+
+    def _connection(self):
+        """Соединение текущего потока; после fork создается заново"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            connection.execute(statement)
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def _transaction(self, callback):
+        """Выполняет callback(connection) в транзакции BEGIN IMMEDIATE"""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = callback(connection)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    # ===== Статистика =====
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._pending[name] += amount
+        self._flush_stats_if_due()
+
+    def _flush_stats_if_due(self):
+        if time.monotonic() - self._flushed_at >= STATS_FLUSH_INTERVAL:
+            self._flush_stats()
+
+    def _flush_stats(self):
+        """Добавляет накопленные в процессе счетчики в таблицу статистики"""
+        with self._stats_lock:
+            pending = {name: value for name, value in self._pending.items() if value}
+            self._pending = dict.fromkeys(STAT_NAMES, 0)
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            self._connection().executemany(
+                'INSERT INTO cache_stats (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                pending.items()
+            )
+        except sqlite3.OperationalError:
+            # Файл занят — вернем счетчики и сохраним в следующий раз
+            with self._stats_lock:
+                for name, value in pending.items():
+                    self._pending[name] += value
+
+    def stats(self):
+        """
+        Статистика общего кэша: число записей, размер значений и файла,
+        суммарные счетчики всех процессов.
+        """
+        self._flush_stats()
+        connection = self._connection()
+        entries, size, expired = connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0), '
+            'COALESCE(SUM(expires IS NOT NULL AND expires <= ?), 0) FROM cache_entries',
+            (time.time(),)
+        ).fetchone()
+        counters = dict.fromkeys(STAT_NAMES, 0)
+        counters.update(connection.execute('SELECT name, value FROM cache_stats'))
+        lookups = counters['hits'] + counters['misses']
+
+        file_size = 0
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                file_size += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+
+        return {
+            'location': self.path,
+            'entries': entries,
+            'stale_entries': expired,
+            'max_entries': self._max_entries,
+            'value_bytes': size,
+            'file_bytes': file_size,
+            'hit_rate': counters['hits'] / lookups if lookups else None,
+            **counters,
+        }
+
+    def reset_stats(self):
+        """Обнуляет счетчики попаданий/промахов"""
+        with self._stats_lock:
+            self._pending = dict.fromkeys(STAT_NAMES, 0)
+        self._connection().execute('DELETE FROM cache_stats')
+
+    # ===== Внутренние операции =====
+
+    def _read(self, connection, key):
+        """(значение, найдено) с удалением просроченной записи"""
+        row = connection.execute(
+            'SELECT value, expires, accessed FROM cache_entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None, False
+        value, expires, accessed = row
+        now = time.time()
+        if expires is not None and expires <= now:
+            connection.execute('DELETE FROM cache_entries WHERE key = ? AND expires <= ?', (key, now))
+            self._count('expired')
+            return None, False
+        if (
+            expires is not None
+            and now - accessed >= ACCESS_TIME_RESOLUTION
+            and random.random() < self.access_sample_rate
+        ):
+            connection.execute('UPDATE cache_entries SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(value), True
+
+    def _write(self, connection, key, value, timeout):
+        connection.execute(
+            'INSERT OR REPLACE INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+            (key, pickle.dumps(value, self.pickle_protocol), self.get_backend_timeout(timeout), time.time())
+        )
+        self._count('sets')
+
+    def _cull_due(self, writes=1):
+        """True раз в CULL_EVERY записей процесса: COUNT(*) не выполняется на каждой"""
+        with self._stats_lock:
+            self._writes_since_cull += writes
+            if self._writes_since_cull < self.cull_every:
+                return False
+            self._writes_since_cull = 0
+            return True
+
+    def _cull(self, connection):
+        """Удаляет просроченные записи, затем давно не читавшиеся (LRU)"""
+        count = connection.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        if count < self._max_entries:
+            return
+        removed = connection.execute(
+            'DELETE FROM cache_entries WHERE expires IS NOT NULL AND expires <= ?', (time.time(),)
+        ).rowcount
+        self._count('expired', removed)
+        count -= removed
+        if count < self._max_entries:
+            return
+        # Записи без срока не вытесняются: время доступа у них не обновляется
+        if self._cull_frequency == 0:
+            evicted = connection.execute('DELETE FROM cache_entries WHERE expires IS NOT NULL').rowcount
+        else:
+            evicted = connection.execute(
+                'DELETE FROM cache_entries WHERE key IN '
+                '(SELECT key FROM cache_entries WHERE expires IS NOT NULL ORDER BY accessed LIMIT ?)',
+                (max(count // self._cull_frequency, 1),)
+            ).rowcount
+        self._count('evictions', evicted)
+
+    # ===== API кэша Django =====
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        value, found = self._read(self._connection(), key)
+        self._count('hits' if found else 'misses')
+        return value if found else default
+
+    def get_many(self, keys, version=None):
+        result = {}
+        connection = self._connection()
+        for key in keys:
+            value, found = self._read(connection, self.make_and_validate_key(key, version=version))
+            self._count('hits' if found else 'misses')
+            if found:
+                result[key] = value
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+
+        cull = self._cull_due()
+
+        def write(connection):
+            if cull:
+                self._cull(connection)
+            self._write(connection, key, value, timeout)
+
+        self._transaction(write)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        keys = {self.make_and_validate_key(key, version=version): value for key, value in data.items()}
+
+        cull = self._cull_due(len(keys))
+
+        def write(connection):
+            if cull:
+                self._cull(connection)
+            for key, value in keys.items():
+                self._write(connection, key, value, timeout)
+
+        self._transaction(write)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+
+        def write(connection):
+            _, found = self._read(connection, key)
+            if found:
+                return False
+            if self._cull_due():
+                self._cull(connection)
+            self._write(connection, key, value, timeout)
+            return True
+
+        return self._transaction(write)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        updated = self._connection().execute(
+            'UPDATE cache_entries SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time())
+        ).rowcount
+        return bool(updated)
+
+    def incr(self, key, delta=1, version=None):
+        """Атомарное увеличение: чтение и запись в одной транзакции"""
+        key = self.make_and_validate_key(key, version=version)
+
+        def increment(connection):
+            row = connection.execute(
+                'SELECT value, expires FROM cache_entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= time.time()):
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            connection.execute(
+                'UPDATE cache_entries SET value = ?, accessed = ? WHERE key = ?',
+                (pickle.dumps(value, self.pickle_protocol), time.time(), key)
+            )
+            return value
+
+        return self._transaction(increment)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT 1 FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        deleted = self._connection().execute('DELETE FROM cache_entries WHERE key = ?', (key,)).rowcount
+        self._count('deletes', deleted)
+        return bool(deleted)
+
+    def delete_many(self, keys, version=None):
+        connection = self._connection()
+        deleted = 0
+        for key in keys:
+            key = self.make_and_validate_key(key, version=version)
+            deleted += connection.execute('DELETE FROM cache_entries WHERE key = ?', (key,)).rowcount
+        self._count('deletes', deleted)
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache_entries')
+
+    def close(self, **kwargs):
+        # Соединение потока переиспользуется между запросами
+        self._flush_stats_if_due()
@@ -0,0 +1,184 @@
+"""
+Поиск дубликатов объявлений по похожим фото.
+
+Одну квартиру часто выставляют несколько агентств с теми же или слегка
+обрезанными/пережатыми фото. Для каждого обработанного фото считается
+перцептивный хэш dHash (64 бита): изображение уменьшается до 9x8 в оттенках
+серого, каждый бит — «левый пиксель ярче правого». Похожие фото дают хэши
+с малым расстоянием Хэмминга.
+
+Поиск — multi-index hashing прямо в БД: хэш делится на 4 сегмента по 16 бит
+(Photo.dhash_0 ... dhash_3, у каждого свой индекс). Если расстояние между
+хэшами не больше MAX_DISTANCE, то хотя бы один сегмент отличается не больше
+чем на MAX_DISTANCE // 4 бит. Поэтому кандидаты выбираются по индексам
+сегментов со всеми вариантами в этом радиусе (1 + 16 значений на сегмент при
+радиусе 1), а точное расстояние считается только для них — без попарного
+сравнения со всей таблицей фото.
+
+Настройки — settings.PHOTO_DUPLICATES.
+"""
+from itertools import combinations
+
+from django.conf import settings
+from django.db.models import Q
+from PIL import Image
+
+
+DEFAULT_CONFIG = {
+    # Максимальное расстояние Хэмминга между dHash похожих фото (из 64 бит)
+    'MAX_DISTANCE': 7,
+    # Сколько фото объявления участвуют в поиске и сколько дубликатов показывается
+    'MAX_PHOTOS': 20,
+    'LIMIT': 5,
+}
+
+HASH_BITS = 64
+SEGMENTS = 4
+SEGMENT_BITS = HASH_BITS // SEGMENTS
+SEGMENT_FIELDS = tuple(f'dhash_{index}' for index in range(SEGMENTS))
+
+# Хэши почти однотонных изображений (планы, заглушки, пустое небо) совпадают
+# у несвязанных фото — такие хэши не ищутся
+MIN_SET_BITS = 4
+
+
+def get_config():
+    return {**DEFAULT_CONFIG, **getattr(settings, 'PHOTO_DUPLICATES', {})}
+
+
+def dhash(image):
+    """64-битный dHash изображения PIL (уже с примененной EXIF-ориентацией)"""
+    small = image.convert('L').resize((9, 8), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for column in range(8):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def hash_fields(value):
+    """
+    Значения полей Photo для хэша: dhash хранится со знаком (BigIntegerField),
+    сегменты — беззнаковые 16-битные числа от старших битов к младшим.
+    """
+    if value is None:
+        return {'dhash': None, **dict.fromkeys(SEGMENT_FIELDS)}
+    return {
+        'dhash': value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value,
+        **dict(zip(SEGMENT_FIELDS, split(value))),
+    }
+
+
+def from_db(value):
+    """Беззнаковый хэш из значения Photo.dhash"""
+    return value & ((1 << HASH_BITS) - 1)
+
+
+def split(value):
+    mask = (1 << SEGMENT_BITS) - 1
+    return [
+        (value >> (SEGMENT_BITS * (SEGMENTS - 1 - index))) & mask
+        for index in range(SEGMENTS)
+    ]
+
+
+def distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def is_informative(value):
+    return MIN_SET_BITS <= value.bit_count() <= HASH_BITS - MIN_SET_BITS
+
+
+def _segment_probes(segment, radius):
+    """Значения сегмента на расстоянии не больше radius бит"""
+    probes = [segment]
+    for flipped in range(1, radius + 1):
+        for bits in combinations(range(SEGMENT_BITS), flipped):
+            value = segment
+            for bit in bits:
+                value ^= 1 << bit
+            probes.append(value)
+    return probes
+
+
+def find_similar_photos(hashes, max_distance=None, exclude_announcement_id=None, exclude_user_id=None):
+    """
+    Готовые фото активных объявлений с dHash на расстоянии не больше max_distance
+    от любого из hashes. Возвращает [(announcement_id, photo_id, расстояние)].
+    """
+    from .models import Photo
+
+    if max_distance is None:
+        max_distance = get_config()['MAX_DISTANCE']
+    hashes = [value for value in hashes if is_informative(value)]
+    if not hashes:
+        return []
+
+    radius = max_distance // SEGMENTS
+    probes = [set() for _ in range(SEGMENTS)]
+    for value in hashes:
+        for index, segment in enumerate(split(value)):
+            probes[index].update(_segment_probes(segment, radius))
+
+    condition = Q()
+    for field, values in zip(SEGMENT_FIELDS, probes):
+        condition |= Q(**{f'{field}__in': values})
+    candidates = Photo.objects.filter(
+        condition, status=Photo.STATUS_READY, announcement__is_archived=False
+    )
+    if exclude_announcement_id is not None:
+        candidates = candidates.exclude(announcement_id=exclude_announcement_id)
+    if exclude_user_id is not None:
+        candidates = candidates.exclude(announcement__user_id=exclude_user_id)
+
+    similar = []
+    for announcement_id, photo_id, value in candidates.values_list('announcement_id', 'id', 'dhash'):
+        best = min(distance(from_db(value), other) for other in hashes)
+        if best <= max_distance:
+            similar.append((announcement_id, photo_id, best))
+    return similar
+
+
+def find_duplicate_announcements(announcement, limit=None, include_own=False):
+    """
+    Активные объявления с похожими фото, сначала с наибольшим числом совпавших
+    фото. У объявлений заполнены duplicate_matches (сколько фото совпало) и
+    duplicate_distance (наименьшее расстояние). Другие объявления того же
+    пользователя (часто с теми же фото) не считаются, если не include_own.
+    """
+    from .models import Announcement, Photo
+
+    config = get_config()
+    hashes = [
+        from_db(value) for value in announcement.photos.filter(
+            status=Photo.STATUS_READY, dhash__isnull=False
+        ).order_by('-is_main', 'id').values_list('dhash', flat=True)[:config['MAX_PHOTOS']]
+    ]
+    matches = {}
+    for announcement_id, photo_id, photo_distance in find_similar_photos(
+        hashes, config['MAX_DISTANCE'],
+        exclude_announcement_id=announcement.pk,
+        exclude_user_id=None if include_own else announcement.user_id,
+    ):
+        photos, best = matches.get(announcement_id, (set(), photo_distance))
+        photos.add(photo_id)
+        matches[announcement_id] = (photos, min(best, photo_distance))
+    if not matches:
+        return []
+
+    ranked = sorted(matches, key=lambda pk: (-len(matches[pk][0]), matches[pk][1], -pk))
+    ranked = ranked[:limit or config['LIMIT']]
+    announcements = Announcement.objects.filter(pk__in=ranked).select_related('user', 'address')
+    by_id = {item.pk: item for item in announcements}
+    result = []
+    for pk in ranked:
+        item = by_id.get(pk)
+        if item is None:
+            continue
+        item.duplicate_matches = len(matches[pk][0])
+        item.duplicate_distance = matches[pk][1]
+        result.append(item)
+    return result
@@ -1,11 +1,98 @@
-from django.core.cache import cache
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm
 from django.core.validators import RegexValidator
-from .models import User, Agency, Announcement, Collection, Address, Landmark
+from django.db.models import Model
+from django.forms.models import ModelChoiceIterator
+from .models import User, Agency, Announcement, Collection, Address
+from .reference_data import ReferenceTable, get_reference_data
 from urllib.parse import urlparse, urlunparse
 
 
+class ReferenceChoiceIterator(ModelChoiceIterator):
+    """Choices из справочника реестра (main.reference_data) без запроса к БД"""
+
+    def __init__(self, field):
+        self.field = field
+        self.queryset = None
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in self.field.table:
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.table) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.table)
+
+
+class ReferenceFieldMixin:
+    """Поле выбора объектов справочника; table назначается в __init__ формы"""
+
+    iterator = ReferenceChoiceIterator
+
+    def __init__(self, **kwargs):
+        self._table = ReferenceTable(())
+        super().__init__(None, **kwargs)
+
+    @property
+    def table(self):
+        return self._table
+
+    @table.setter
+    def table(self, table):
+        self._table = table
+        self.widget.choices = self.choices
+
+
+class ReferenceChoiceField(ReferenceFieldMixin, forms.ModelChoiceField):
+    """ModelChoiceField, валидирующий значение по справочнику реестра"""
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        self.validate_no_null_characters(value)
+        if isinstance(value, Model):
+            value = value.pk
+        obj = self.table.get(value)
+        if obj is None:
+            raise forms.ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return obj
+
+
+class ReferenceMultipleChoiceField(ReferenceFieldMixin, forms.ModelMultipleChoiceField):
+    """ModelMultipleChoiceField, валидирующий значения по справочнику реестра"""
+
+    def clean(self, value):
+        value = self.prepare_value(value)
+        if self.required and not value:
+            raise forms.ValidationError(self.error_messages['required'], code='required')
+        if not value:
+            return []
+        if not isinstance(value, (list, tuple)):
+            raise forms.ValidationError(self.error_messages['invalid_list'], code='invalid_list')
+
+        objects = {}
+        for pk in value:
+            self.validate_no_null_characters(pk)
+            obj = self.table.get(pk)
+            if obj is None:
+                raise forms.ValidationError(
+                    self.error_messages['invalid_choice'],
+                    code='invalid_choice',
+                    params={'value': pk},
+                )
+            objects[obj.pk] = obj
+        self.run_validators(value)
+        return list(objects.values())
+
+
 class PhoneLoginForm(AuthenticationForm):
     """Custom login form using phone number instead of username"""
     username = forms.CharField(
@@ -153,8 +240,7 @@ class AnnouncementForm(forms.ModelForm):
     """Announcement creation/edit form"""
     
     # Address fields - using database models instead of hardcoded choices
-    microdistrict = forms.ModelChoiceField(
-        queryset=None,  # Will be set in __init__
+    microdistrict = ReferenceChoiceField(
         required=True,
         label="Микрорайон *",
         empty_label="Выберите микрорайон",
@@ -163,8 +249,7 @@ class AnnouncementForm(forms.ModelForm):
         })
     )
     
-    complex_name = forms.ModelChoiceField(
-        queryset=None,  # Will be set in __init__
+    complex_name = ReferenceChoiceField(
         required=False,
         label="Жилой комплекс",
         empty_label="Выберите жилой комплекс",
@@ -266,8 +351,7 @@ class AnnouncementForm(forms.ModelForm):
     )
 
     # Using database models for repair status
-    repair_status = forms.ModelChoiceField(
-        queryset=None,  # Will be set in __init__
+    repair_status = ReferenceChoiceField(
         required=True,
         label="Ремонт *",
         empty_label="Выберите состояние ремонта",
@@ -278,8 +362,7 @@ class AnnouncementForm(forms.ModelForm):
     )
     
     # Using database models for building type
-    building_type = forms.ModelChoiceField(
-        queryset=None,  # Will be set in __init__
+    building_type = ReferenceChoiceField(
         required=True,
         label="Тип дома *",
         empty_label="Выберите тип дома",
@@ -290,8 +373,7 @@ class AnnouncementForm(forms.ModelForm):
     )
     
     # Landmarks field - "Дом находится рядом с"
-    landmarks = forms.ModelMultipleChoiceField(
-        queryset=None,  # Will be set in __init__
+    landmarks = ReferenceMultipleChoiceField(
         required=False,
         label="Дом находится рядом с",
         widget=forms.CheckboxSelectMultiple(attrs={
@@ -335,8 +417,8 @@ class AnnouncementForm(forms.ModelForm):
         }
 
     def __init__(self, *args, **kwargs):
-        # Import models here to avoid circular imports
-        from .models import Microdistrict, RepairType, BuildingType, ResidentialComplex
+        # Справочники для полей выбора и начальных значений — из реестра, без запросов к БД
+        reference_data = get_reference_data()
         
         # Extract address data if editing existing announcement
         instance = kwargs.get('instance')
@@ -345,25 +427,15 @@ class AnnouncementForm(forms.ModelForm):
             
             # Handle microdistrict - find by name
             if instance.address.microdistrict:
-                try:
-                    microdistrict_obj = Microdistrict.objects.get(
-                        name=instance.address.microdistrict, 
-                        is_active=True
-                    )
+                microdistrict_obj = reference_data.microdistricts.get_by_name(instance.address.microdistrict)
+                if microdistrict_obj:
                     initial['microdistrict'] = microdistrict_obj
-                except Microdistrict.DoesNotExist:
-                    pass
             
             # Handle complex name - find by name
             if instance.address.complex_name:
-                try:
-                    complex_obj = ResidentialComplex.objects.get(
-                        name=instance.address.complex_name, 
-                        is_active=True
-                    )
+                complex_obj = reference_data.residential_complexes.get_by_name(instance.address.complex_name)
+                if complex_obj:
                     initial['complex_name'] = complex_obj
-                except ResidentialComplex.DoesNotExist:
-                    pass
             
             initial.update({
                 'street': instance.address.street,
@@ -374,90 +446,26 @@ class AnnouncementForm(forms.ModelForm):
             
             # Handle building_type - find by name
             if instance.building_type:
-                try:
-                    building_type_obj = BuildingType.objects.get(
-                        name=instance.building_type, 
-                        is_active=True
-                    )
+                building_type_obj = reference_data.building_types.get_by_name(instance.building_type)
+                if building_type_obj:
                     initial['building_type'] = building_type_obj
-                except BuildingType.DoesNotExist:
-                    pass
             
             # Handle repair_status - find by name
             if instance.repair_status:
-                try:
-                    repair_type_obj = RepairType.objects.get(
-                        name=instance.repair_status, 
-                        is_active=True
-                    )
+                repair_type_obj = reference_data.repair_types.get_by_name(instance.repair_status)
+                if repair_type_obj:
                     initial['repair_status'] = repair_type_obj
-                except RepairType.DoesNotExist:
-                    pass
             
             kwargs['initial'] = initial
         
         super().__init__(*args, **kwargs)
         
-        # 🚀 Set cached querysets for model choice fields
-        from django.core.cache import cache
-        
-        # Кэшированный queryset для микрорайонов
-        microdistrict_qs_key = 'announcement_form_microdistrict_qs_v2'
-        microdistrict_qs = cache.get(microdistrict_qs_key)
-        if microdistrict_qs is None:
-            microdistrict_qs = list(Microdistrict.objects.filter(is_active=True).order_by('name'))
-            cache.set(microdistrict_qs_key, microdistrict_qs, 3600)  # 1 час
-        self.fields['microdistrict'].queryset = Microdistrict.objects.filter(
-            pk__in=[obj.pk for obj in microdistrict_qs]
-        ).order_by('name')
-        
-        # Кэшированный queryset для ЖК: сначала русские названия (А-Я), потом английские (A-Z)
-        complex_qs_key = 'announcement_form_complex_qs_v2'
-        complex_qs = cache.get(complex_qs_key)
-        if complex_qs is None:
-            complex_qs = list(ResidentialComplex.objects.filter(is_active=True).extra(
-                select={'name_sort': "CASE WHEN name ~ '^[А-Яа-я]' THEN '1' || name ELSE '2' || name END"}
-            ).order_by('name_sort'))
-            cache.set(complex_qs_key, complex_qs, 3600)
-        self.fields['complex_name'].queryset = ResidentialComplex.objects.filter(
-            pk__in=[obj.pk for obj in complex_qs]
-        ).extra(
-            select={'name_sort': "CASE WHEN name ~ '^[А-Яа-я]' THEN '1' || name ELSE '2' || name END"}
-        ).order_by('name_sort')
-        
-        # Кэшированный queryset для типов ремонта
-        repair_qs_key = 'announcement_form_repair_qs_v2'
-        repair_qs = cache.get(repair_qs_key)
-        if repair_qs is None:
-            repair_qs = list(RepairType.objects.filter(is_active=True).order_by('name'))
-            cache.set(repair_qs_key, repair_qs, 3600)
-        self.fields['repair_status'].queryset = RepairType.objects.filter(
-            pk__in=[obj.pk for obj in repair_qs]
-        ).order_by('name')
-        
-        # Кэшированный queryset для типов домов: "иной" вверху, остальные по алфавиту
-        building_type_qs_key = 'announcement_form_building_type_qs_v2'
-        building_type_qs = cache.get(building_type_qs_key)
-        if building_type_qs is None:
-            building_type_qs = list(BuildingType.objects.filter(is_active=True).extra(
-                select={'is_other': "CASE WHEN LOWER(name) = 'иной' THEN 0 ELSE 1 END"}
-            ).order_by('is_other', 'name'))
-            cache.set(building_type_qs_key, building_type_qs, 3600)
-        self.fields['building_type'].queryset = BuildingType.objects.filter(
-            pk__in=[obj.pk for obj in building_type_qs]
-        ).extra(
-            select={'is_other': "CASE WHEN LOWER(name) = 'иной' THEN 0 ELSE 1 END"}
-        ).order_by('is_other', 'name')
-        
-        # Кэшированный queryset для landmarks
-        landmarks_qs_key = 'announcement_form_landmarks_qs_v2'
-        landmarks_qs = cache.get(landmarks_qs_key)
-        if landmarks_qs is None:
-            landmarks_qs = list(Landmark.objects.all().order_by('name'))
-            cache.set(landmarks_qs_key, landmarks_qs, 3600)
-        self.fields['landmarks'].queryset = Landmark.objects.filter(
-            pk__in=[obj.pk for obj in landmarks_qs]
-        ).order_by('name')
+        # 🚀 Справочники в порядке отображения (ЖК: А-Я, затем A-Z; типы домов: "иной" вверху)
+        self.fields['microdistrict'].table = reference_data.microdistricts
+        self.fields['complex_name'].table = reference_data.residential_complexes
+        self.fields['repair_status'].table = reference_data.repair_types
+        self.fields['building_type'].table = reference_data.building_types
+        self.fields['landmarks'].table = reference_data.landmarks
 
     def get_address_data(self):
         """Extract address data from cleaned form data"""
@@ -853,8 +861,7 @@ class SearchForm(forms.Form):
     )
     
     # Фильтр по агентству
-    agency = forms.ModelChoiceField(
-        queryset=Agency.objects.all(),
+    agency = ReferenceChoiceField(
         required=False,
         empty_label="Все агентства",
         widget=forms.Select(attrs={
@@ -889,8 +896,7 @@ class SearchForm(forms.Form):
         ('central_embankment', 'Центральная набережная'),
     ]
     
-    landmarks = forms.ModelMultipleChoiceField(
-        queryset=Landmark.objects.all(),
+    landmarks = ReferenceMultipleChoiceField(
         required=False,
         widget=forms.CheckboxSelectMultiple(attrs={
             'class': 'form-check-input'
@@ -900,46 +906,15 @@ class SearchForm(forms.Form):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
-        # Импортируем модели
-        from .models import Microdistrict, BuildingType, ResidentialComplex
-        from django.core.cache import cache
-        
-        # 🚀 Кэшированные choices для микрорайонов
-        microdistrict_choices_key = 'search_form_microdistrict_choices_v2'
-        microdistrict_choices = cache.get(microdistrict_choices_key)
-        if not microdistrict_choices:
-            microdistrict_choices = [('', 'Выберите микрорайон')]
-            microdistricts = Microdistrict.objects.filter(is_active=True).order_by('name')
-            for microdistrict in microdistricts:
-                microdistrict_choices.append((microdistrict.name, microdistrict.name))
-            cache.set(microdistrict_choices_key, microdistrict_choices, 3600)  # 1 час
-        self.fields['microdistrict'].choices = microdistrict_choices
-        
-        # 🚀 Кэшированные choices для типов домов с сортировкой "иной" вверху
-        building_type_choices_key = 'search_form_building_type_choices_v2'
-        building_type_choices = cache.get(building_type_choices_key)
-        if not building_type_choices:
-            building_type_choices = [('', 'Выберите тип дома')]
-            building_types = BuildingType.objects.filter(is_active=True).extra(
-                select={'is_other': "CASE WHEN LOWER(name) = 'иной' THEN 0 ELSE 1 END"}
-            ).order_by('is_other', 'name')
-            for building_type in building_types:
-                building_type_choices.append((building_type.name, building_type.name))
-            cache.set(building_type_choices_key, building_type_choices, 3600)  # 1 час
-        self.fields['building_type'].choices = building_type_choices
-        
-        # 🚀 Кэшированные choices для жилых комплексов
-        complex_choices_key = 'search_form_complex_choices_v2'
-        complex_choices = cache.get(complex_choices_key)
-        if not complex_choices:
-            complex_choices = [('', 'Все жилые комплексы')]
-            complexes = ResidentialComplex.objects.filter(is_active=True).extra(
-                select={'name_sort': "CASE WHEN name ~ '^[А-Яа-я]' THEN '1' || name ELSE '2' || name END"}
-            ).order_by('name_sort')
-            for complex_obj in complexes:
-                complex_choices.append((complex_obj.name, complex_obj.name))
-            cache.set(complex_choices_key, complex_choices, 3600)  # 1 час
-        self.fields['complex_name'].choices = complex_choices
+        # 🚀 Choices и валидация по справочникам реестра, без запросов к БД
+        reference_data = get_reference_data()
+        self.fields['microdistrict'].choices = reference_data.microdistricts.choices('Выберите микрорайон')
+        # Типы домов: "иной" вверху, остальные по алфавиту
+        self.fields['building_type'].choices = reference_data.building_types.choices('Выберите тип дома')
+        # ЖК: сначала русские названия (А-Я), потом английские (A-Z)
+        self.fields['complex_name'].choices = reference_data.residential_complexes.choices('Все жилые комплексы')
+        self.fields['agency'].table = reference_data.agencies
+        self.fields['landmarks'].table = reference_data.landmarks
 
 
 class ChangeAgencyForm(forms.Form):
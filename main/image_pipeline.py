@@ -0,0 +1,313 @@
+"""
+Конвейер обработки загруженных изображений.
+
+Исходник открывается и декодируется один раз, из него получаются все нужные
+варианты (renditions) из settings.IMAGE_OPTIMIZATION:
+
+- full      — фото объявления (ANNOUNCEMENT_PHOTOS MAX_WIDTH x MAX_HEIGHT);
+- thumbnail — миниатюра для карточек и списков (THUMBNAIL_SIZE);
+- avatar    — фото пользователя (USER_PHOTOS);
+- w320, w640, ... — ширины для srcset (ANNOUNCEMENT_PHOTOS SRCSET_WIDTHS).
+
+JPEG декодируется сразу в уменьшенном масштабе (Image.draft: 1/2, 1/4, 1/8),
+достаточном для самого большого варианта, — фото с телефона на 12-48 Мп не
+разворачивается в память целиком. EXIF-ориентация применяется один раз, варианты
+уменьшаются последовательно от большего к меньшему.
+
+Кроме JPEG каждый вариант может кодироваться в современные форматы
+(IMAGE_OPTIMIZATION['MODERN_FORMATS'], например AVIF и WebP) — если их
+поддерживает установленный Pillow. Файлы форматов лежат рядом с JPEG с другим
+расширением, шаблоны отдают их через <picture> (main.templatetags.photo_tags).
+
+Заодно по самому маленькому варианту считается перцептивный хэш
+(PipelineResult.dhash, см. main.duplicates) — для поиска дубликатов объявлений.
+
+Время этапов (open, decode, orient, resize, encode) возвращается в
+PipelineResult.timings, пишется в лог и суммируется в get_pipeline_stats().
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from dataclasses import astuple, dataclass, field
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .duplicates import dhash
+
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('open', 'decode', 'orient', 'resize', 'encode')
+
+# Повороты EXIF, после которых ширина и высота меняются местами
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+@dataclass(frozen=True)
+class RenditionSpec:
+    """Вариант изображения: вписывается в max_width x max_height, без увеличения"""
+    name: str
+    max_width: int
+    max_height: int
+    quality: int = 85
+    # Необязательный вариант (ширины srcset) не строится, если он не уже
+    # предыдущего варианта или исходника
+    optional: bool = False
+
+    @property
+    def box(self):
+        return (self.max_width, self.max_height)
+
+
+# Форматы по умолчанию: сначала лучший, браузер выбирает первый поддерживаемый
+DEFAULT_MODERN_FORMATS = {
+    'avif': {'QUALITY': 55, 'SPEED': 8},
+    'webp': {'QUALITY': 75, 'METHOD': 4},
+}
+
+MIME_TYPES = {
+    'jpeg': 'image/jpeg',
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+}
+
+
+@dataclass
+class Rendition:
+    name: str
+    data: bytes
+    width: int
+    height: int
+    # Тот же вариант в других форматах: {'webp': bytes}
+    alternates: dict = field(default_factory=dict)
+
+    @property
+    def size(self):
+        return len(self.data)
+
+
+@dataclass
+class PipelineResult:
+    renditions: dict
+    source_size: tuple
+    decoded_size: tuple
+    timings: dict = field(default_factory=dict)
+    # dHash изображения (main.duplicates.dhash)
+    dhash: int = None
+
+    def __getitem__(self, name):
+        return self.renditions[name]
+
+    @property
+    def total_ms(self):
+        return sum(self.timings.values())
+
+
+def get_rendition_specs():
+    """Варианты изображений по settings.IMAGE_OPTIMIZATION"""
+    image_settings = getattr(settings, 'IMAGE_OPTIMIZATION', {})
+    announcement = image_settings.get('ANNOUNCEMENT_PHOTOS', {})
+    user = image_settings.get('USER_PHOTOS', {})
+    thumbnail_width, thumbnail_height = announcement.get('THUMBNAIL_SIZE', (400, 300))
+    return {
+        'full': RenditionSpec(
+            'full',
+            announcement.get('MAX_WIDTH', 1920),
+            announcement.get('MAX_HEIGHT', 1080),
+            announcement.get('QUALITY', 85),
+        ),
+        'thumbnail': RenditionSpec(
+            'thumbnail', thumbnail_width, thumbnail_height, announcement.get('THUMBNAIL_QUALITY', 80)
+        ),
+        'avatar': RenditionSpec(
+            'avatar',
+            user.get('MAX_WIDTH', 800),
+            user.get('MAX_HEIGHT', 800),
+            user.get('QUALITY', 90),
+        ),
+    }
+
+
+def get_srcset_specs():
+    """
+    Ширины для srcset фото объявлений (ANNOUNCEMENT_PHOTOS SRCSET_WIDTHS).
+    Высота ограничена как у full, поэтому ширины не больше full пропускаются.
+    """
+    announcement = getattr(settings, 'IMAGE_OPTIMIZATION', {}).get('ANNOUNCEMENT_PHOTOS', {})
+    return [
+        RenditionSpec(
+            f'w{width}',
+            width,
+            announcement.get('MAX_HEIGHT', 1080),
+            announcement.get('QUALITY', 85),
+            optional=True,
+        )
+        for width in announcement.get('SRCSET_WIDTHS', ())
+    ]
+
+
+def get_modern_formats():
+    """Современные форматы из настроек, которые умеет сохранять Pillow: {формат: параметры}"""
+    image_settings = getattr(settings, 'IMAGE_OPTIMIZATION', {})
+    configured = image_settings.get('MODERN_FORMATS', DEFAULT_MODERN_FORMATS)
+    Image.init()
+    return {
+        name: options for name, options in configured.items()
+        if name.upper() in Image.SAVE
+    }
+
+
+def get_renditions_signature():
+    """
+    Короткий хэш параметров вариантов фото объявлений и форматов. Входит в имена
+    файлов (PhotoService.get_storage_key): после смены настроек те же исходники
+    получают новые файлы, а не старые копии. Форматы берутся из настроек, а не из
+    get_modern_formats(): кодеки установленного Pillow не должны менять имена —
+    иначе хосты с разными сборками Pillow не делили бы одинаковые файлы.
+    """
+    specs = get_rendition_specs()
+    configured = getattr(settings, 'IMAGE_OPTIMIZATION', {}).get('MODERN_FORMATS', DEFAULT_MODERN_FORMATS)
+    params = [
+        astuple(spec) for spec in (specs['full'], specs['thumbnail'], *get_srcset_specs())
+    ] + sorted((name, sorted(options.items())) for name, options in configured.items())
+    return hashlib.sha1(repr(params).encode('utf-8')).hexdigest()[:8]
+
+
+def alternate_path(path, image_format):
+    """Путь файла варианта в другом формате: то же имя с другим расширением"""
+    return f"{os.path.splitext(path)[0]}.{image_format}"
+
+
+def fit_size(size, box):
+    """Размер изображения size, вписанного в box без увеличения"""
+    width, height = size
+    scale = min(1.0, box[0] / width, box[1] / height)
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+
+def render(source, renditions, formats=()):
+    """
+    Декодирует source (путь или файловый объект) один раз и строит варианты.
+    renditions — имена из get_rendition_specs() или объекты RenditionSpec;
+    formats — дополнительные форматы из get_modern_formats().
+    """
+    available = get_rendition_specs()
+    modern_formats = get_modern_formats()
+    formats = [image_format for image_format in formats if image_format in modern_formats]
+    specs = [available[spec] if isinstance(spec, str) else spec for spec in renditions]
+    if not specs:
+        raise ValueError('No renditions requested')
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    started = time.perf_counter()
+    img = Image.open(source)
+    source_size = img.size
+    orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    transposed = orientation in TRANSPOSED_ORIENTATIONS
+    timings['open'] = _elapsed(started)
+
+    # Уменьшенное декодирование JPEG до масштаба, достаточного для самого большого варианта
+    started = time.perf_counter()
+    if img.format == 'JPEG':
+        oriented = source_size[::-1] if transposed else source_size
+        needed = max((fit_size(oriented, spec.box) for spec in specs), key=_area)
+        img.draft('RGB', needed[::-1] if transposed else needed)
+    img.load()
+    decoded_size = img.size
+    timings['decode'] = _elapsed(started)
+
+    started = time.perf_counter()
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    img = ImageOps.exif_transpose(img)
+    timings['orient'] = _elapsed(started)
+
+    # Каждый следующий вариант уменьшается из предыдущего, а не из исходника
+    results = {}
+    current = img
+    previous_size = img.size
+    for spec in sorted(specs, key=lambda spec: _area(fit_size(img.size, spec.box)), reverse=True):
+        started = time.perf_counter()
+        target = fit_size(current.size, spec.box)
+        if spec.optional and target[0] >= previous_size[0]:
+            continue
+        if target != current.size:
+            current = current.resize(target, Image.Resampling.LANCZOS)
+        previous_size = current.size
+        timings['resize'] += _elapsed(started)
+
+        started = time.perf_counter()
+        buffer = io.BytesIO()
+        current.save(buffer, format='JPEG', quality=spec.quality, optimize=True)
+        rendition = Rendition(spec.name, buffer.getvalue(), *current.size)
+        for image_format in formats:
+            rendition.alternates[image_format] = _encode(current, image_format, modern_formats[image_format])
+        results[spec.name] = rendition
+        timings['encode'] += _elapsed(started)
+
+    # Хэш по самому маленькому варианту: уменьшение до 9x8 почти ничего не стоит
+    result = PipelineResult(results, source_size, decoded_size, timings, dhash(current))
+    _record(result)
+    return result
+
+
+def _area(size):
+    return size[0] * size[1]
+
+
+def _encode(image, image_format, options):
+    buffer = io.BytesIO()
+    params = {'quality': options.get('QUALITY', 75)}
+    if image_format == 'webp':
+        params['method'] = options.get('METHOD', 4)
+    elif image_format == 'avif':
+        params['speed'] = options.get('SPEED', 8)
+    image.save(buffer, format=image_format.upper(), **params)
+    return buffer.getvalue()
+
+
+def _elapsed(started):
+    return (time.perf_counter() - started) * 1000
+
+
+# ===== Статистика процесса =====
+
+_stats_lock = threading.Lock()
+_stats = {
+    'images': 0,
+    'source_pixels': 0,
+    'decoded_pixels': 0,
+    'stages_ms': dict.fromkeys(STAGES, 0.0),
+}
+
+
+def _record(result):
+    logger.info(
+        'Image %sx%s decoded at %sx%s, renditions %s: %s (%.1f ms)',
+        *result.source_size, *result.decoded_size,
+        ','.join(result.renditions),
+        ' '.join(f'{stage}={ms:.1f}' for stage, ms in result.timings.items()),
+        result.total_ms,
+    )
+    with _stats_lock:
+        _stats['images'] += 1
+        _stats['source_pixels'] += result.source_size[0] * result.source_size[1]
+        _stats['decoded_pixels'] += result.decoded_size[0] * result.decoded_size[1]
+        for stage, ms in result.timings.items():
+            _stats['stages_ms'][stage] += ms
+
+
+def get_pipeline_stats():
+    """Суммарное время этапов и доля декодированных пикселей в текущем процессе"""
+    with _stats_lock:
+        stats = {**_stats, 'stages_ms': dict(_stats['stages_ms'])}
+    stats['total_ms'] = sum(stats['stages_ms'].values())
+    stats['decoded_ratio'] = (
+        stats['decoded_pixels'] / stats['source_pixels'] if stats['source_pixels'] else None
+    )
+    return stats
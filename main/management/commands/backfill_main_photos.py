@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+from main.models import Announcement
+from main.services import PhotoService
+
+
+class Command(BaseCommand):
+    help = 'Fill denormalized main photo paths (main_photo_path, main_thumbnail_path) on announcements'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of announcement ids per UPDATE (default: 1000)',
+        )
+        parser.add_argument(
+            '--only-missing',
+            action='store_true',
+            help='Only process announcements without main photo path',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        
+        queryset = Announcement.objects.all()
+        if options['only_missing']:
+            queryset = queryset.filter(main_photo_path__isnull=True)
+        
+        bounds = queryset.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if bounds['min_id'] is None:
+            self.stdout.write(self.style.SUCCESS('No announcements to process'))
+            return
+        
+        # Обновляем диапазонами id, чтобы не держать блокировку на всей таблице
+        updated = 0
+        start = bounds['min_id']
+        while start <= bounds['max_id']:
+            end = start + batch_size
+            updated += PhotoService.refresh_announcement_main_photos(
+                queryset.filter(id__gte=start, id__lt=end)
+            )
+            self.stdout.write(f'  Processed ids {start}-{end - 1}, updated: {updated}')
+            start = end
+        
+        with_photo = Announcement.objects.filter(main_photo_path__isnull=False).count()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully updated {updated} announcements ({with_photo} have a main photo)'
+            )
+        )
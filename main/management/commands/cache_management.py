@@ -1,5 +1,8 @@
 from django.core.cache import cache
 from django.core.management.base import BaseCommand
+from main.reference_data import (
+    REFERENCE_DATA_VERSION_KEY, bump_reference_data_version, get_reference_data
+)
 import time
 
 class Command(BaseCommand):
@@ -42,32 +45,16 @@ class Command(BaseCommand):
             )
 
     def clear_static_cache(self):
-        """Очищает кэш статических данных"""
+        """Сбрасывает реестр справочников во всех процессах"""
         self.stdout.write('🗑️ Очистка кэша статических данных...')
         
-        # Ключи кэша для форм поиска
-        search_keys = [
-            'search_form_microdistrict_choices_v2',
-            'search_form_building_type_choices_v2',
-            'search_form_complex_choices_v2',
-        ]
-        
-        # Ключи кэша для форм объявлений
-        announcement_keys = [
-            'announcement_form_microdistrict_qs_v2',
-            'announcement_form_complex_qs_v2',
-            'announcement_form_repair_qs_v2',
-            'announcement_form_building_type_qs_v2',
-        ]
-        
-        all_keys = search_keys + announcement_keys
-        
-        for key in all_keys:
-            cache.delete(key)
-            self.stdout.write(f'   ❌ Удален: {key}')
+        # Справочники форм хранятся в реестре main.reference_data:
+        # новая версия заставит все процессы перечитать их из БД
+        bump_reference_data_version()
+        self.stdout.write(f'   ❌ Изменена версия: {REFERENCE_DATA_VERSION_KEY}')
         
         self.stdout.write(
-            self.style.SUCCESS(f'✅ Очищено {len(all_keys)} ключей кэша')
+            self.style.SUCCESS('✅ Справочники будут перечитаны при следующем обращении')
         )
 
     def warmup_static_cache(self):
@@ -77,15 +64,8 @@ class Command(BaseCommand):
         start_time = time.time()
         
         try:
-            # Импортируем формы для инициализации кэша
-            from main.forms import SearchForm, AnnouncementForm
-            
-            # Создаем формы - это автоматически заполнит кэш
-            search_form = SearchForm()
-            self.stdout.write('   ✅ SearchForm кэш прогрет')
-            
-            announcement_form = AnnouncementForm()
-            self.stdout.write('   ✅ AnnouncementForm кэш прогрет')
+            # Создает версию справочников в общем кэше и загружает реестр
+            self.show_reference_data(get_reference_data())
             
             elapsed = time.time() - start_time
             self.stdout.write(
@@ -102,6 +82,11 @@ class Command(BaseCommand):
         self.stdout.write('📊 Статистика кэша статических данных:')
         self.stdout.write('')
         
+        # Общий кэш (SQLiteCache) виден из любого процесса — показываем реальные данные
+        if hasattr(cache, 'stats'):
+            self.show_shared_cache_stats()
+            return
+        
         # Объясняем поведение LocMemCache
         from django.conf import settings
         cache_backend = settings.CACHES['default']['BACKEND']
@@ -113,59 +98,44 @@ class Command(BaseCommand):
             self.stdout.write('   Поэтому кэш всегда будет показываться как пустой')
             self.stdout.write('')
         
-        # Проверяем и прогреваем кэш в этом же процессе
-        self.stdout.write('🔥 Проверяем кэш в текущем процессе...')
+        self.show_reference_data(get_reference_data())
+
+    def show_shared_cache_stats(self):
+        """Статистика общего кэша: счетчики всех воркеров и наличие ключей справочников"""
+        stats = cache.stats()
         
-        try:
-            from main.forms import SearchForm, AnnouncementForm
-            
-            # Очищаем для чистого теста
-            cache.clear()
-            self.stdout.write('   🧹 Кэш очищен')
-            
-            # Создаем формы
-            search_form = SearchForm()
-            announcement_form = AnnouncementForm()
-            
-            # Проверяем что кэш заполнился
-            cache_keys = [
-                ('SearchForm микрорайоны', 'search_form_microdistrict_choices_v2'),
-                ('SearchForm типы домов', 'search_form_building_type_choices_v2'),
-                ('SearchForm ЖК', 'search_form_complex_choices_v2'),
-                ('AnnouncementForm микрорайоны', 'announcement_form_microdistrict_qs_v2'),
-                ('AnnouncementForm ЖК', 'announcement_form_complex_qs_v2'),
-                ('AnnouncementForm ремонт', 'announcement_form_repair_qs_v2'),
-                ('AnnouncementForm типы домов', 'announcement_form_building_type_qs_v2'),
-            ]
-            
-            cached_count = 0
-            total_count = len(cache_keys)
-            
-            for name, key in cache_keys:
-                value = cache.get(key)
-                if value is not None:
-                    if isinstance(value, list) and len(value) > 0:
-                        first_item = value[0]
-                        if isinstance(first_item, tuple):
-                            # Choices для форм поиска
-                            self.stdout.write(f'   ✅ {name}: {len(value)-1} вариантов (+ пустой)')
-                        else:
-                            # Объекты Django для форм объявлений
-                            self.stdout.write(f'   ✅ {name}: {len(value)} объектов')
-                    else:
-                        self.stdout.write(f'   ✅ {name}: кэшировано')
-                    cached_count += 1
-                else:
-                    self.stdout.write(f'   ❌ {name}: не кэшировано')
-            
-            self.stdout.write('')
-            if cached_count == total_count:
-                self.stdout.write(self.style.SUCCESS(f'🎉 Кэширование работает отлично! ({cached_count}/{total_count})'))
-            else:
-                self.stdout.write(self.style.ERROR(f'❌ Проблемы с кэшированием ({cached_count}/{total_count})'))
-                
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'❌ Ошибка проверки кэша: {e}'))
+        self.stdout.write(f'   📁 Файл: {stats["location"]}')
+        self.stdout.write(f'   📦 Записей: {stats["entries"]} из {stats["max_entries"]} (просрочено: {stats["stale_entries"]})')
+        self.stdout.write(f'   💾 Размер значений: {stats["value_bytes"] / 1024:.1f} КБ, файла: {stats["file_bytes"] / 1024:.1f} КБ')
+        self.stdout.write('')
+        
+        hit_rate = f'{stats["hit_rate"] * 100:.1f}%' if stats['hit_rate'] is not None else '—'
+        self.stdout.write(f'   🎯 Попаданий: {stats["hits"]}, промахов: {stats["misses"]} (hit rate: {hit_rate})')
+        self.stdout.write(f'   ✏️ Сохранений: {stats["sets"]}, удалений: {stats["deletes"]}')
+        self.stdout.write(f'   ⌛ Истекло: {stats["expired"]}, вытеснено (LRU): {stats["evictions"]}')
+        self.stdout.write('')
+        
+        # has_key не учитывается в счетчиках попаданий
+        if cache.has_key(REFERENCE_DATA_VERSION_KEY):
+            self.stdout.write(f'   ✅ {REFERENCE_DATA_VERSION_KEY}: {cache.get(REFERENCE_DATA_VERSION_KEY)}')
+        else:
+            self.stdout.write(f'   ❌ {REFERENCE_DATA_VERSION_KEY}: версия еще не создана, см. --warmup')
+        self.stdout.write('')
+        self.show_reference_data(get_reference_data())
+
+    def show_reference_data(self, reference_data):
+        """Размеры справочников реестра текущей версии"""
+        self.stdout.write(f'📚 Реестр справочников (версия {reference_data.version}):')
+        tables = [
+            ('Микрорайоны', reference_data.microdistricts),
+            ('Жилые комплексы', reference_data.residential_complexes),
+            ('Типы ремонта', reference_data.repair_types),
+            ('Типы домов', reference_data.building_types),
+            ('Опорные точки', reference_data.landmarks),
+            ('Агентства', reference_data.agencies),
+        ]
+        for name, table in tables:
+            self.stdout.write(f'   ✅ {name}: {len(table)}')
 
     def test_cache_performance(self):
         """Тестирует производительность кэширования"""
@@ -175,8 +145,8 @@ class Command(BaseCommand):
         try:
             from main.forms import SearchForm, AnnouncementForm
             
-            # Очищаем кэш
-            cache.clear()
+            # Сбрасываем реестр справочников
+            bump_reference_data_version()
             
             # Тест без кэша (первый запуск)
             self.stdout.write('🐌 БЕЗ КЭША (первый запуск):')
@@ -0,0 +1,217 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from main.image_pipeline import MIME_TYPES, alternate_path
+from main.models import Photo, PhotoRendition, PhotoUpload, UserPhoto
+from main.services import PhotoUploadService
+
+
+class Command(BaseCommand):
+    help = 'Find and delete media files not referenced by photos, and report referenced files that are missing'
+
+    # Каталоги MEDIA_ROOT с загрузками; остальное содержимое media/ не трогается
+    MANAGED_DIRS = ('announcement_photos', 'user_photos')
+
+    # Пути, на которые ссылаются строки БД (у каждого поля есть индекс)
+    REFERENCES = (
+        (Photo, 'file_path'),
+        (Photo, 'thumbnail_path'),
+        (PhotoRendition, 'file_path'),
+        (UserPhoto, 'file_path'),
+    )
+
+    # Расширения копий фото в современных форматах (лежат рядом с JPEG, см. Photo.formats)
+    ALTERNATE_EXTENSIONS = {f'.{image_format}' for image_format in MIME_TYPES if image_format != 'jpeg'}
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would be deleted without deleting',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=float,
+            default=24,
+            help='Hours: newer unreferenced files are kept — uploads may not be committed yet (default: 24)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Files checked against the database per query (default: 500)',
+        )
+        parser.add_argument(
+            '--skip-missing',
+            action='store_true',
+            help='Do not check that referenced files exist',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        verbose = options['verbosity'] > 1
+        if dry_run:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No files will be deleted'))
+
+        started = time.monotonic()
+        modified_before = time.time() - options['min_age'] * 3600
+        stats = {'files': 0, 'bytes': 0, 'orphans': 0, 'orphan_bytes': 0, 'recent': 0, 'deleted_bytes': 0}
+
+        for batch in self.iter_batches(self.iter_files(), options['batch_size']):
+            referenced = self.get_referenced(batch)
+            for path, size, mtime in batch:
+                stats['files'] += 1
+                stats['bytes'] += size
+                if path in referenced:
+                    continue
+                if mtime > modified_before:
+                    stats['recent'] += 1
+                    continue
+                stats['orphans'] += 1
+                stats['orphan_bytes'] += size
+                if verbose:
+                    self.stdout.write(f'  orphan: {path} ({self.format_size(size)})')
+                if not dry_run:
+                    try:
+                        os.remove(self.full_path(path))
+                        stats['deleted_bytes'] += size
+                    except FileNotFoundError:
+                        pass
+
+        self.stdout.write(
+            f'Scanned {stats["files"]} files ({self.format_size(stats["bytes"])}) '
+            f'in {", ".join(self.MANAGED_DIRS)}'
+        )
+        action = 'would be deleted' if dry_run else 'deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'Orphaned files: {stats["orphans"]} ({self.format_size(stats["orphan_bytes"])}) {action}'
+        ))
+        if stats['recent']:
+            self.stdout.write(
+                f'Kept {stats["recent"]} unreferenced files newer than {options["min_age"]:g} h'
+            )
+
+        self.cleanup_uploads(dry_run)
+
+        if not options['skip_missing']:
+            self.report_missing(verbose)
+
+        self.stdout.write(f'Completed in {time.monotonic() - started:.1f} s')
+
+    def iter_files(self):
+        """(относительный путь, размер, mtime) файлов управляемых каталогов — обход через os.scandir"""
+        media_root = os.fspath(settings.MEDIA_ROOT)
+        pending = [os.path.join(media_root, name) for name in self.MANAGED_DIRS]
+        while pending:
+            directory = pending.pop()
+            try:
+                entries = os.scandir(directory)
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        path = os.path.relpath(entry.path, media_root).replace(os.sep, '/')
+                        yield path, stat.st_size, stat.st_mtime
+
+    def iter_batches(self, items, size):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def get_referenced(self, batch):
+        """Пути порции, на которые ссылается БД: несколько запросов по индексам на порцию"""
+        paths = [path for path, _, _ in batch]
+        referenced = set()
+        for model, field in self.REFERENCES:
+            referenced.update(
+                model.objects.filter(**{f'{field}__in': paths}).values_list(field, flat=True)
+            )
+        # Исходники в очереди обработки — фото еще не готовы (индекс по status)
+        referenced.update(
+            Photo.objects.exclude(status=Photo.STATUS_READY).filter(
+                source_path__in=paths
+            ).values_list('source_path', flat=True)
+        )
+
+        # Копия в современном формате используется, если ее формат есть в Photo.formats
+        alternates = {}
+        for path in paths:
+            stem, extension = os.path.splitext(path)
+            if extension in self.ALTERNATE_EXTENSIONS and path not in referenced:
+                alternates.setdefault(f'{stem}.jpg', []).append((extension[1:], path))
+        if alternates:
+            jpeg_paths = list(alternates)
+            rows = Photo.objects.filter(
+                Q(file_path__in=jpeg_paths) | Q(thumbnail_path__in=jpeg_paths)
+            ).exclude(formats='').values_list('file_path', 'thumbnail_path', 'formats')
+            for file_path, thumbnail_path, formats in rows:
+                formats = formats.split(',')
+                for jpeg_path in (file_path, thumbnail_path):
+                    for image_format, path in alternates.get(jpeg_path, ()):
+                        if image_format in formats:
+                            referenced.add(path)
+        return referenced
+
+    def cleanup_uploads(self, dry_run):
+        """Незавершенные и неиспользованные загрузки частями (PhotoUploadService)"""
+        if dry_run:
+            expired_before = timezone.now() - timedelta(seconds=PhotoUploadService.get_config()['EXPIRE_AFTER'])
+            count = PhotoUpload.objects.filter(updated_at__lt=expired_before).count()
+            self.stdout.write(f'Expired chunked uploads: {count} would be deleted')
+            return
+        count, freed = PhotoUploadService.delete_expired()
+        self.stdout.write(f'Expired chunked uploads: {count} deleted, {self.format_size(freed)} of spool files freed')
+
+    def report_missing(self, verbose):
+        """Пути из БД без файла. Строки читаются потоком (iterator), общие файлы — один раз (distinct)"""
+        missing = 0
+        checked = 0
+        for model, field in (*self.REFERENCES, (Photo, 'source_path')):
+            paths = model.objects.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''}).order_by(
+                field
+            ).values_list(field, flat=True).distinct()
+            for path in paths.iterator(chunk_size=2000):
+                checked += 1
+                if not os.path.exists(self.full_path(path)):
+                    missing += 1
+                    if verbose:
+                        self.stdout.write(f'  missing: {path} ({model.__name__}.{field})')
+
+        rows = Photo.objects.exclude(formats='').order_by('file_path').values_list(
+            'file_path', 'thumbnail_path', 'formats'
+        ).distinct()
+        for file_path, thumbnail_path, formats in rows.iterator(chunk_size=2000):
+            for path in (file_path, thumbnail_path):
+                if not path:
+                    continue
+                for image_format in formats.split(','):
+                    checked += 1
+                    alternate = alternate_path(path, image_format)
+                    if not os.path.exists(self.full_path(alternate)):
+                        missing += 1
+                        if verbose:
+                            self.stdout.write(f'  missing: {alternate} (Photo.formats)')
+
+        style = self.style.WARNING if missing else self.style.SUCCESS
+        self.stdout.write(style(f'Missing files: {missing} of {checked} referenced paths'))
+
+    def full_path(self, path):
+        return os.path.join(os.fspath(settings.MEDIA_ROOT), *path.split('/'))
+
+    def format_size(self, size):
+        return f'{size / 1024 / 1024:.2f} MB'
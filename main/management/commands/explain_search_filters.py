@@ -0,0 +1,172 @@
+import ast
+import re
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from main.models import Agency, Landmark, UserActivity
+from main.services import AnnouncementService
+
+
+# Типы значений SearchForm: log_filter_action сохраняет их строками (str(value))
+INTEGER_FILTERS = {
+    'price_from', 'price_to', 'price_per_sqm_from', 'price_per_sqm_to',
+    'year_built_from', 'year_built_to', 'floor_from', 'floor_to',
+}
+DECIMAL_FILTERS = {'area_from', 'area_to'}
+BOOLEAN_FILTERS = {'not_first_floor', 'not_last_floor', 'is_new_building', 'agency_only'}
+STRING_FILTERS = {'microdistrict', 'building_type', 'complex_name'}
+
+LANDMARK_REPR_RE = re.compile(r'<Landmark: (.*?)>')
+
+# Признаки последовательного чтения таблицы в плане запроса
+SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (\w+)(?!\w| USING)'),
+}
+
+
+def parse_filter_params(params):
+    """
+    Восстанавливает cleaned_data SearchForm из filter_params,
+    записанных log_filter_action. Нераспознанные значения пропускаются.
+    """
+    filters = {}
+    for key, value in (params or {}).items():
+        try:
+            if key == 'rooms_count':
+                rooms = ast.literal_eval(value) if isinstance(value, str) else value
+                filters[key] = [str(room) for room in rooms]
+            elif key in INTEGER_FILTERS:
+                filters[key] = int(value)
+            elif key in DECIMAL_FILTERS:
+                filters[key] = Decimal(value)
+            elif key in BOOLEAN_FILTERS:
+                filters[key] = value in (True, 'True', 'true', '1', 'on')
+            elif key in STRING_FILTERS:
+                filters[key] = value
+            elif key == 'agency':
+                filters[key] = Agency.objects.filter(name=value).first()
+            elif key == 'landmarks':
+                names = LANDMARK_REPR_RE.findall(value)
+                filters[key] = list(Landmark.objects.filter(name__in=names))
+        except (ValueError, SyntaxError, TypeError, InvalidOperation):
+            continue
+    return filters
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded search filter combinations with EXPLAIN and report sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Use filter actions recorded during the last N days (default: 30)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=5000,
+            help='Maximum number of recorded filter actions to read (default: 5000)',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Number of most frequent combinations to explain (default: 20)',
+        )
+        parser.add_argument(
+            '--per-page',
+            type=int,
+            default=12,
+            help='LIMIT used for the explained list query (default: 12)',
+        )
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='Run EXPLAIN ANALYZE (PostgreSQL only, executes the queries)',
+        )
+        parser.add_argument(
+            '--show-plan',
+            action='store_true',
+            help='Print full plan for every combination',
+        )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        seq_scan_re = SEQ_SCAN_PATTERNS.get(vendor)
+        if seq_scan_re is None:
+            self.stdout.write(self.style.ERROR(f'EXPLAIN parsing is not supported for {vendor}'))
+            return
+
+        since = timezone.now() - timedelta(days=options['days'])
+        recorded = UserActivity.objects.filter(
+            action_type='filter_announcements',
+            timestamp__gte=since
+        ).order_by('-timestamp').values_list('metadata', flat=True)[:options['limit']]
+
+        # Группируем по набору примененных фильтров и храним пример значений
+        combinations = Counter()
+        samples = {}
+        for metadata in recorded:
+            params = (metadata or {}).get('filter_params') or {}
+            if not params:
+                continue
+            signature = tuple(sorted(params))
+            combinations[signature] += 1
+            samples.setdefault(signature, params)
+
+        if not combinations:
+            self.stdout.write(self.style.WARNING('No recorded filter actions found'))
+            return
+
+        self.stdout.write(
+            f'Recorded filter actions: {sum(combinations.values())}, '
+            f'distinct combinations: {len(combinations)}'
+        )
+
+        explain_options = {}
+        if options['analyze'] and vendor == 'postgresql':
+            explain_options['analyze'] = True
+
+        seq_scan_count = 0
+        for signature, count in combinations.most_common(options['top']):
+            filters = parse_filter_params(samples[signature])
+            queryset = AnnouncementService.filter_announcements(
+                AnnouncementService.get_all_announcements(), filters
+            ).order_by('-created_at', '-id')[:options['per_page'] + 1]
+
+            try:
+                plan = queryset.explain(**explain_options)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'[{count}x] {", ".join(signature)}: {e}'))
+                continue
+
+            seq_scans = sorted(set(seq_scan_re.findall(plan)))
+            if seq_scans:
+                seq_scan_count += 1
+                self.stdout.write(
+                    self.style.WARNING(
+                        f'[{count}x] {", ".join(signature)}: seq scan on {", ".join(seq_scans)}'
+                    )
+                )
+            else:
+                self.stdout.write(self.style.SUCCESS(f'[{count}x] {", ".join(signature)}: uses indexes'))
+
+            if options['show_plan']:
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line}')
+
+        explained = min(options['top'], len(combinations))
+        if seq_scan_count:
+            self.stdout.write(
+                self.style.WARNING(f'{seq_scan_count} of {explained} combinations still use sequential scans')
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(f'All {explained} combinations use indexes'))
@@ -3,6 +3,7 @@ import os
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from main.models import ResidentialComplex, Microdistrict
+from main.reference_data import bump_reference_data_version
 
 
 class Command(BaseCommand):
@@ -85,6 +86,9 @@ class Command(BaseCommand):
                 )
                 return
 
+        # Процессы сайта перечитают справочники при следующем обращении
+        bump_reference_data_version()
+
         # Final results
         self.stdout.write(
             self.style.SUCCESS(
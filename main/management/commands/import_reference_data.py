@@ -4,6 +4,8 @@ from django.core import serializers
 from django.db import transaction
 from django.apps import apps
 
+from main.reference_data import bump_reference_data_version
+
 
 class Command(BaseCommand):
     help = 'Import reference data from JSON file'
@@ -86,6 +88,9 @@ class Command(BaseCommand):
                 )
                 return
 
+        # Процессы сайта перечитают справочники при следующем обращении
+        bump_reference_data_version()
+
         self.stdout.write(
             self.style.SUCCESS(
                 f'Import completed!\n'
@@ -1,15 +1,19 @@
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
-from main.models import Photo, UserPhoto
-from main.services import PhotoService
-import os
-from PIL import Image
-import io
+
+from main.image_pipeline import get_modern_formats, get_srcset_specs
+from main.photo_batch import TASKS, init_worker, process_chunk
 
 
 class Command(BaseCommand):
-    help = 'Optimize existing photos and create thumbnails'
+    help = 'Optimize existing photos: thumbnails, user photos, modern formats, srcset renditions and perceptual hashes'
+
+    CHECKPOINT_KEY = 'optimize_photos_checkpoint_{task}'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -19,151 +23,122 @@ class Command(BaseCommand):
         )
         parser.add_argument(
             '--type',
-            choices=['announcement', 'user', 'all'],
+            choices=['announcement', 'user', 'formats', 'sizes', 'hashes', 'all'],
             default='all',
             help='Type of photos to optimize',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes (default: 1 — in this process)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=50,
+            help='Photos per chunk sent to a worker and written with one bulk_update (default: 50)',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore saved progress and start from the first photo',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         photo_type = options['type']
-        
+
         if dry_run:
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
-        
-        if photo_type in ['announcement', 'all']:
-            self.optimize_announcement_photos(dry_run)
-        
-        if photo_type in ['user', 'all']:
-            self.optimize_user_photos(dry_run)
-
-    def optimize_announcement_photos(self, dry_run=False):
-        """Optimize announcement photos"""
-        self.stdout.write('Optimizing announcement photos...')
-        
-        photos = Photo.objects.filter(thumbnail_path__isnull=True)
-        total = photos.count()
-        
-        if total == 0:
-            self.stdout.write(self.style.SUCCESS('No announcement photos to optimize'))
-            return
-        
-        self.stdout.write(f'Found {total} announcement photos to optimize')
-        
-        for i, photo in enumerate(photos, 1):
-            self.stdout.write(f'Processing {i}/{total}: {photo.file_name}')
-            
-            if dry_run:
+
+        task_names = list(TASKS) if photo_type == 'all' else [photo_type]
+        for task_name in task_names:
+            if task_name == 'formats' and not get_modern_formats():
+                self.stdout.write(self.style.WARNING('No modern formats are configured or supported by Pillow'))
                 continue
-                
-            try:
-                # Check if file exists
-                if not default_storage.exists(photo.file_path):
-                    self.stdout.write(self.style.ERROR(f'File not found: {photo.file_path}'))
-                    continue
-                
-                # Open original file
-                with default_storage.open(photo.file_path, 'rb') as f:
-                    file_content = f.read()
-                
-                # Create thumbnail
-                img_bytes = io.BytesIO(file_content)
-                thumbnail_img, thumbnail_size = PhotoService._create_thumbnail(img_bytes)
-                
-                # Generate thumbnail filename
-                base_name = os.path.splitext(photo.file_name)[0]
-                thumbnail_filename = f"{base_name}_thumb.jpg"
-                thumbnail_path = f"announcement_photos/thumbnails/{thumbnail_filename}"
-                
-                # Save thumbnail
-                saved_thumbnail_path = default_storage.save(
-                    thumbnail_path, 
-                    ContentFile(thumbnail_img.read())
-                )
-                
-                # Update photo record
-                photo.thumbnail_path = saved_thumbnail_path
-                photo.thumbnail_size = thumbnail_size
-                photo.save()
-                
-                self.stdout.write(self.style.SUCCESS(f'✓ Optimized: {photo.file_name}'))
-                
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'✗ Error processing {photo.file_name}: {str(e)}'))
-        
-        self.stdout.write(self.style.SUCCESS('Announcement photos optimization completed'))
-
-    def optimize_user_photos(self, dry_run=False):
-        """Optimize user photos"""
-        self.stdout.write('Optimizing user photos...')
-        
-        photos = UserPhoto.objects.all()
-        total = photos.count()
-        
+            if task_name == 'sizes' and not get_srcset_specs():
+                self.stdout.write(self.style.WARNING('SRCSET_WIDTHS is not configured'))
+                continue
+            self.run_task(task_name, options)
+
+    def run_task(self, task_name, options):
+        """Обрабатывает фото задачи порциями, сохраняя прогресс после каждой порции"""
+        task = TASKS[task_name]
+        checkpoint_key = self.CHECKPOINT_KEY.format(task=task_name)
+        self.stdout.write(f'Optimizing {task.description}...')
+
+        if options['restart']:
+            cache.delete(checkpoint_key)
+        last_id = cache.get(checkpoint_key, 0)
+        if last_id:
+            self.stdout.write(f'Resuming after photo id {last_id} (use --restart to start over)')
+
+        total = task.queryset().filter(pk__gt=last_id).count()
         if total == 0:
-            self.stdout.write(self.style.SUCCESS('No user photos to optimize'))
+            self.stdout.write(self.style.SUCCESS(f'No {task.description} to optimize'))
+            cache.delete(checkpoint_key)
             return
-        
-        self.stdout.write(f'Found {total} user photos to optimize')
-        
-        for i, photo in enumerate(photos, 1):
-            self.stdout.write(f'Processing {i}/{total}: {photo.file_name}')
-            
-            if dry_run:
-                continue
-                
-            try:
-                # Check if file exists
-                if not default_storage.exists(photo.file_path):
-                    self.stdout.write(self.style.ERROR(f'File not found: {photo.file_path}'))
-                    continue
-                
-                # Open original file
-                with default_storage.open(photo.file_path, 'rb') as f:
-                    file_content = f.read()
-                
-                # Re-optimize user photo if it's not JPEG or too large
-                img_bytes = io.BytesIO(file_content)
-                img = Image.open(img_bytes)
-                
-                # Check if needs optimization
-                needs_optimization = (
-                    img.format != 'JPEG' or 
-                    img.width > 800 or 
-                    img.height > 800 or
-                    len(file_content) > 500000  # 500KB
-                )
-                
-                if needs_optimization:
-                    # Re-optimize
-                    img_bytes.seek(0)
-                    optimized_img, optimized_size = PhotoService._optimize_image(
-                        img_bytes, max_width=800, max_height=800, quality=90
-                    )
-                    
-                    # Save optimized image
-                    new_filename = f"{os.path.splitext(photo.file_name)[0]}.jpg"
-                    new_path = f"user_photos/{new_filename}"
-                    
-                    # Remove old file
-                    if default_storage.exists(photo.file_path):
-                        default_storage.delete(photo.file_path)
-                    
-                    # Save new file
-                    saved_path = default_storage.save(new_path, ContentFile(optimized_img.read()))
-                    
-                    # Update photo record
-                    photo.file_path = saved_path
-                    photo.file_name = new_filename
-                    photo.file_size = optimized_size
-                    photo.mime_type = 'image/jpeg'
-                    photo.save()
-                    
-                    self.stdout.write(self.style.SUCCESS(f'✓ Optimized: {photo.file_name}'))
-                else:
-                    self.stdout.write(f'- Already optimized: {photo.file_name}')
-                
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'✗ Error processing {photo.file_name}: {str(e)}'))
-        
-        self.stdout.write(self.style.SUCCESS('User photos optimization completed')) 
\ No newline at end of file
+
+        self.stdout.write(f'Found {total} photos')
+        if options['dry_run']:
+            return
+
+        stats = {'count': 0, 'changed': 0, 'errors': 0, 'bytes': 0}
+        started = time.monotonic()
+        chunks = self.iter_chunks(task, last_id, options['chunk_size'])
+
+        def apply(chunk_last_id, result):
+            if result['changed']:
+                task.apply(result['changed'])
+            for photo_id, file_name, error in result['errors']:
+                self.stdout.write(self.style.ERROR(f'✗ Error processing {file_name} (id {photo_id}): {error}'))
+            # Порции применяются в порядке id, поэтому все фото до chunk_last_id обработаны
+            cache.set(checkpoint_key, chunk_last_id, None)
+            for key in ('count', 'bytes'):
+                stats[key] += result[key]
+            stats['changed'] += len(result['changed'])
+            stats['errors'] += len(result['errors'])
+            self.stdout.write(f'Processed {stats["count"]}/{total}')
+
+        if options['workers'] > 1:
+            # spawn: процессы пула не наследуют соединения с БД и не пишут в нее
+            with ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker
+            ) as executor:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append((chunk[-1].pk, executor.submit(process_chunk, task_name, chunk)))
+                    # Не больше двух порций на процесс в памяти
+                    if len(pending) >= options['workers'] * 2:
+                        chunk_last_id, future = pending.popleft()
+                        apply(chunk_last_id, future.result())
+                while pending:
+                    chunk_last_id, future = pending.popleft()
+                    apply(chunk_last_id, future.result())
+        else:
+            for chunk in chunks:
+                apply(chunk[-1].pk, process_chunk(task_name, chunk))
+
+        cache.delete(checkpoint_key)
+        self.print_throughput(task, stats, time.monotonic() - started)
+
+    def iter_chunks(self, task, last_id, chunk_size):
+        """Порции фото по возрастанию id (keyset), без загрузки всей выборки"""
+        queryset = task.queryset().order_by('pk')
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_id)[:chunk_size])
+            if not chunk:
+                return
+            last_id = chunk[-1].pk
+            yield chunk
+
+    def print_throughput(self, task, stats, elapsed):
+        elapsed = max(elapsed, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f'{task.description.capitalize()} completed: {stats["count"]} photos '
+            f'({stats["changed"]} changed, {stats["errors"]} errors) in {elapsed:.1f} s — '
+            f'{stats["count"] / elapsed:.1f} images/s, {stats["bytes"] / elapsed / 1024 / 1024:.2f} MB/s'
+        ))
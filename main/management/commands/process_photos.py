@@ -0,0 +1,83 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from main.image_pipeline import get_pipeline_stats
+from main.models import Photo
+from main.photo_queue import photo_queue
+from main.services import PhotoService
+
+
+class Command(BaseCommand):
+    help = 'Process queued announcement photos (status pending) and create their renditions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process the current queue and exit instead of polling',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of queued photos fetched per query (default: 50)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=2.0,
+            help='Seconds to wait when the queue is empty (default: 2)',
+        )
+
+    def handle(self, *args, **options):
+        processed = 0
+        failed = 0
+
+        while True:
+            photo_ids = self.get_queued_ids(options['batch_size'])
+            if not photo_ids:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            for photo_id in photo_ids:
+                if PhotoService.process_photo(photo_id):
+                    processed += 1
+                    self.stdout.write(f'✓ Photo {photo_id} is ready')
+                else:
+                    # Фото захвачено другим обработчиком, удалено или обработка не удалась
+                    failed += 1
+
+            if options['once'] and len(photo_ids) < options['batch_size']:
+                break
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Processed: {processed}, skipped or failed: {failed}')
+        )
+        self.print_pipeline_stats()
+
+    def get_queued_ids(self, limit):
+        """Фото в статусе pending и зависшие в processing дольше STALE_AFTER"""
+        stale_before = timezone.now() - timedelta(seconds=photo_queue.config['STALE_AFTER'])
+        return list(
+            Photo.objects.filter(
+                Q(status=Photo.STATUS_PENDING) |
+                Q(status=Photo.STATUS_PROCESSING, processing_started_at__lt=stale_before)
+            ).order_by('id').values_list('id', flat=True)[:limit]
+        )
+
+    def print_pipeline_stats(self):
+        """Время этапов обработки изображений в этом процессе"""
+        stats = get_pipeline_stats()
+        if not stats['images']:
+            return
+        stages = ', '.join(f'{stage} {ms / stats["images"]:.1f}' for stage, ms in stats['stages_ms'].items())
+        self.stdout.write(
+            f'Pipeline: {stats["images"]} images, {stats["total_ms"] / stats["images"]:.1f} ms/image '
+            f'({stages}); decoded {stats["decoded_ratio"]:.0%} of source pixels'
+        )
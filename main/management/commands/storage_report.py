@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.utils import STORAGE_REPORT_TIMEOUT, format_file_size, get_storage_report
+
+
+class Command(BaseCommand):
+    help = 'Show photo storage usage: totals, renditions and users with the most photo data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--refresh',
+            action='store_true',
+            help=f'Recalculate instead of using the cached report (cached for {STORAGE_REPORT_TIMEOUT} s)',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=20,
+            help='Number of users in the breakdown (default: 20)',
+        )
+
+    def handle(self, *args, **options):
+        report = get_storage_report(refresh=options['refresh'], users_limit=options['users'])
+        self.stdout.write(f'Storage report generated at {timezone.localtime(report["generated_at"]):%Y-%m-%d %H:%M:%S}')
+
+        announcement = report['photos']['announcement_photos']
+        user = report['photos']['user_photos']
+        stored = report['stored']
+        self.stdout.write(self.style.SUCCESS('\nPhotos'))
+        self.stdout.write(
+            f'  Announcement photos: {announcement["count"]} '
+            f'({announcement["pending_count"]} not processed), '
+            f'{format_file_size(announcement["total_size"])}, '
+            f'average {format_file_size(announcement["average_size"])}'
+        )
+        self.stdout.write(
+            f'  Stored files: {stored["files"]}, '
+            f'{format_file_size(stored["size"] + stored["thumbnails_size"])} with thumbnails '
+            f'(photos with identical content share files)'
+        )
+        self.stdout.write(
+            f'  User photos: {user["count"]}, {format_file_size(user["total_size"])}, '
+            f'average {format_file_size(user["average_size"])}'
+        )
+
+        self.stdout.write(self.style.SUCCESS('\nRenditions'))
+        for rendition in report['renditions']:
+            self.stdout.write(
+                f'  {rendition["name"]:<14} {rendition["count"]:>8}  {format_file_size(rendition["total_size"] or 0)}'
+            )
+
+        self.stdout.write(self.style.SUCCESS('\nUsers'))
+        for row in report['users']:
+            self.stdout.write(
+                f'  {row["name"] or row["user_id"]:<30} {row["photos"]:>6} photos  '
+                f'{format_file_size(row["total_size"])} '
+                f'(photos {format_file_size(row["photos_size"])}, '
+                f'thumbnails {format_file_size(row["thumbnails_size"])}, '
+                f'srcset {format_file_size(row["renditions_size"])}, '
+                f'profile {format_file_size(row["user_photos_size"])})'
+            )
+
+        savings = report['savings']
+        self.stdout.write(self.style.SUCCESS('\nOptimization'))
+        self.stdout.write(
+            f'  Estimated without optimization: {savings["formatted_estimated"]}, '
+            f'actual: {savings["formatted_actual"]}, '
+            f'saved: {savings["formatted_savings"]} ({savings["savings_percent"]:.1f}%)'
+        )
@@ -0,0 +1,218 @@
+"""
+Раздача загруженных фото (announcement_photos/, user_photos/) из MEDIA_ROOT.
+
+django.conf.urls.static работает только в DEBUG и не отдает заголовков
+кэширования — одни и те же фото скачивались заново на каждой странице.
+serve_media():
+
+- файлы с хэшем содержимого в имени (PhotoService.get_storage_key:
+  "<sha256[:40]>-<подпись настроек>[_thumb|_640w].jpg") никогда не меняются:
+  ETag — хэш из имени, Cache-Control: immutable на год;
+- остальные файлы (старые имена uuid) — ETag по mtime и размеру, MAX_AGE;
+- If-None-Match / If-Modified-Since -> 304 (django.utils.cache.get_conditional_response);
+- Range: bytes=... для одного диапазона -> 206, If-Range учитывается;
+  синтаксически неверный Range игнорируется (200 с полным файлом);
+- полный файл и диапазон — FileResponse: WSGI-сервер отдает его через
+  wsgi.file_wrapper (в gunicorn — sendfile без копирования в Python; для
+  диапазона файл уже спозиционирован, длина — Content-Length). С ACCEL_REDIRECT файл
+  отдает nginx (X-Accel-Redirect), view только проверяет запрос и ставит заголовки.
+
+Исходники фото в очереди обработки (announcement_photos/originals/) не
+отдаются: они еще не уменьшены и могут содержать EXIF с координатами.
+
+Настройки — settings.MEDIA_SERVING.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.urls import re_path
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .image_pipeline import MIME_TYPES
+
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    # Кэширование файлов без хэша в имени, сек.
+    'MAX_AGE': 24 * 60 * 60,
+    'IMMUTABLE_MAX_AGE': 365 * 24 * 60 * 60,
+    # Префикс internal location nginx (например '/protected-media/'): файл отдает nginx
+    'ACCEL_REDIRECT': None,
+}
+
+SERVED_DIRS = ('announcement_photos', 'user_photos')
+PRIVATE_DIRS = ('announcement_photos/originals',)
+
+# Имя файла, построенное по хэшу содержимого
+HASHED_NAME = re.compile(r'^[0-9a-f]{40}-[0-9a-f]{8}(?:_thumb|_\d+w)?$')
+
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_config():
+    return {**DEFAULT_CONFIG, **getattr(settings, 'MEDIA_SERVING', {})}
+
+
+def media_urlpatterns():
+    """URL раздачи фото под MEDIA_URL; пусто, если MEDIA_SERVING['ENABLED'] выключен"""
+    if not get_config()['ENABLED']:
+        return []
+    prefix = re.escape(settings.MEDIA_URL.lstrip('/'))
+    dirs = '|'.join(re.escape(name) for name in SERVED_DIRS)
+    return [
+        re_path(rf'^{prefix}(?P<path>(?:{dirs})/.+)$', serve_media, name='media'),
+    ]
+
+
+@require_safe
+def serve_media(request, path):
+    """Фото из MEDIA_ROOT с ETag, условными запросами и диапазонами"""
+    media_root = os.fspath(settings.MEDIA_ROOT)
+    try:
+        full_path = safe_join(media_root, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    # Проверяется нормализованный путь: "announcement_photos/x/../originals/..." тоже закрыт
+    path = os.path.relpath(full_path, media_root).replace(os.sep, '/')
+    if not path.startswith(tuple(f'{name}/' for name in SERVED_DIRS)):
+        raise Http404
+    if path.startswith(tuple(f'{name}/' for name in PRIVATE_DIRS)):
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    config = get_config()
+    stem, extension = os.path.splitext(os.path.basename(path))
+    if HASHED_NAME.match(stem):
+        etag = f'"{stem}"'
+        cache_control = f"public, max-age={config['IMMUTABLE_MAX_AGE']}, immutable"
+    else:
+        etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+        cache_control = f"public, max-age={config['MAX_AGE']}"
+    last_modified = int(stat.st_mtime)
+
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        # 304 / 412: заголовки кэширования нужны и в ответе без тела
+        for header, value in headers.items():
+            conditional[header] = value
+        return conditional
+
+    image_format = extension.lstrip('.').lower()
+    content_type = MIME_TYPES.get('jpeg' if image_format == 'jpg' else image_format)
+    if content_type is None:
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    if config['ACCEL_REDIRECT']:
+        # Range, sendfile и Content-Length обрабатывает nginx
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f"{config['ACCEL_REDIRECT'].rstrip('/')}/{path}"
+        return _with_headers(response, headers)
+
+    byte_range = _parse_range(request, stat.st_size, etag, last_modified)
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return _with_headers(response, headers)
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = str(stat.st_size)
+        return _with_headers(response, headers)
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        return _with_headers(response, headers)
+
+    start, end = byte_range
+    response = FileResponse(
+        RangeFile(open(full_path, 'rb'), start, end - start + 1), status=206, content_type=content_type
+    )
+    response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Content-Length'] = str(end - start + 1)
+    return _with_headers(response, headers)
+
+
+def _with_headers(response, headers):
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def _parse_range(request, size, etag, last_modified):
+    """
+    (start, end) включительно для заголовка Range с одним диапазоном,
+    None — отдать файл целиком, 'unsatisfiable' — 416 (диапазон начинается за
+    концом файла). Несколько диапазонов и неверный Range (например bytes=5-3)
+    игнорируются, как требует RFC 9110, — файл отдается целиком.
+    """
+    header = request.headers.get('Range')
+    if not header or size == 0:
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        # Файл изменился с тех пор, как клиент получил начало
+        return None
+
+    match = RANGE_HEADER.match(header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # bytes=-500: последние 500 байт
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+class RangeFile:
+    """
+    Открытый файл, спозиционированный на начало диапазона и читаемый не дальше
+    length байт. fileno() оставлен, чтобы wsgi.file_wrapper мог использовать
+    sendfile с текущей позиции и Content-Length ответа.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
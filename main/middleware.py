@@ -4,11 +4,14 @@ from django.contrib import messages
 from django.utils.deprecation import MiddlewareMixin
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-from .models import UserActivity, UserSession
-from django.db import transaction, connection
+from django.conf import settings
+from .services import UserSessionService
+from .utils import log_user_activity
+from django.db import connection
 from django.http import HttpResponseRedirect
 import json
 import logging
+import time
 import psycopg2
 
 User = get_user_model()
@@ -101,6 +104,10 @@ class UserActivityMiddleware(MiddlewareMixin):
         # Сохраняем время начала запроса
         request._activity_start_time = timezone.now()
         
+        # Фото (main.media) не читают сессию: иначе в ответе Vary: Cookie и общие кэши их не хранят
+        if request.path.startswith(settings.MEDIA_URL):
+            return None
+        
         # Получаем информацию о пользователе
         if hasattr(request, 'user') and request.user.is_authenticated:
             # Логируем просмотр страницы только для GET запросов
@@ -149,23 +156,14 @@ class UserActivityMiddleware(MiddlewareMixin):
         if page_type:
             metadata['page_type'] = page_type
         
-        # Создаем запись об активности
-        try:
-            with transaction.atomic():
-                UserActivity.objects.create(
-                    user=request.user,
-                    action_type='view_page',
-                    description=f"Просмотр страницы {request.path}",
-                    metadata=metadata if metadata else None,
-                    ip_address=self.get_client_ip(request),
-                    user_agent=request.META.get('HTTP_USER_AGENT', ''),
-                    session_key=request.session.session_key,
-                    page_url=request.build_absolute_uri(),
-                    referrer=request.META.get('HTTP_REFERER', ''),
-                    is_successful=True
-                )
-        except Exception as e:
-            logger.error(f"Ошибка при создании записи об активности: {e}")
+        # Запись ставится в очередь и сохраняется в фоне, запрос не ждет базу
+        log_user_activity(
+            user=request.user,
+            action_type='view_page',
+            description=f"Просмотр страницы {request.path}",
+            metadata=metadata if metadata else None,
+            request=request,
+        )
     
     def get_page_type(self, path):
         """Определяет тип страницы по URL"""
@@ -213,35 +211,43 @@ class UserActivityMiddleware(MiddlewareMixin):
 
 
 class UserSessionMiddleware(MiddlewareMixin):
-    """Middleware для отслеживания сессий пользователей"""
+    """
+    Middleware для отслеживания сессий пользователей.
+    
+    Последняя активность (UserSession.last_activity) и срок сессии обновляются
+    не чаще раза в SESSION_TRACKING['ACTIVITY_INTERVAL'] секунд. Время последней
+    отметки хранится в самой сессии, поэтому запросы между отметками не пишут
+    ни в user_sessions, ни в django_session.
+    """
+    
+    TRACKED_AT_SESSION_KEY = '_activity_tracked_at'
     
     def process_request(self, request):
         """Обработка входящих запросов для отслеживания сессий"""
-        if hasattr(request, 'user') and request.user.is_authenticated:
-            session_key = request.session.session_key
-            
-            if session_key:
-                try:
-                    # Получаем или создаем сессию
-                    session, created = UserSession.objects.get_or_create(
-                        user=request.user,
-                        session_key=session_key,
-                        defaults={
-                            'login_time': timezone.now(),
-                        }
-                    )
-                    
-                    # Если сессия уже существует, обновляем время последней активности
-                    if not created:
-                        # Продлеваем сессию при активности пользователя
-                        request.session.set_expiry(432000)  # 5 дней
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке сессии: {e}")
-            
-            # Продлеваем сессию при любой активности аутентифицированного пользователя
-            if request.user.is_authenticated:
-                request.session.set_expiry(432000)  # 5 дней
+        if request.path.startswith(settings.MEDIA_URL):
+            return None
+        if not (hasattr(request, 'user') and request.user.is_authenticated):
+            return None
+        
+        session_key = request.session.session_key
+        if not session_key:
+            return None
+        
+        interval = getattr(settings, 'SESSION_TRACKING', {}).get('ACTIVITY_INTERVAL', 300)
+        tracked_at = request.session.get(self.TRACKED_AT_SESSION_KEY)
+        now = time.time()
+        if tracked_at is not None and now - tracked_at < interval:
+            return None
+        
+        try:
+            UserSessionService.track_activity(
+                request.user, session_key, first_seen=tracked_at is None
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при обработке сессии: {e}")
+        
+        # Изменение сессии сохраняет ее и продлевает срок на SESSION_COOKIE_AGE (5 дней)
+        request.session[self.TRACKED_AT_SESSION_KEY] = now
         
         return None
 
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_alter_announcement_building_type_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='useractivity',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Время'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_useractivity_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='main_photo_path',
+            field=models.CharField(blank=True, max_length=500, null=True, verbose_name='Main Photo Path'),
+        ),
+        migrations.AddField(
+            model_name='announcement',
+            name='main_thumbnail_path',
+            field=models.CharField(blank=True, max_length=500, null=True, verbose_name='Main Photo Thumbnail Path'),
+        ),
+    ]
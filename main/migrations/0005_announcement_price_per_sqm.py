@@ -0,0 +1,43 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:48
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def fill_price_per_sqm(apps, schema_editor):
+    """Заполняет price_per_sqm для существующих объявлений"""
+    Announcement = apps.get_model('main', 'Announcement')
+
+    batch = []
+    for announcement in Announcement.objects.only('id', 'price', 'area').iterator(chunk_size=BATCH_SIZE):
+        if announcement.price is None or not announcement.area:
+            continue
+        announcement.price_per_sqm = int(
+            (Decimal(announcement.price) / Decimal(announcement.area)).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+        )
+        batch.append(announcement)
+        if len(batch) >= BATCH_SIZE:
+            Announcement.objects.bulk_update(batch, ['price_per_sqm'])
+            batch = []
+    if batch:
+        Announcement.objects.bulk_update(batch, ['price_per_sqm'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_announcement_main_photo_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='price_per_sqm',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='Price per sq.m'),
+        ),
+        migrations.RunPython(fill_price_per_sqm, migrations.RunPython.noop),
+    ]
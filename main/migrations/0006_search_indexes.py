@@ -0,0 +1,53 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_announcement_price_per_sqm'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['microdistrict'], name='address_microdistrict_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['complex_name'], name='address_complex_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('is_archived', False)), fields=['-created_at', '-id'], name='ann_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('is_archived', False)), fields=['rooms_count', 'price'], name='ann_active_rooms_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('is_archived', False)), fields=['price'], name='ann_active_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('is_archived', False)), fields=['area'], name='ann_active_area_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('is_archived', False)), fields=['building_type', '-created_at'], name='ann_active_building_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('is_archived', False), ('is_new_building', True)), fields=['-created_at'], name='ann_active_new_building_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('commission_type', 'buyer'), ('is_archived', False)), fields=['-created_at'], name='ann_active_buyer_comm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['user', 'is_archived', '-created_at'], name='ann_user_archived_created_idx'),
+        ),
+    ]
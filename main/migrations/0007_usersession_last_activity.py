@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersession',
+            name='last_activity',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last Activity'),
+        ),
+    ]
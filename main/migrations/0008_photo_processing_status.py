@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_usersession_last_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='processing_attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Processing Attempts'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Processing Started At'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='source_path',
+            field=models.CharField(blank=True, max_length=500, null=True, verbose_name='Source Path'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает обработки'), ('processing', 'Обрабатывается'), ('ready', 'Готово'), ('failed', 'Ошибка обработки')], db_index=True, default='ready', max_length=20, verbose_name='Processing Status'),
+        ),
+    ]
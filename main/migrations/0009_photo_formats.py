@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_photo_processing_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='main_photo_formats',
+            field=models.CharField(blank=True, max_length=50, null=True, verbose_name='Main Photo Formats'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='formats',
+            field=models.CharField(blank=True, default='', max_length=50, verbose_name='Extra Formats'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_photo_formats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Height'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Width'),
+        ),
+        migrations.CreateModel(
+            name='PhotoRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveIntegerField(verbose_name='Width')),
+                ('height', models.PositiveIntegerField(verbose_name='Height')),
+                ('format', models.CharField(default='jpeg', max_length=10, verbose_name='Format')),
+                ('file_path', models.CharField(max_length=500, verbose_name='File Path')),
+                ('file_size', models.BigIntegerField(verbose_name='File Size')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='main.photo', verbose_name='Photo')),
+            ],
+            options={
+                'verbose_name': 'Photo Rendition',
+                'verbose_name_plural': 'Photo Renditions',
+                'db_table': 'photo_renditions',
+                'ordering': ['width'],
+                'unique_together': {('photo', 'width', 'format')},
+            },
+        ),
+    ]
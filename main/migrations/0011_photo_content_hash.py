@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_photo_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='Content Hash'),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='file_path',
+            field=models.CharField(db_index=True, max_length=500, verbose_name='File Path'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_photo_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='dhash',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Perceptual Hash'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='dhash_0',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Perceptual Hash Segment 0'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='dhash_1',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Perceptual Hash Segment 1'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='dhash_2',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Perceptual Hash Segment 2'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='dhash_3',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Perceptual Hash Segment 3'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['dhash_0'], name='photo_dhash_0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['dhash_1'], name='photo_dhash_1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['dhash_2'], name='photo_dhash_2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['dhash_3'], name='photo_dhash_3_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_photo_dhash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='photo',
+            name='thumbnail_path',
+            field=models.CharField(blank=True, db_index=True, max_length=500, null=True, verbose_name='Thumbnail Path'),
+        ),
+        migrations.AlterField(
+            model_name='photorendition',
+            name='file_path',
+            field=models.CharField(db_index=True, max_length=500, verbose_name='File Path'),
+        ),
+        migrations.AlterField(
+            model_name='userphoto',
+            name='file_path',
+            field=models.CharField(db_index=True, max_length=500, verbose_name='File Path'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:25
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_media_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255, verbose_name='File Name')),
+                ('content_type', models.CharField(max_length=100, verbose_name='Content Type')),
+                ('size', models.BigIntegerField(verbose_name='Size')),
+                ('received', models.BigIntegerField(default=0, verbose_name='Received')),
+                ('checksum', models.CharField(blank=True, default='', max_length=64, verbose_name='Checksum')),
+                ('content_hash', models.CharField(blank=True, max_length=64, null=True, verbose_name='Content Hash')),
+                ('status', models.CharField(choices=[('uploading', 'Загружается'), ('complete', 'Загружено')], default='uploading', max_length=20, verbose_name='Status')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True, verbose_name='Updated At')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photo_uploads', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Photo Upload',
+                'verbose_name_plural': 'Photo Uploads',
+                'db_table': 'photo_uploads',
+            },
+        ),
+    ]
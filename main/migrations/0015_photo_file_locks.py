@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_photo_uploads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoFileLock',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Storage Key')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='Locked At')),
+            ],
+            options={
+                'verbose_name': 'Photo File Lock',
+                'verbose_name_plural': 'Photo File Locks',
+                'db_table': 'photo_file_locks',
+            },
+        ),
+    ]
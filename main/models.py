@@ -1,7 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.validators import RegexValidator
-from decimal import Decimal
+from django.utils import timezone
+from django.utils.functional import cached_property
+from decimal import Decimal, ROUND_HALF_UP
+import uuid
 
 
 class UserManager(BaseUserManager):
@@ -172,6 +175,12 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.phone})"
 
+    @cached_property
+    def profile_photo_path(self):
+        """Путь главного фото профиля, иначе первого загруженного (None — нет фото)"""
+        # PhoneAuthBackend заполняет значение при загрузке пользователя
+        return self.photos.order_by('-is_main', 'id').values_list('file_path', flat=True).first()
+
 
 class UserPhoto(models.Model):
     """User photos model"""
@@ -182,7 +191,8 @@ class UserPhoto(models.Model):
         verbose_name="User"
     )
     file_name = models.CharField(max_length=255, verbose_name="File Name")
-    file_path = models.CharField(max_length=500, verbose_name="File Path")
+    # Индексы путей файлов — для поиска ссылок на файлы (manage.py cleanup_media)
+    file_path = models.CharField(max_length=500, db_index=True, verbose_name="File Path")
     file_size = models.BigIntegerField(verbose_name="File Size")
     mime_type = models.CharField(max_length=100, verbose_name="MIME Type")
     original_name = models.CharField(max_length=255, verbose_name="Original Name")
@@ -223,6 +233,11 @@ class Address(models.Model):
         verbose_name = "Address"
         verbose_name_plural = "Addresses"
         db_table = "addresses"
+        indexes = [
+            # Фильтры поиска address__microdistrict / address__complex_name
+            models.Index(fields=['microdistrict'], name='address_microdistrict_idx'),
+            models.Index(fields=['complex_name'], name='address_complex_name_idx'),
+        ]
 
     def __str__(self):
         parts = [self.microdistrict, self.complex_name, self.street, self.building_no]
@@ -281,6 +296,14 @@ class Announcement(models.Model):
     floor = models.SmallIntegerField(blank=True, null=True, verbose_name="Floor")
     total_floors = models.SmallIntegerField(blank=True, null=True, verbose_name="Total Floors")
     area = models.DecimalField(max_digits=8, decimal_places=2, verbose_name="Area (sq.m)")
+    # Цена за м² в тенге (округленная), пересчитывается в save() — для фильтра по индексу
+    price_per_sqm = models.BigIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+        db_index=True,
+        verbose_name="Price per sq.m"
+    )
     description = models.TextField(blank=True, null=True, verbose_name="Description")
     
     # Опорные точки (множественный выбор)
@@ -301,7 +324,13 @@ class Announcement(models.Model):
     commission_percentage = models.IntegerField(blank=True, null=True, verbose_name="Commission Percentage")
     commission_amount = models.IntegerField(blank=True, null=True, verbose_name="Commission Amount")
     commission_bonus = models.IntegerField(blank=True, null=True, verbose_name="Commission Bonus")
-    
+
+    # Денормализованная ссылка на главное фото (поддерживается PhotoService),
+    # чтобы карточки в списках не запрашивали фотографии
+    main_photo_path = models.CharField(max_length=500, blank=True, null=True, verbose_name="Main Photo Path")
+    main_thumbnail_path = models.CharField(max_length=500, blank=True, null=True, verbose_name="Main Photo Thumbnail Path")
+    main_photo_formats = models.CharField(max_length=50, blank=True, null=True, verbose_name="Main Photo Formats")
+
     is_archived = models.BooleanField(default=False, verbose_name="Is Archived")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
@@ -311,13 +340,87 @@ class Announcement(models.Model):
         verbose_name_plural = "Announcements"
         db_table = "announcements"
         ordering = ['-created_at']
+        # Индексы подобраны под фильтры списка объявлений (filter_params в
+        # UserActivity): список всегда фильтрует is_archived=False и сортирует
+        # по -created_at, поэтому большинство индексов частичные — только активные.
+        # Проверка планов: manage.py explain_search_filters
+        indexes = [
+            # Лента без фильтров и keyset-пагинация по (created_at, id)
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='ann_active_created_idx',
+                condition=models.Q(is_archived=False),
+            ),
+            # Комнаты + диапазон цены — самая частая комбинация
+            models.Index(
+                fields=['rooms_count', 'price'],
+                name='ann_active_rooms_price_idx',
+                condition=models.Q(is_archived=False),
+            ),
+            models.Index(
+                fields=['price'],
+                name='ann_active_price_idx',
+                condition=models.Q(is_archived=False),
+            ),
+            models.Index(
+                fields=['area'],
+                name='ann_active_area_idx',
+                condition=models.Q(is_archived=False),
+            ),
+            models.Index(
+                fields=['building_type', '-created_at'],
+                name='ann_active_building_idx',
+                condition=models.Q(is_archived=False),
+            ),
+            # Чекбоксы "только новостройки" и "только с доплатой партнеру"
+            models.Index(
+                fields=['-created_at'],
+                name='ann_active_new_building_idx',
+                condition=models.Q(is_archived=False, is_new_building=True),
+            ),
+            models.Index(
+                fields=['-created_at'],
+                name='ann_active_buyer_comm_idx',
+                condition=models.Q(is_archived=False, commission_type='buyer'),
+            ),
+            # Объявления пользователя в личном кабинете
+            models.Index(
+                fields=['user', 'is_archived', '-created_at'],
+                name='ann_user_archived_created_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.rooms_count}-room apartment - {self.price}"
 
+    @staticmethod
+    def calculate_price_per_sqm(price, area):
+        """Цена за м², округленная до тенге; None, если площадь не задана"""
+        if price is None or not area:
+            return None
+        return int((Decimal(price) / Decimal(area)).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+    def save(self, *args, **kwargs):
+        self.price_per_sqm = self.calculate_price_per_sqm(self.price, self.area)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'price', 'area'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'price_per_sqm'}
+        super().save(*args, **kwargs)
+
 
 class Photo(models.Model):
     """Listing photos model"""
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает обработки'),
+        (STATUS_PROCESSING, 'Обрабатывается'),
+        (STATUS_READY, 'Готово'),
+        (STATUS_FAILED, 'Ошибка обработки'),
+    ]
+
     announcement = models.ForeignKey(
         Announcement, 
         on_delete=models.CASCADE, 
@@ -325,7 +428,9 @@ class Photo(models.Model):
         verbose_name="Announcement"
     )
     file_name = models.CharField(max_length=255, verbose_name="File Name")
-    file_path = models.CharField(max_length=500, verbose_name="File Path")
+    # Файлы фото с одинаковым содержимым общие (имена по хэшу, см. content_hash):
+    # индекс для подсчета ссылок при удалении
+    file_path = models.CharField(max_length=500, db_index=True, verbose_name="File Path")
     file_size = models.BigIntegerField(verbose_name="File Size")
     mime_type = models.CharField(max_length=100, verbose_name="MIME Type")
     original_name = models.CharField(max_length=255, verbose_name="Original Name")
@@ -333,17 +438,153 @@ class Photo(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name="Uploaded At")
     
     # Thumbnail fields
-    thumbnail_path = models.CharField(max_length=500, blank=True, null=True, verbose_name="Thumbnail Path")
+    thumbnail_path = models.CharField(max_length=500, blank=True, null=True, db_index=True, verbose_name="Thumbnail Path")
     thumbnail_size = models.BigIntegerField(blank=True, null=True, verbose_name="Thumbnail Size")
 
+    # Размер file_path в пикселях — последняя ширина в srcset (см. PhotoRendition)
+    width = models.PositiveIntegerField(blank=True, null=True, verbose_name="Width")
+    height = models.PositiveIntegerField(blank=True, null=True, verbose_name="Height")
+
+    # Форматы, в которых есть и фото, и миниатюра, кроме JPEG ("avif,webp"):
+    # файлы лежат рядом с file_path/thumbnail_path с другим расширением
+    formats = models.CharField(max_length=50, blank=True, default='', verbose_name="Extra Formats")
+
+    # Фоновая обработка: загрузка сохраняется как есть (source_path), версии
+    # создаются очередью (PhotoService.process_photo), до этого — заглушка в шаблонах
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_READY,
+        db_index=True,
+        verbose_name="Processing Status"
+    )
+    source_path = models.CharField(max_length=500, blank=True, null=True, verbose_name="Source Path")
+    # SHA-256 загруженного файла: повторная загрузка тех же байтов использует готовые файлы
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True, verbose_name="Content Hash")
+    # Перцептивный хэш (dHash) для поиска дубликатов объявлений (main.duplicates):
+    # 64 бита со знаком и те же биты четырьмя 16-битными сегментами с индексами
+    dhash = models.BigIntegerField(blank=True, null=True, verbose_name="Perceptual Hash")
+    dhash_0 = models.PositiveIntegerField(blank=True, null=True, verbose_name="Perceptual Hash Segment 0")
+    dhash_1 = models.PositiveIntegerField(blank=True, null=True, verbose_name="Perceptual Hash Segment 1")
+    dhash_2 = models.PositiveIntegerField(blank=True, null=True, verbose_name="Perceptual Hash Segment 2")
+    dhash_3 = models.PositiveIntegerField(blank=True, null=True, verbose_name="Perceptual Hash Segment 3")
+    processing_started_at = models.DateTimeField(blank=True, null=True, verbose_name="Processing Started At")
+    processing_attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Processing Attempts")
+
     class Meta:
         verbose_name = "Photo"
         verbose_name_plural = "Photos"
         db_table = "photos"
+        indexes = [
+            models.Index(fields=['dhash_0'], name='photo_dhash_0_idx'),
+            models.Index(fields=['dhash_1'], name='photo_dhash_1_idx'),
+            models.Index(fields=['dhash_2'], name='photo_dhash_2_idx'),
+            models.Index(fields=['dhash_3'], name='photo_dhash_3_idx'),
+        ]
 
     def __str__(self):
         return f"Photo for {self.announcement} - {self.file_name}"
 
+    @property
+    def is_ready(self):
+        return self.status == self.STATUS_READY
+
+
+class PhotoRendition(models.Model):
+    """Уменьшенные копии фото объявления для srcset (ширины SRCSET_WIDTHS)"""
+    photo = models.ForeignKey(
+        Photo,
+        on_delete=models.CASCADE,
+        related_name='renditions',
+        verbose_name="Photo"
+    )
+    width = models.PositiveIntegerField(verbose_name="Width")
+    height = models.PositiveIntegerField(verbose_name="Height")
+    format = models.CharField(max_length=10, default='jpeg', verbose_name="Format")
+    # Файлы копий общие у фото с одинаковым содержимым: индекс для подсчета ссылок
+    file_path = models.CharField(max_length=500, db_index=True, verbose_name="File Path")
+    file_size = models.BigIntegerField(verbose_name="File Size")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    class Meta:
+        verbose_name = "Photo Rendition"
+        verbose_name_plural = "Photo Renditions"
+        db_table = "photo_renditions"
+        unique_together = ['photo', 'width', 'format']
+        ordering = ['width']
+
+    def __str__(self):
+        return f"{self.photo} - {self.width}w {self.format}"
+
+
+class PhotoFileLock(models.Model):
+    """
+    Блокировка файлов фото с одним ключом хранения (PhotoService.get_storage_key).
+    Файлы общие у фото с одинаковым содержимым: проверка ссылок перед удалением
+    и повторное использование файлов выполняются под блокировкой строки ключа
+    (PhotoService.lock_storage_key), иначе удаление могло бы пройти между
+    проверкой и созданием нового фото, ссылающегося на те же файлы.
+    """
+    key = models.CharField(max_length=100, primary_key=True, verbose_name="Storage Key")
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="Locked At")
+
+    class Meta:
+        verbose_name = "Photo File Lock"
+        verbose_name_plural = "Photo File Locks"
+        db_table = "photo_file_locks"
+
+    def __str__(self):
+        return self.key
+
+
+class PhotoUpload(models.Model):
+    """
+    Загрузка фото объявления частями (PhotoUploadService): файл собирается во
+    временном файле на диске, форма объявления отправляет id готовых загрузок.
+    """
+    STATUS_UPLOADING = 'uploading'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_UPLOADING, 'Загружается'),
+        (STATUS_COMPLETE, 'Загружено'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='photo_uploads',
+        verbose_name="User"
+    )
+    file_name = models.CharField(max_length=255, verbose_name="File Name")
+    content_type = models.CharField(max_length=100, verbose_name="Content Type")
+    size = models.BigIntegerField(verbose_name="Size")
+    # Сколько байт от начала файла получено — с этого места продолжается загрузка
+    received = models.BigIntegerField(default=0, verbose_name="Received")
+    # SHA-256 всего файла от клиента (необязательно) и посчитанный после загрузки
+    checksum = models.CharField(max_length=64, blank=True, default='', verbose_name="Checksum")
+    content_hash = models.CharField(max_length=64, blank=True, null=True, verbose_name="Content Hash")
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_UPLOADING,
+        verbose_name="Status"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Updated At")
+
+    class Meta:
+        verbose_name = "Photo Upload"
+        verbose_name_plural = "Photo Uploads"
+        db_table = "photo_uploads"
+
+    def __str__(self):
+        return f"{self.file_name} ({self.received}/{self.size})"
+
+    @property
+    def is_complete(self):
+        return self.status == self.STATUS_COMPLETE
+
 
 class Collection(models.Model):
     """Collection of listings model"""
@@ -451,6 +692,8 @@ class UserSession(models.Model):
     login_time = models.DateTimeField(verbose_name="Login Time")
     logout_time = models.DateTimeField(blank=True, null=True, verbose_name="Logout Time")
     duration = models.DurationField(blank=True, null=True, verbose_name="Duration")
+    # Обновляется не чаще раза в SESSION_TRACKING['ACTIVITY_INTERVAL'] секунд
+    last_activity = models.DateTimeField(blank=True, null=True, verbose_name="Last Activity")
 
     class Meta:
         verbose_name = "User Session"
@@ -570,8 +813,8 @@ class UserActivity(models.Model):
         verbose_name="Связанная коллекция"
     )
     
-    # Время и сессия
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Время")
+    # Время и сессия (время действия, а не момента фоновой записи в базу)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Время")
     session_key = models.CharField(
         max_length=40, 
         blank=True, 
@@ -0,0 +1,186 @@
+"""
+Keyset-пагинация (по курсору) для списка объявлений.
+
+Страница выбирается условием по ключу сортировки (created_at, id), а не
+через OFFSET, поэтому N-я страница стоит столько же, сколько первая, и не
+требует COUNT(*) по всей выборке. Курсоры непрозрачны для клиента:
+это base64 от позиции последней/первой записи страницы и направления.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+
+
+NEXT = 'next'
+PREVIOUS = 'prev'
+LAST_PAGE_CURSOR = 'last'
+
+# Сколько секунд хранится оценка количества при заданном total_cache_key
+ESTIMATE_CACHE_TIMEOUT = 300
+
+
+def encode_cursor(created_at, pk, direction=NEXT):
+    """Кодирует позицию (created_at, id) и направление в непрозрачный токен"""
+    payload = json.dumps([created_at.isoformat(), pk, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Декодирует токен курсора.
+    Возвращает (created_at, id, direction) или None для пустого/битого токена.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, pk, direction = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if direction not in (NEXT, PREVIOUS):
+            return None
+        return datetime.fromisoformat(created_at), int(pk), direction
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        return None
+
+
+def estimate_count(queryset):
+    """
+    Приблизительное количество строк по оценке планировщика PostgreSQL.
+    Для других СУБД возвращает None — точный COUNT(*) здесь не делаем намеренно.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    try:
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception:
+        return None
+
+
+class KeysetPage:
+    """Страница keyset-пагинации (аналог django.core.paginator.Page)"""
+
+    def __init__(self, object_list, has_next, has_previous,
+                 next_cursor=None, previous_cursor=None, approximate_total=None):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.approximate_total = approximate_total
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    """
+    Пагинатор по ключу (created_at, id) в порядке убывания.
+
+    Каждая страница — один запрос с LIMIT per_page + 1: лишняя строка
+    говорит о наличии следующей страницы в выбранном направлении.
+    С total_cache_key оценка количества (EXPLAIN) кэшируется и не
+    запрашивается заново на каждой странице той же выборки.
+    """
+
+    ordering = ('-created_at', '-id')
+    reverse_ordering = ('created_at', 'id')
+
+    def __init__(self, queryset, per_page, approximate_total=False, total_cache_key=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.approximate_total = approximate_total
+        self.total_cache_key = total_cache_key
+
+    def page(self, cursor=None):
+        """Возвращает KeysetPage для токена курсора (None — первая страница)"""
+        limit = self.per_page + 1
+
+        if cursor == LAST_PAGE_CURSOR:
+            rows = self._fetch(None, PREVIOUS, limit)
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_next = False
+        else:
+            position = decode_cursor(cursor)
+            if position is None:
+                rows = self._fetch(None, NEXT, limit)
+                has_next = len(rows) > self.per_page
+                rows = rows[:self.per_page]
+                has_previous = False
+            else:
+                created_at, pk, direction = position
+                rows = self._fetch((created_at, pk), direction, limit)
+                if direction == NEXT:
+                    has_next = len(rows) > self.per_page
+                    rows = rows[:self.per_page]
+                    has_previous = True
+                else:
+                    has_previous = len(rows) > self.per_page
+                    rows = rows[:self.per_page][::-1]
+                    has_next = True
+
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].pk, NEXT) if has_next and rows else None
+        previous_cursor = encode_cursor(rows[0].created_at, rows[0].pk, PREVIOUS) if has_previous and rows else None
+
+        return KeysetPage(
+            rows,
+            has_next=bool(next_cursor),
+            has_previous=bool(previous_cursor),
+            next_cursor=next_cursor,
+            previous_cursor=previous_cursor,
+            approximate_total=self._total() if self.approximate_total else None,
+        )
+
+    def _fetch(self, position, direction, limit):
+        """
+        До limit строк после позиции (created_at, id): по убыванию для NEXT,
+        по возрастанию для PREVIOUS. position=None — от начала/конца выборки.
+        """
+        # Результат in-memory поиска (main.search_engine) считает окно сам
+        if hasattr(self.queryset, 'keyset_window'):
+            return self.queryset.keyset_window(position, direction, limit)
+
+        queryset = self.queryset
+        if direction == NEXT:
+            if position is not None:
+                created_at, pk = position
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+            return list(queryset.order_by(*self.ordering)[:limit])
+
+        if position is not None:
+            created_at, pk = position
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+        return list(queryset.order_by(*self.reverse_ordering)[:limit])
+
+    def _total(self):
+        """Количество строк: точное для результата in-memory поиска, иначе оценка"""
+        if hasattr(self.queryset, 'keyset_window'):
+            return len(self.queryset)
+        if self.total_cache_key is None:
+            return estimate_count(self.queryset)
+        total = cache.get(self.total_cache_key)
+        if total is None:
+            total = estimate_count(self.queryset)
+            if total is not None:
+                cache.set(self.total_cache_key, total, ESTIMATE_CACHE_TIMEOUT)
+        return total
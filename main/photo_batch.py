@@ -0,0 +1,264 @@
+"""
+Пакетная обработка уже загруженных фото (manage.py optimize_photos).
+
+Задачи (TASKS):
+
+- announcement — миниатюры для фото объявлений без thumbnail_path;
+- user — пережатие больших и не-JPEG фото пользователей;
+- formats — копии в современных форматах (IMAGE_OPTIMIZATION['MODERN_FORMATS']);
+- sizes — ширины для srcset (PhotoRendition);
+- hashes — перцептивный хэш для поиска дубликатов (main.duplicates).
+
+process_chunk() работает только с файлами, поэтому порции фото можно
+обрабатывать в отдельных процессах (ProcessPoolExecutor с контекстом spawn:
+процессы не наследуют соединения с БД родителя). Результаты порции
+записываются в основном процессе одним bulk_update — Task.apply().
+"""
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+
+class Task:
+    """Задача обработки: выборка фото, обработка одного фото, запись порции"""
+    name = None
+    description = None
+
+    @staticmethod
+    def queryset():
+        raise NotImplementedError
+
+    @staticmethod
+    def process(photo):
+        """Обрабатывает файлы фото и меняет поля объекта. Возвращает True, если фото изменено"""
+        raise NotImplementedError
+
+    @staticmethod
+    def apply(photos):
+        """Сохраняет измененные фото порции в БД"""
+        raise NotImplementedError
+
+
+class ThumbnailTask(Task):
+    name = 'announcement'
+    description = 'announcement photo thumbnails'
+
+    @staticmethod
+    def queryset():
+        from .models import Photo
+
+        # Фото в очереди обработки получат миниатюру от process_photo
+        return Photo.objects.filter(status=Photo.STATUS_READY, thumbnail_path__isnull=True).only(
+            'id', 'announcement_id', 'file_name', 'file_path'
+        )
+
+    @staticmethod
+    def process(photo):
+        from .services import PhotoService
+
+        with default_storage.open(photo.file_path, 'rb') as source:
+            thumbnail_img, thumbnail_size = PhotoService._create_thumbnail(source)
+        base_name = os.path.splitext(photo.file_name)[0]
+        photo.thumbnail_path = default_storage.save(
+            f"announcement_photos/thumbnails/{base_name}_thumb.jpg", ContentFile(thumbnail_img.read())
+        )
+        photo.thumbnail_size = thumbnail_size
+        return True
+
+    @staticmethod
+    def apply(photos):
+        from .models import Announcement, Photo
+        from .services import PhotoService
+
+        Photo.objects.bulk_update(photos, ['thumbnail_path', 'thumbnail_size'])
+        # Миниатюра главного фото денормализована в объявлении
+        PhotoService.refresh_announcement_main_photos(
+            Announcement.objects.filter(pk__in={photo.announcement_id for photo in photos})
+        )
+
+
+class UserPhotoTask(Task):
+    name = 'user'
+    description = 'user photos'
+
+    # Фото пользователя пережимается, если оно не JPEG, больше MAX_SIZE или MAX_BYTES
+    MAX_SIZE = 800
+    MAX_BYTES = 500000
+
+    @staticmethod
+    def queryset():
+        from .models import UserPhoto
+
+        return UserPhoto.objects.only('id', 'user_id', 'file_name', 'file_path')
+
+    @staticmethod
+    def process(photo):
+        from PIL import Image
+
+        from .services import PhotoService
+
+        max_size = UserPhotoTask.MAX_SIZE
+        with default_storage.open(photo.file_path, 'rb') as source:
+            # Image.open читает только заголовок
+            img = Image.open(source)
+            needs_optimization = (
+                img.format != 'JPEG' or
+                img.width > max_size or
+                img.height > max_size or
+                source.size > UserPhotoTask.MAX_BYTES
+            )
+            if not needs_optimization:
+                return False
+            source.seek(0)
+            optimized_img, optimized_size = PhotoService._optimize_image(
+                source, max_width=max_size, max_height=max_size, quality=90
+            )
+
+        # Старый файл удаляется в apply() после записи нового пути в БД
+        photo.replaced_path = photo.file_path
+        photo.file_path = default_storage.save(
+            f"user_photos/{os.path.splitext(photo.file_name)[0]}.jpg", ContentFile(optimized_img.read())
+        )
+        photo.file_name = os.path.basename(photo.file_path)
+        photo.file_size = optimized_size
+        photo.mime_type = 'image/jpeg'
+        return True
+
+    @staticmethod
+    def apply(photos):
+        from .auth_backends import invalidate_cached_users
+        from .models import UserPhoto
+
+        with transaction.atomic():
+            UserPhoto.objects.bulk_update(photos, ['file_path', 'file_name', 'file_size', 'mime_type'])
+            # bulk_update не отправляет сигналы — путь фото профиля закэширован в снимке пользователя
+            invalidate_cached_users({photo.user_id for photo in photos})
+        for photo in photos:
+            default_storage.delete(photo.replaced_path)
+
+
+class FormatsTask(Task):
+    name = 'formats'
+    description = 'modern format copies'
+
+    @staticmethod
+    def queryset():
+        from .image_pipeline import get_modern_formats
+        from .models import Photo
+
+        return Photo.objects.filter(status=Photo.STATUS_READY).exclude(
+            formats=','.join(get_modern_formats())
+        ).only('id', 'announcement_id', 'file_name', 'file_path', 'thumbnail_path', 'formats')
+
+    @staticmethod
+    def process(photo):
+        from .services import PhotoService
+
+        formats = PhotoService.render_alternate_formats(photo)
+        if formats == photo.formats:
+            return False
+        photo.formats = formats
+        return True
+
+    @staticmethod
+    def apply(photos):
+        from .models import Announcement, Photo
+        from .services import PhotoService
+
+        Photo.objects.bulk_update(photos, ['formats'])
+        PhotoService.refresh_announcement_main_photos(
+            Announcement.objects.filter(pk__in={photo.announcement_id for photo in photos})
+        )
+
+
+class SizesTask(Task):
+    name = 'sizes'
+    description = 'srcset renditions'
+
+    @staticmethod
+    def queryset():
+        from .models import Photo
+
+        # width заполняется вместе с копиями, поэтому обработанные фото не выбираются повторно
+        return Photo.objects.filter(status=Photo.STATUS_READY, width__isnull=True).only(
+            'id', 'file_name', 'file_path', 'formats'
+        )
+
+    @staticmethod
+    def process(photo):
+        from .services import PhotoService
+
+        PhotoService.render_photo_renditions(photo)
+        return True
+
+    @staticmethod
+    def apply(photos):
+        from .services import PhotoService
+
+        PhotoService.replace_photo_renditions(photos)
+
+
+class HashTask(Task):
+    name = 'hashes'
+    description = 'perceptual hashes'
+
+    @staticmethod
+    def queryset():
+        from .models import Photo
+
+        return Photo.objects.filter(status=Photo.STATUS_READY, dhash__isnull=True).only(
+            'id', 'file_name', 'file_path', 'thumbnail_path'
+        )
+
+    @staticmethod
+    def process(photo):
+        from PIL import Image, ImageOps
+
+        from .duplicates import dhash, hash_fields
+
+        # Миниатюра дает тот же хэш, что и полное фото, а декодируется в разы быстрее
+        with default_storage.open(photo.thumbnail_path or photo.file_path, 'rb') as source:
+            img = Image.open(source)
+            img.draft('L', (64, 64))
+            for field_name, value in hash_fields(dhash(ImageOps.exif_transpose(img))).items():
+                setattr(photo, field_name, value)
+        return True
+
+    @staticmethod
+    def apply(photos):
+        from .duplicates import SEGMENT_FIELDS
+        from .models import Photo
+
+        Photo.objects.bulk_update(photos, ['dhash', *SEGMENT_FIELDS])
+
+
+TASKS = {task.name: task for task in (ThumbnailTask, UserPhotoTask, FormatsTask, SizesTask, HashTask)}
+
+
+def init_worker():
+    """Инициализация процесса пула (контекст spawn)"""
+    import django
+
+    django.setup()
+
+
+def process_chunk(task_name, photos):
+    """
+    Обрабатывает порцию фото без обращений к БД.
+    Возвращает {'changed': [фото], 'errors': [(id, имя файла, ошибка)], 'count', 'bytes'}.
+    """
+    task = TASKS[task_name]
+    changed = []
+    errors = []
+    read_bytes = 0
+    for photo in photos:
+        try:
+            # size() заодно проверяет, что файл существует
+            read_bytes += default_storage.size(photo.file_path)
+            if task.process(photo):
+                changed.append(photo)
+        except Exception as e:
+            errors.append((photo.pk, photo.file_name, str(e)))
+    return {'changed': changed, 'errors': errors, 'count': len(photos), 'bytes': read_bytes}
@@ -0,0 +1,88 @@
+"""
+Очередь обработки фотографий объявлений.
+
+Загрузка сохраняется как есть, а фото создается со статусом 'pending' —
+это и есть очередь в БД. Обработку (PhotoService.process_photo) выполняет:
+
+- 'background' — пул потоков текущего процесса сразу после коммита
+  транзакции (Pillow отпускает GIL при декодировании и сжатии);
+- 'queue' — только отдельный воркер: manage.py process_photos;
+- 'inline' — синхронно в запросе, как раньше.
+
+Фото захватывается одним условным UPDATE, поэтому пул потоков и воркер
+process_photos могут работать одновременно. Оставшиеся после перезапуска
+фото ('pending' или зависшие 'processing') дообрабатывает process_photos.
+
+Настройки — settings.PHOTO_PROCESSING.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'MODE': 'background',
+    'WORKERS': 2,
+    'MAX_ATTEMPTS': 3,
+    'STALE_AFTER': 600,
+}
+
+
+class PhotoQueue:
+    """Пул потоков для фоновой обработки фото в процессе веб-сервера"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @property
+    def config(self):
+        """Настройки очереди с учетом значений по умолчанию"""
+        return {**DEFAULT_CONFIG, **getattr(settings, 'PHOTO_PROCESSING', {})}
+
+    @property
+    def mode(self):
+        return self.config['MODE']
+
+    def enqueue(self, photo_id):
+        """Ставит фото в обработку после коммита текущей транзакции"""
+        if self.mode != 'background':
+            # 'queue': фото дождется воркера process_photos в статусе pending
+            return
+        transaction.on_commit(lambda: self._get_executor().submit(self._run, photo_id))
+
+    def _get_executor(self):
+        """Пул создается заново после fork воркера gunicorn"""
+        pid = os.getpid()
+        if self._executor is not None and self._pid == pid:
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != pid:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config['WORKERS'],
+                    thread_name_prefix='photo-processing',
+                )
+                self._pid = pid
+            return self._executor
+
+    @staticmethod
+    def _run(photo_id):
+        from .services import PhotoService
+
+        close_old_connections()
+        try:
+            PhotoService.process_photo(photo_id)
+        except Exception:
+            logger.exception(f"Ошибка фоновой обработки фото {photo_id}")
+        finally:
+            close_old_connections()
+
+
+photo_queue = PhotoQueue()
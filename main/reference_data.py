@@ -0,0 +1,131 @@
+"""
+Реестр справочников: микрорайоны, ЖК, типы ремонта и домов, опорные точки,
+агентства.
+
+Все справочники загружаются одним проходом в неизменяемый снимок в памяти
+процесса (кортежи объектов в порядке отображения, индексы по id и имени,
+списки choices). Формы отображаются и валидируются по снимку без запросов к БД.
+
+Снимок привязан к версии в общем кэше (REFERENCE_DATA_VERSION_KEY). Версия
+меняется при сохранении/удалении справочников (сигналы — админка, формы) и
+после команд импорта; каждый процесс при следующем обращении перечитывает
+справочники.
+"""
+import re
+import threading
+import uuid
+from types import MappingProxyType
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+REFERENCE_DATA_VERSION_KEY = 'reference_data_version'
+
+CYRILLIC_RE = re.compile(r'^[А-Яа-я]')
+
+
+class ReferenceTable:
+    """Неизменяемый справочник: объекты в порядке отображения, индексы по id и имени"""
+
+    def __init__(self, objects):
+        self.objects = tuple(objects)
+        self.by_id = MappingProxyType({obj.pk: obj for obj in self.objects})
+        # При совпадении имен остается первый объект в порядке отображения
+        by_name = {}
+        for obj in self.objects:
+            by_name.setdefault(obj.name, obj)
+        self.by_name = MappingProxyType(by_name)
+        self.names = tuple(by_name)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def get(self, pk):
+        """Объект по id или None"""
+        try:
+            return self.by_id.get(int(pk))
+        except (TypeError, ValueError):
+            return None
+
+    def get_by_name(self, name):
+        """Объект по названию или None"""
+        return self.by_name.get(name)
+
+    def choices(self, empty_label):
+        """Choices по названиям для форм поиска"""
+        return [('', empty_label)] + [(name, name) for name in self.names]
+
+
+class ReferenceData:
+    """Снимок всех справочников одной версии"""
+
+    def __init__(self, version):
+        from .models import (
+            Agency, BuildingType, Landmark, Microdistrict, RepairType, ResidentialComplex
+        )
+
+        self.version = version
+        self.microdistricts = ReferenceTable(
+            Microdistrict.objects.filter(is_active=True).order_by('name')
+        )
+        # ЖК: сначала русские названия (А-Я), потом английские (A-Z)
+        self.residential_complexes = ReferenceTable(sorted(
+            ResidentialComplex.objects.filter(is_active=True),
+            key=lambda obj: (0 if CYRILLIC_RE.match(obj.name) else 1, obj.name)
+        ))
+        self.repair_types = ReferenceTable(
+            RepairType.objects.filter(is_active=True).order_by('name')
+        )
+        # Типы домов: "иной" вверху, остальные по алфавиту
+        self.building_types = ReferenceTable(sorted(
+            BuildingType.objects.filter(is_active=True),
+            key=lambda obj: (0 if obj.name.lower() == 'иной' else 1, obj.name)
+        ))
+        self.landmarks = ReferenceTable(Landmark.objects.order_by('name'))
+        self.agencies = ReferenceTable(Agency.objects.order_by('name'))
+
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+def get_current_version():
+    """Версия справочников в общем кэше; создается, если ключ отсутствует"""
+    version = cache.get(REFERENCE_DATA_VERSION_KEY)
+    if version is None:
+        cache.add(REFERENCE_DATA_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(REFERENCE_DATA_VERSION_KEY)
+    return version
+
+
+def get_reference_data():
+    """Актуальный снимок справочников; перечитывается при смене версии"""
+    global _snapshot
+
+    version = get_current_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = ReferenceData(version)
+        return _snapshot
+
+
+def bump_reference_data_version():
+    """
+    Помечает справочники измененными для всех процессов. Внутри транзакции
+    версия меняется после коммита, чтобы не закэшировать старые данные.
+    """
+    def bump():
+        global _snapshot
+        # Случайная версия, а не счетчик: вытесненный из кэша ключ не вернет старое значение
+        cache.set(REFERENCE_DATA_VERSION_KEY, uuid.uuid4().hex, None)
+        _snapshot = None
+
+    transaction.on_commit(bump)
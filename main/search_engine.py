@@ -0,0 +1,549 @@
+"""
+In-memory поисковый движок для активных объявлений (необязательный).
+
+Активные объявления хранятся в памяти процесса колонками NumPy,
+отсортированными по (created_at, id) по убыванию, опорные точки — битовыми
+масками. Фильтры SearchForm вычисляются векторно, а из БД загружаются только
+объявления текущей страницы (см. SearchResult).
+
+Актуальность данных: сигналы (main.signals) увеличивают поколение объявлений
+(listings generation) в кэше — по нему же инвалидируются кэш результатов
+поиска и фасетов. При изменении поколения или раз в SYNC_INTERVAL секунд движок дочитывает из БД
+только объявления с updated_at позже последней синхронизации минус SYNC_OVERLAP
+(запас на долгие транзакции; уже примененные строки не сливаются повторно); удаленные
+объявления передаются через список в кэше. Раз в REBUILD_INTERVAL секунд
+колонки перестраиваются целиком.
+
+Включается settings.SEARCH_ENGINE['BACKEND'] = 'memory'. Без NumPy или при
+BACKEND = 'database' поиск выполняется в БД, как раньше.
+"""
+import bisect
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:  # NumPy — необязательная зависимость
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'BACKEND': 'database',
+    'SYNC_INTERVAL': 5.0,
+    'REBUILD_INTERVAL': 900.0,
+    # Запас при дочитывании по updated_at, сек.: updated_at ставится в начале
+    # транзакции, а видна строка только после коммита — значение должно быть
+    # не меньше самой долгой транзакции, меняющей объявления
+    'SYNC_OVERLAP': 300.0,
+}
+
+GENERATION_CACHE_KEY = 'listings_generation'
+DELETED_CACHE_KEY = 'search_engine_deleted'
+DELETED_KEEP = 1000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+ROW_FIELDS = (
+    'id', 'is_archived', 'created_at', 'rooms_count', 'price', 'price_per_sqm',
+    'area', 'floor', 'total_floors', 'year_built', 'is_new_building',
+    'commission_type', 'building_type', 'user_id',
+    'address__microdistrict', 'address__complex_name', 'user__agency_id',
+)
+
+# Строковые поля храним кодами; коды только добавляются и стабильны
+CATEGORY_FIELDS = ('building_type', 'microdistrict', 'complex_name')
+
+# Диапазонные фильтры SearchForm: ключ -> (колонка, оператор)
+RANGE_FILTERS = {
+    'price_from': ('price', 'gte'),
+    'price_to': ('price', 'lte'),
+    'price_per_sqm_from': ('price_per_sqm', 'gte'),
+    'price_per_sqm_to': ('price_per_sqm', 'lte'),
+    'year_built_from': ('year_built', 'gte'),
+    'year_built_to': ('year_built', 'lte'),
+    'area_from': ('area', 'gte'),
+    'area_to': ('area', 'lte'),
+    'floor_from': ('floor', 'gte'),
+    'floor_to': ('floor', 'lte'),
+}
+
+SUPPORTED_FILTERS = set(RANGE_FILTERS) | set(CATEGORY_FIELDS) | {
+    'rooms_count', 'not_first_floor', 'not_last_floor', 'is_new_building',
+    'agency_only', 'agency', 'landmarks',
+}
+
+
+def to_timestamp(value):
+    """datetime -> целое число микросекунд (без потери точности float)"""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def get_listings_generation():
+    """Текущее поколение объявлений — часть ключей кэша поиска"""
+    return cache.get(GENERATION_CACHE_KEY) or 0
+
+
+def mark_changed(deleted_ids=None):
+    """
+    Увеличивает поколение объявлений после создания, изменения, архивации
+    или удаления. Удаленные id передаются in-memory движкам всех процессов.
+    Внутри транзакции поколение меняется после коммита: иначе параллельный
+    запрос закэширует еще старые результаты уже под новым поколением.
+    """
+    deleted_ids = list(deleted_ids or ())
+
+    def bump():
+        if deleted_ids and search_engine.enabled:
+            deleted = cache.get(DELETED_CACHE_KEY) or []
+            cache.set(DELETED_CACHE_KEY, (deleted + deleted_ids)[-DELETED_KEEP:], None)
+        try:
+            cache.incr(GENERATION_CACHE_KEY)
+        except ValueError:
+            cache.set(GENERATION_CACHE_KEY, 1, None)
+
+    transaction.on_commit(bump)
+
+
+def mark_users_changed(user_ids):
+    """
+    Агентство пользователей изменилось: их объявления отмечаются измененными,
+    чтобы in-memory индекс перечитал колонку agency_id.
+    """
+    from .models import Announcement
+
+    if search_engine.enabled:
+        Announcement.objects.filter(user_id__in=list(user_ids)).update(updated_at=timezone.now())
+    mark_changed()
+
+
+class ColumnStore:
+    """Неизменяемый снимок колонок; каждое обновление создает новый снимок"""
+
+    def __init__(self, columns, landmark_bits):
+        self.columns = columns
+        self.landmark_bits = landmark_bits
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+
+class SearchResult:
+    """
+    Упорядоченный по (created_at, id) убыванию список id найденных объявлений.
+
+    ids и created — массивы NumPy или обычные списки (кэш результатов поиска).
+    Ведет себя как object_list для Paginator (count(), срезы) и поддерживает
+    keyset_window() для KeysetPaginator. Объявления загружаются из БД только
+    для запрошенного среза.
+    """
+
+    ordered = True
+
+    def __init__(self, queryset, ids, created):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.ids = ids
+        self.created = created
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.hydrate(self.ids[key])
+        return self.hydrate(self.ids[key:key + 1 or None])[0]
+
+    def hydrate(self, ids):
+        """Загружает объявления по id одним запросом, сохраняя порядок"""
+        ids = [int(pk) for pk in ids]
+        if not ids:
+            return []
+        objects = self.queryset.filter(pk__in=ids).in_bulk()
+        # Удаленные после последней синхронизации объявления пропускаются
+        return [objects[pk] for pk in ids if pk in objects]
+
+    def keyset_window(self, position, direction, limit):
+        """
+        Окно для keyset-пагинации в том же порядке, что вернул бы запрос к БД:
+        по убыванию для direction='next', по возрастанию для 'prev'.
+        position — (created_at, id) или None (с начала/конца списка).
+        """
+        from .pagination import NEXT
+
+        if position is None:
+            start = end = None
+        else:
+            created_at, pk = position
+            # Список отсортирован по убыванию (created, id) — ищем по обратному ключу
+            def key(index):
+                return (-int(self.created[index]), -int(self.ids[index]))
+
+            indexes = range(len(self.ids))
+            target = (-to_timestamp(created_at), -pk)
+            start = bisect.bisect_right(indexes, target, key=key)
+            end = bisect.bisect_left(indexes, target, key=key)
+
+        if direction == NEXT:
+            begin = start or 0
+            return self.hydrate(self.ids[begin:begin + limit])
+        end = len(self.ids) if end is None else end
+        return self.hydrate(self.ids[max(end - limit, 0):end][::-1])
+
+
+class SearchEngine:
+    """Колоночный индекс активных объявлений процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._store = None
+        self._version = None
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        self._synced_until = None
+        self._codes = {field: {} for field in CATEGORY_FIELDS}
+        self._landmark_bits = {}
+        self._deleted_seen = set()
+        # id -> updated_at строк, уже примененных в пределах SYNC_OVERLAP
+        self._applied = {}
+        self._warned = False
+
+    @property
+    def config(self):
+        """Настройки движка с учетом значений по умолчанию"""
+        return {**DEFAULT_CONFIG, **getattr(settings, 'SEARCH_ENGINE', {})}
+
+    @property
+    def enabled(self):
+        if self.config['BACKEND'] != 'memory':
+            return False
+        if np is None:
+            if not self._warned:
+                logger.warning("SEARCH_ENGINE BACKEND='memory', но NumPy не установлен — поиск выполняется в БД")
+                self._warned = True
+            return False
+        return True
+
+    def search(self, queryset, filters):
+        """
+        Возвращает SearchResult для фильтров SearchForm или None, если движок
+        выключен или фильтры не поддерживаются (тогда поиск выполняется в БД).
+        """
+        if not self.enabled:
+            return None
+        if any(value and key not in SUPPORTED_FILTERS for key, value in filters.items()):
+            return None
+        try:
+            store = self._get_store()
+            mask = self._evaluate(store, filters)
+        except Exception as e:
+            logger.error(f"Ошибка in-memory поиска, используется БД: {e}")
+            return None
+        return SearchResult(queryset, store.columns['id'][mask], store.columns['created'][mask])
+
+    def facet_counts(self, filters):
+        """
+        Количество результатов по значениям фасетов (см.
+        AnnouncementService.get_facet_counts) или None, если движок выключен.
+        """
+        if not self.enabled:
+            return None
+        if any(value and key not in SUPPORTED_FILTERS for key, value in filters.items()):
+            return None
+        try:
+            store = self._get_store()
+            return self._facet_counts(store, filters)
+        except Exception as e:
+            logger.error(f"Ошибка подсчета фасетов в памяти, используется БД: {e}")
+            return None
+
+    def stats(self):
+        """Размер индекса и состояние синхронизации для мониторинга"""
+        store = self._store
+        return {
+            'enabled': self.enabled,
+            'rows': len(store) if store is not None else 0,
+            'version': self._version,
+            'landmark_bits': len(self._landmark_bits),
+            'synced_until': self._synced_until,
+        }
+
+    # Синхронизация
+
+    def _get_store(self):
+        config = self.config
+        now = time.monotonic()
+
+        if self._store is None or now - self._built_at > config['REBUILD_INTERVAL']:
+            # Первая загрузка ждет; плановую перестройку делает один поток
+            blocking = self._store is None
+            if self._lock.acquire(blocking=blocking):
+                try:
+                    if self._store is None or now - self._built_at > config['REBUILD_INTERVAL']:
+                        self._rebuild()
+                finally:
+                    self._lock.release()
+            return self._store
+
+        if now - self._checked_at > config['SYNC_INTERVAL'] or cache.get(GENERATION_CACHE_KEY) != self._version:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._sync(config)
+                finally:
+                    self._lock.release()
+        return self._store
+
+    def _rebuild(self):
+        """Полная загрузка активных объявлений"""
+        from .models import Announcement
+
+        started = time.monotonic()
+        version = cache.get(GENERATION_CACHE_KEY)
+        synced_until = timezone.now()
+        since = synced_until - timedelta(seconds=self.config['SYNC_OVERLAP'])
+        rows = []
+        applied = {}
+        for *row, updated_at in Announcement.objects.filter(
+            is_archived=False
+        ).values_list(*ROW_FIELDS, 'updated_at'):
+            rows.append(tuple(row))
+            # Строки окна SYNC_OVERLAP уже загружены — первая синхронизация их не сливает
+            if updated_at >= since:
+                applied[row[0]] = updated_at
+        pairs = Announcement.landmarks.through.objects.filter(
+            announcement__is_archived=False
+        ).values_list('announcement_id', 'landmark_id')
+
+        self._store = self._merge(None, rows, self._group_landmarks(pairs), ())
+        self._deleted_seen = set(cache.get(DELETED_CACHE_KEY) or [])
+        self._applied = applied
+        self._version = version
+        self._synced_until = synced_until
+        self._built_at = self._checked_at = time.monotonic()
+        logger.info(
+            f"Поисковый индекс перестроен: {len(self._store)} объявлений "
+            f"за {time.monotonic() - started:.2f} с"
+        )
+
+    def _sync(self, config):
+        """Дочитывает объявления, измененные после последней синхронизации"""
+        from .models import Announcement
+
+        version = cache.get(GENERATION_CACHE_KEY)
+        synced_until = timezone.now()
+        since = self._synced_until - timedelta(seconds=config['SYNC_OVERLAP'])
+
+        # Строки окна, уже примененные с тем же updated_at, повторно не сливаются
+        rows = []
+        for *row, updated_at in Announcement.objects.filter(
+            updated_at__gte=since
+        ).values_list(*ROW_FIELDS, 'updated_at'):
+            if self._applied.get(row[0]) != updated_at:
+                self._applied[row[0]] = updated_at
+                rows.append(tuple(row))
+        self._applied = {pk: value for pk, value in self._applied.items() if value >= since}
+        deleted = cache.get(DELETED_CACHE_KEY) or []
+        removed = [row[0] for row in rows] + [pk for pk in deleted if pk not in self._deleted_seen]
+        active_rows = [row for row in rows if not row[1]]
+
+        if removed:
+            pairs = Announcement.landmarks.through.objects.filter(
+                announcement_id__in=[row[0] for row in active_rows]
+            ).values_list('announcement_id', 'landmark_id')
+            self._store = self._merge(self._store, active_rows, self._group_landmarks(pairs), removed)
+
+        self._deleted_seen = set(deleted)
+        self._version = version
+        self._synced_until = synced_until
+        self._checked_at = time.monotonic()
+
+    # Построение колонок
+
+    @staticmethod
+    def _group_landmarks(pairs):
+        landmarks = {}
+        for announcement_id, landmark_id in pairs:
+            landmarks.setdefault(announcement_id, []).append(landmark_id)
+        return landmarks
+
+    def _code(self, field, value):
+        if value is None:
+            return -1
+        codes = self._codes[field]
+        if value not in codes:
+            codes[value] = len(codes)
+        return codes[value]
+
+    def _landmark_words(self):
+        return max(1, (len(self._landmark_bits) + 63) // 64)
+
+    def _columns_from_rows(self, rows, landmarks):
+        """Колонки NumPy из строк values_list(*ROW_FIELDS)"""
+        nan = float('nan')
+
+        def nullable(value):
+            return nan if value is None else float(value)
+
+        for announcement_id in landmarks:
+            for landmark_id in landmarks[announcement_id]:
+                if landmark_id not in self._landmark_bits:
+                    self._landmark_bits[landmark_id] = len(self._landmark_bits)
+
+        columns = {
+            'id': np.array([row[0] for row in rows], dtype=np.int64),
+            'created': np.array([to_timestamp(row[2]) for row in rows], dtype=np.int64),
+            'rooms_count': np.array([row[3] for row in rows], dtype=np.int16),
+            'price': np.array([row[4] for row in rows], dtype=np.int64),
+            'price_per_sqm': np.array([nullable(row[5]) for row in rows], dtype=np.float64),
+            'area': np.array([nullable(row[6]) for row in rows], dtype=np.float64),
+            'floor': np.array([nullable(row[7]) for row in rows], dtype=np.float64),
+            'total_floors': np.array([nullable(row[8]) for row in rows], dtype=np.float64),
+            'year_built': np.array([nullable(row[9]) for row in rows], dtype=np.float64),
+            'is_new_building': np.array([bool(row[10]) for row in rows], dtype=bool),
+            'is_buyer_commission': np.array([row[11] == 'buyer' for row in rows], dtype=bool),
+            'building_type': np.array([self._code('building_type', row[12]) for row in rows], dtype=np.int32),
+            'user_id': np.array([row[13] for row in rows], dtype=np.int64),
+            'microdistrict': np.array([self._code('microdistrict', row[14]) for row in rows], dtype=np.int32),
+            'complex_name': np.array([self._code('complex_name', row[15]) for row in rows], dtype=np.int32),
+            # Агентство автора: смена агентства отмечает его объявления измененными (main.signals)
+            'agency_id': np.array([-1 if row[16] is None else row[16] for row in rows], dtype=np.int64),
+        }
+
+        bits = np.zeros((len(rows), self._landmark_words()), dtype=np.uint64)
+        for index, row in enumerate(rows):
+            for landmark_id in landmarks.get(row[0], ()):
+                bit = self._landmark_bits[landmark_id]
+                bits[index, bit // 64] |= np.uint64(1 << (bit % 64))
+        return columns, bits
+
+    def _merge(self, store, rows, landmarks, removed_ids):
+        """Новый снимок: старый без removed_ids плюс rows, в порядке (-created, -id)"""
+        columns, bits = self._columns_from_rows(rows, landmarks)
+
+        if store is not None:
+            keep = ~np.isin(store.columns['id'], np.array(list(removed_ids), dtype=np.int64))
+            old_bits = store.landmark_bits[keep]
+            if old_bits.shape[1] < bits.shape[1]:
+                # Появились новые опорные точки — расширяем битовые маски
+                old_bits = np.pad(old_bits, ((0, 0), (0, bits.shape[1] - old_bits.shape[1])))
+            columns = {
+                name: np.concatenate([store.columns[name][keep], column])
+                for name, column in columns.items()
+            }
+            bits = np.concatenate([old_bits, bits])
+
+        order = np.lexsort((columns['id'], columns['created']))[::-1]
+        return ColumnStore({name: column[order] for name, column in columns.items()}, bits[order])
+
+    # Фасеты
+
+    def _facet_counts(self, store, filters):
+        """Каждый фасет считается по всем фильтрам, кроме собственного"""
+        columns = store.columns
+
+        def facet_mask(facet):
+            return self._evaluate(store, {key: value for key, value in filters.items() if key != facet})
+
+        facets = {}
+
+        rooms = np.bincount(columns['rooms_count'][facet_mask('rooms_count')].clip(min=0), minlength=6)
+        facets['rooms_count'] = {str(room): int(rooms[room]) for room in range(1, 5) if rooms[room]}
+        if rooms[5:].sum():
+            facets['rooms_count']['5+'] = int(rooms[5:].sum())
+
+        for field in CATEGORY_FIELDS:
+            codes = columns[field][facet_mask(field)]
+            counts = np.bincount(codes[codes >= 0], minlength=len(self._codes[field]))
+            values = {code: value for value, code in self._codes[field].items()}
+            facets[field] = {values[code]: int(count) for code, count in enumerate(counts) if count}
+
+        agency_ids, agency_counts = np.unique(columns['agency_id'][facet_mask('agency')], return_counts=True)
+        facets['agency'] = {
+            str(agency_id): count
+            for agency_id, count in zip(agency_ids.tolist(), agency_counts.tolist()) if agency_id >= 0
+        }
+
+        bits = store.landmark_bits[facet_mask('landmarks')]
+        facets['landmarks'] = {}
+        for landmark_id, bit in self._landmark_bits.items():
+            if bit // 64 >= bits.shape[1]:
+                continue
+            count = int(((bits[:, bit // 64] >> np.uint64(bit % 64)) & np.uint64(1)).sum())
+            if count:
+                facets['landmarks'][str(landmark_id)] = count
+
+        return facets
+
+    # Фильтрация
+
+    def _evaluate(self, store, filters):
+        """Булева маска объявлений, подходящих под фильтры SearchForm"""
+        columns = store.columns
+        mask = np.ones(len(store), dtype=bool)
+
+        rooms_count = filters.get('rooms_count')
+        if rooms_count:
+            rooms_mask = np.zeros(len(store), dtype=bool)
+            for room in rooms_count:
+                if room == '5+':
+                    rooms_mask |= columns['rooms_count'] >= 5
+                else:
+                    rooms_mask |= columns['rooms_count'] == int(room)
+            mask &= rooms_mask
+
+        for key, (column, operator) in RANGE_FILTERS.items():
+            value = filters.get(key)
+            if value:
+                if operator == 'gte':
+                    mask &= columns[column] >= float(value)
+                else:
+                    mask &= columns[column] <= float(value)
+
+        for field in CATEGORY_FIELDS:
+            value = filters.get(field)
+            if value:
+                code = self._codes[field].get(value)
+                if code is None:
+                    return np.zeros(len(store), dtype=bool)
+                mask &= columns[field] == code
+
+        if filters.get('not_first_floor'):
+            mask &= columns['floor'] > 1
+        if filters.get('not_last_floor'):
+            # NULL в floor/total_floors не исключает объявление, как и exclude() в ORM
+            mask &= ~(columns['floor'] == columns['total_floors'])
+        if filters.get('is_new_building'):
+            mask &= columns['is_new_building']
+        if filters.get('agency_only'):
+            mask &= columns['is_buyer_commission']
+
+        agency = filters.get('agency')
+        if agency:
+            mask &= columns['agency_id'] == getattr(agency, 'pk', agency)
+
+        landmarks = filters.get('landmarks')
+        if landmarks:
+            query_bits = np.zeros(store.landmark_bits.shape[1], dtype=np.uint64)
+            for landmark in landmarks:
+                bit = self._landmark_bits.get(landmark.pk)
+                if bit is not None and bit // 64 < len(query_bits):
+                    query_bits[bit // 64] |= np.uint64(1 << (bit % 64))
+            mask &= (store.landmark_bits & query_bits).any(axis=1)
+
+        return mask
+
+
+search_engine = SearchEngine()
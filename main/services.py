@@ -1,18 +1,34 @@
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.contrib.auth.hashers import make_password
 from django.utils import timezone
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, F, OuterRef, Q, Subquery
 from .models import (
-    Agency, User, UserPhoto, Address, Announcement, Photo, 
+    Agency, User, UserPhoto, Address, Announcement, Photo, PhotoFileLock, PhotoRendition, PhotoUpload,
     Collection, CollectionItem, UserSession, PageView
 )
+from . import duplicates, image_pipeline
+from .image_pipeline import (
+    RenditionSpec, alternate_path, get_modern_formats, get_rendition_specs, get_srcset_specs
+)
+from .photo_queue import photo_queue
+from .search_engine import SearchResult, get_listings_generation, search_engine, to_timestamp
 import os
+import re
 import uuid
+import json
+import hashlib
 from datetime import timedelta
-from PIL import Image, ImageOps
+from decimal import Decimal
 import io
+import logging
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
 
 
 class AgencyService:
@@ -118,6 +134,17 @@ class AddressService:
 class AnnouncementService:
     """Service class for working with announcements"""
     
+    # Фасеты панели фильтров: ключ фильтра SearchForm -> поле для группировки
+    FACET_FIELDS = {
+        'rooms_count': 'rooms_count',
+        'microdistrict': 'address__microdistrict',
+        'building_type': 'building_type',
+        'complex_name': 'address__complex_name',
+        'agency': 'user__agency_id',
+        'landmarks': 'landmarks__id',
+    }
+    FACET_CACHE_TIMEOUT = 60
+    
     @staticmethod
     def create_announcement(user, address_data, **announcement_data):
         """Create a new announcement with address"""
@@ -156,6 +183,269 @@ class AnnouncementService:
             queryset = queryset.filter(is_archived=False)
         return queryset.order_by('-created_at')
     
+    @staticmethod
+    def filter_announcements(queryset, filters):
+        """
+        Apply search filters to announcements queryset.
+        filters is SearchForm.cleaned_data (or a dict with the same keys).
+        """
+        # Количество комнат (множественный выбор)
+        rooms_count = filters.get('rooms_count')
+        if rooms_count:
+            room_filters = Q()
+            for room in rooms_count:
+                if room == '5+':
+                    room_filters |= Q(rooms_count__gte=5)
+                else:
+                    room_filters |= Q(rooms_count=int(room))
+            queryset = queryset.filter(room_filters)
+        
+        # Цена
+        price_from = filters.get('price_from')
+        price_to = filters.get('price_to')
+        if price_from:
+            queryset = queryset.filter(price__gte=price_from)
+        if price_to:
+            queryset = queryset.filter(price__lte=price_to)
+        
+        # Цена за м² (хранимое поле price_per_sqm с индексом)
+        price_per_sqm_from = filters.get('price_per_sqm_from')
+        price_per_sqm_to = filters.get('price_per_sqm_to')
+        if price_per_sqm_from:
+            queryset = queryset.filter(price_per_sqm__gte=price_per_sqm_from)
+        if price_per_sqm_to:
+            queryset = queryset.filter(price_per_sqm__lte=price_per_sqm_to)
+        
+        # Микрорайон
+        microdistrict = filters.get('microdistrict')
+        if microdistrict:
+            queryset = queryset.filter(address__microdistrict=microdistrict)
+        
+        # Тип дома
+        building_type = filters.get('building_type')
+        if building_type:
+            queryset = queryset.filter(building_type=building_type)
+        
+        # Год постройки
+        year_built_from = filters.get('year_built_from')
+        year_built_to = filters.get('year_built_to')
+        if year_built_from:
+            queryset = queryset.filter(year_built__gte=year_built_from)
+        if year_built_to:
+            queryset = queryset.filter(year_built__lte=year_built_to)
+        
+        # Жилой комплекс
+        complex_name = filters.get('complex_name')
+        if complex_name:
+            queryset = queryset.filter(address__complex_name__exact=complex_name)
+        
+        # Площадь
+        area_from = filters.get('area_from')
+        area_to = filters.get('area_to')
+        if area_from:
+            queryset = queryset.filter(area__gte=area_from)
+        if area_to:
+            queryset = queryset.filter(area__lte=area_to)
+        
+        # Этаж
+        floor_from = filters.get('floor_from')
+        floor_to = filters.get('floor_to')
+        if floor_from:
+            queryset = queryset.filter(floor__gte=floor_from)
+        if floor_to:
+            queryset = queryset.filter(floor__lte=floor_to)
+        
+        # Не первый этаж
+        not_first_floor = filters.get('not_first_floor')
+        if not_first_floor:
+            queryset = queryset.filter(floor__gt=1)
+        
+        # Не последний этаж
+        not_last_floor = filters.get('not_last_floor')
+        if not_last_floor:
+            queryset = queryset.exclude(floor=F('total_floors'))
+        
+        # Только новостройки
+        is_new_building = filters.get('is_new_building')
+        if is_new_building:
+            queryset = queryset.filter(is_new_building=True)
+        
+        # Только предложения от агентства
+        agency_only = filters.get('agency_only')
+        if agency_only:
+            # Показываем только объявления где партнер дополнительно платит вознаграждение
+            # Это третий вариант комиссии: 'buyer' - "Я беру с продавца, вы - с покупателя и я дополнительно доплачиваю вам"
+            queryset = queryset.filter(commission_type='buyer')
+        
+        # Фильтр по агентству
+        agency = filters.get('agency')
+        if agency:
+            queryset = queryset.filter(user__agency=agency)
+        
+        # Фильтр по опорным точкам
+        landmarks = filters.get('landmarks')
+        if landmarks:
+            queryset = queryset.filter(landmarks__in=landmarks)
+        
+        return queryset
+    
+    @staticmethod
+    def search_announcements(filters):
+        """
+        Search active announcements by SearchForm filters.
+        Uses in-memory search engine when enabled (settings.SEARCH_ENGINE),
+        otherwise filters in the database.
+        """
+        queryset = AnnouncementService.get_all_announcements()
+        result = search_engine.search(queryset, filters)
+        if result is not None:
+            return result
+        result = AnnouncementService._get_cached_search_result(queryset, filters)
+        if result is not None:
+            return result
+        return AnnouncementService.filter_announcements(queryset, filters)
+    
+    @staticmethod
+    def _get_cached_search_result(queryset, filters):
+        """
+        Ordered ids of matching announcements cached by filters signature
+        and listings generation (settings.SEARCH_RESULT_CACHE). A hit skips
+        the filtering query; only the requested page is loaded from the DB.
+        Returns None when disabled, without filters or when the result
+        exceeds MAX_IDS.
+        """
+        config = getattr(settings, 'SEARCH_RESULT_CACHE', {})
+        if not config.get('ENABLED', False):
+            return None
+        # Без фильтров страница — обычный keyset-запрос с LIMIT, кэш не нужен
+        if not AnnouncementService.normalize_filters(filters):
+            return None
+        
+        cache_key = (
+            f"announcement_search_{get_listings_generation()}_"
+            f"{AnnouncementService.get_filters_signature(filters)}"
+        )
+        cached = cache.get(cache_key)
+        if cached is None:
+            max_ids = config.get('MAX_IDS', 10000)
+            rows = AnnouncementService.filter_announcements(
+                Announcement.objects.filter(is_archived=False), filters
+            ).order_by('-created_at', '-id').values_list('id', 'created_at')[:max_ids + 1]
+            
+            # Фильтр по опорным точкам дает дубли — оставляем первое вхождение
+            ids, created, seen = [], [], set()
+            for pk, created_at in rows:
+                if pk in seen:
+                    continue
+                seen.add(pk)
+                ids.append(pk)
+                created.append(to_timestamp(created_at))
+            if len(rows) > max_ids:
+                # Запоминаем, что результат слишком большой: иначе каждый запрос
+                # с этими фильтрами снова читал бы MAX_IDS строк перед обычным запросом
+                cache.set(cache_key, {'oversized': True}, config.get('TIMEOUT', 300))
+                return None
+            cached = {'ids': ids, 'created': created}
+            cache.set(cache_key, cached, config.get('TIMEOUT', 300))
+        
+        if cached.get('oversized'):
+            return None
+        return SearchResult(queryset, cached['ids'], cached['created'])
+    
+    @staticmethod
+    def normalize_filters(filters):
+        """
+        Canonical JSON-compatible form of SearchForm filters:
+        empty values dropped, model instances replaced by ids, lists sorted.
+        """
+        normalized = {}
+        for key, value in filters.items():
+            if not value:
+                continue
+            if hasattr(value, 'pk'):
+                value = value.pk
+            elif isinstance(value, Decimal):
+                value = str(value.normalize())
+            elif isinstance(value, (list, tuple, set)) or hasattr(value, 'model'):
+                value = sorted(str(getattr(item, 'pk', item)) for item in value)
+            normalized[key] = value
+        return normalized
+    
+    @staticmethod
+    def get_filters_signature(filters):
+        """Stable hash of normalized filters for cache keys"""
+        payload = json.dumps(AnnouncementService.normalize_filters(filters), sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def get_facet_counts(filters):
+        """
+        Result counts per filter panel value for the current filters.
+        Each facet is counted with all filters except its own, so selected
+        values keep counts for alternatives. Cached by filters signature.
+        """
+        cache_key = (
+            f"announcement_facets_{get_listings_generation()}_"
+            f"{AnnouncementService.get_filters_signature(filters)}"
+        )
+        facets = cache.get(cache_key)
+        if facets is None:
+            facets = search_engine.facet_counts(filters)
+            if facets is None:
+                facets = AnnouncementService._get_facet_counts_from_db(filters)
+            cache.set(cache_key, facets, AnnouncementService.FACET_CACHE_TIMEOUT)
+        return facets
+    
+    @staticmethod
+    def _get_facet_counts_from_db(filters):
+        """
+        All facets in one scan of announcements matching the non-facet filters.
+        Each row carries whether it passes every selected facet filter (Exists
+        by pk), and counts are summed in Python: a row counts for a facet when
+        it passes all selected facet filters except the facet's own.
+        """
+        names = list(AnnouncementService.FACET_FIELDS)
+        selected = [facet for facet in names if filters.get(facet)]
+        queryset = AnnouncementService.filter_announcements(
+            Announcement.objects.filter(is_archived=False),
+            {key: value for key, value in filters.items() if key not in AnnouncementService.FACET_FIELDS}
+        )
+        matches = {
+            f'matches_{facet}': Exists(AnnouncementService.filter_announcements(
+                Announcement.objects.filter(pk=OuterRef('pk')), {facet: filters[facet]}
+            ))
+            for facet in selected
+        }
+        rows = queryset.order_by().annotate(**matches).values_list(
+            'id', *AnnouncementService.FACET_FIELDS.values(), *matches
+        )
+        
+        facets = {facet: {} for facet in names}
+        # Опорные точки дают строку на каждую точку объявления — остальные фасеты считаются по id один раз
+        counted = {facet: set() for facet in names}
+        for row in rows.iterator(chunk_size=2000):
+            pk, values, passed = row[0], row[1:len(names) + 1], row[len(names) + 1:]
+            failed = [facet for facet, ok in zip(selected, passed) if not ok]
+            if len(failed) > 1:
+                continue
+            for facet, value in zip(names, values):
+                if value is None or (failed and failed[0] != facet):
+                    continue
+                key = (pk, value) if facet == 'landmarks' else pk
+                if key in counted[facet]:
+                    continue
+                counted[facet].add(key)
+                value = str(value)
+                facets[facet][value] = facets[facet].get(value, 0) + 1
+        
+        # Комнаты: 5 и больше объединяются в "5+", как в фильтре
+        rooms = {}
+        for value, count in facets['rooms_count'].items():
+            key = value if int(value) < 5 else '5+'
+            rooms[key] = rooms.get(key, 0) + count
+        facets['rooms_count'] = rooms
+        return facets
+    
     @staticmethod
     def update_announcement(announcement, **kwargs):
         """Update announcement"""
@@ -255,6 +545,25 @@ class CollectionService:
             user=user,
             items__announcement=announcement
         ).order_by('name')
+    
+    @staticmethod
+    def get_announcements_collections_map(announcements, user):
+        """
+        Get {announcement_id: [collections]} of the user's collections
+        for a whole page of announcements in a single query
+        """
+        collections_map = {announcement.pk: [] for announcement in announcements}
+        if not collections_map:
+            return collections_map
+        
+        items = CollectionItem.objects.filter(
+            collection__user=user,
+            announcement_id__in=collections_map.keys()
+        ).select_related('collection').order_by('collection__name')
+        
+        for item in items:
+            collections_map[item.announcement_id].append(item.collection)
+        return collections_map
 
 
 class UserSessionService:
@@ -263,12 +572,37 @@ class UserSessionService:
     @staticmethod
     def create_session(user, session_key):
         """Create a new user session"""
+        now = timezone.now()
         return UserSession.objects.create(
             user=user,
             session_key=session_key,
-            login_time=timezone.now()
+            login_time=now,
+            last_activity=now
         )
     
+    @staticmethod
+    def track_activity(user, session_key, first_seen=False):
+        """
+        Record user activity for an open session. On the first request of
+        a session the record is created if missing (e.g. session started
+        before login tracking); later calls only update last_activity.
+        """
+        now = timezone.now()
+        if first_seen:
+            session, created = UserSession.objects.get_or_create(
+                user=user,
+                session_key=session_key,
+                defaults={
+                    'login_time': now,
+                    'last_activity': now,
+                }
+            )
+            if created:
+                return
+        UserSession.objects.filter(
+            user=user, session_key=session_key, logout_time__isnull=True
+        ).update(last_activity=now)
+    
     @staticmethod
     def end_session(session_key):
         """End a user session"""
@@ -317,108 +651,505 @@ class PhotoService:
         Optimize image: resize and compress
         Returns optimized image bytes and new size
         """
-        # Get settings
-        image_settings = getattr(settings, 'IMAGE_OPTIMIZATION', {})
-        
-        if image_type == 'announcement':
-            config = image_settings.get('ANNOUNCEMENT_PHOTOS', {})
-            max_width = max_width or config.get('MAX_WIDTH', 1920)
-            max_height = max_height or config.get('MAX_HEIGHT', 1080)
-            quality = quality or config.get('QUALITY', 85)
-        else:  # user photos
-            config = image_settings.get('USER_PHOTOS', {})
-            max_width = max_width or config.get('MAX_WIDTH', 800)
-            max_height = max_height or config.get('MAX_HEIGHT', 800)
-            quality = quality or config.get('QUALITY', 90)
-        
-        # Open image
-        img = Image.open(image_file)
-        
-        # Convert to RGB if necessary (for JPEG)
-        if img.mode in ('RGBA', 'LA', 'P'):
-            img = img.convert('RGB')
-        
-        # Auto-orient image based on EXIF data
-        img = ImageOps.exif_transpose(img)
-        
-        # Resize if too large
-        if img.width > max_width or img.height > max_height:
-            img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-        
-        # Save optimized image to bytes
-        img_bytes = io.BytesIO()
-        img.save(img_bytes, format='JPEG', quality=quality, optimize=True)
-        img_bytes.seek(0)
-        
-        return img_bytes, img_bytes.tell()
+        spec = get_rendition_specs()['full' if image_type == 'announcement' else 'avatar']
+        spec = RenditionSpec(
+            spec.name,
+            max_width or spec.max_width,
+            max_height or spec.max_height,
+            quality or spec.quality
+        )
+        rendition = image_pipeline.render(image_file, [spec])[spec.name]
+        return io.BytesIO(rendition.data), rendition.size
     
     @staticmethod
     def _create_thumbnail(image_file, size=None):
         """Create thumbnail image"""
-        # Get thumbnail size from settings
-        if size is None:
-            image_settings = getattr(settings, 'IMAGE_OPTIMIZATION', {})
-            size = image_settings.get('ANNOUNCEMENT_PHOTOS', {}).get('THUMBNAIL_SIZE', (400, 300))
+        spec = get_rendition_specs()['thumbnail']
+        if size is not None:
+            spec = RenditionSpec(spec.name, size[0], size[1], spec.quality)
+        rendition = image_pipeline.render(image_file, [spec])[spec.name]
+        return io.BytesIO(rendition.data), rendition.size
+    
+    @staticmethod
+    def save_announcement_photo(announcement, photo_file, content_hash=None):
+        """
+        Store uploaded announcement photo as is and queue it for processing
+        (settings.PHOTO_PROCESSING). Until renditions are ready the photo has
+        status 'pending' and templates show a placeholder. In 'inline' mode
+        renditions are created before returning.
+        If the same bytes were already processed with current rendition
+        settings, the new photo shares those files and the upload is neither
+        decoded nor stored.
+        content_hash: SHA-256 of photo_file if already known (chunked uploads).
+        """
+        original_name = photo_file.name
+        if content_hash is None:
+            content_hash = PhotoService._hash_file(photo_file)
         
-        img = Image.open(image_file)
+        # Ссылка на общие файлы создается под блокировкой ключа: удаление файлов
+        # последнего фото с тем же содержимым не пройдет между проверкой и созданием
+        with PhotoService.lock_storage_key(PhotoService.get_storage_key(content_hash)):
+            twin = PhotoService._find_processed_twin(content_hash)
+            if twin is not None:
+                photo = Photo.objects.create(
+                    announcement=announcement,
+                    original_name=original_name,
+                    content_hash=content_hash,
+                    status=Photo.STATUS_READY,
+                    **PhotoService._shared_file_fields(twin)
+                )
+                PhotoRendition.objects.bulk_create(PhotoService._copy_renditions(twin, photo.pk))
+        if twin is not None:
+            if default_storage.exists(photo.file_path):
+                PhotoService.refresh_announcement_main_photos(
+                    Announcement.objects.filter(pk=announcement.pk)
+                )
+                return photo
+            # Файлы пропали уже после коммита (удалены вручную) — обрабатываем загрузку заново
+            logger.warning(f"Файл {photo.file_path} общего фото не найден, фото {photo.pk} обрабатывается заново")
+            photo.delete()
         
-        # Convert to RGB if necessary
-        if img.mode in ('RGBA', 'LA', 'P'):
-            img = img.convert('RGB')
+        unique_id = str(uuid.uuid4())
+        extension = os.path.splitext(original_name)[1].lower() or '.jpg'
         
-        # Auto-orient image
-        img = ImageOps.exif_transpose(img)
+        # Исходный файл сохраняется без декодирования
+        photo_file.seek(0)
+        source_path = default_storage.save(f"announcement_photos/originals/{unique_id}{extension}", photo_file)
         
-        # Create thumbnail
-        img.thumbnail(size, Image.Resampling.LANCZOS)
+        photo = Photo.objects.create(
+            announcement=announcement,
+            file_name=os.path.basename(source_path),
+            file_path=source_path,
+            file_size=photo_file.size,
+            mime_type=getattr(photo_file, 'content_type', None) or 'application/octet-stream',
+            original_name=original_name,
+            content_hash=content_hash,
+            status=Photo.STATUS_PENDING,
+            source_path=source_path
+        )
         
-        # Save thumbnail to bytes
-        thumb_bytes = io.BytesIO()
-        img.save(thumb_bytes, format='JPEG', quality=80, optimize=True)
-        thumb_bytes.seek(0)
+        if photo_queue.mode == 'inline':
+            PhotoService.process_photo(photo.pk)
+            photo.refresh_from_db()
+        else:
+            photo_queue.enqueue(photo.pk)
         
-        return thumb_bytes, thumb_bytes.tell()
+        return photo
     
     @staticmethod
-    def save_announcement_photo(announcement, photo_file):
-        """Save optimized announcement photo with thumbnail"""
-        # Generate unique filename
-        original_name = photo_file.name
-        unique_id = str(uuid.uuid4())
+    def process_photo(photo_id):
+        """
+        Create renditions for a queued announcement photo and mark it ready.
+        The photo is claimed with a single conditional UPDATE, so background
+        threads and process_photos workers can share the queue.
+        Returns True if the photo became ready.
+        """
+        config = photo_queue.config
+        now = timezone.now()
+        stale_before = now - timedelta(seconds=config['STALE_AFTER'])
+        claimed = Photo.objects.filter(pk=photo_id).filter(
+            Q(status=Photo.STATUS_PENDING) |
+            Q(status=Photo.STATUS_PROCESSING, processing_started_at__lt=stale_before)
+        ).update(
+            status=Photo.STATUS_PROCESSING,
+            processing_started_at=now,
+            processing_attempts=F('processing_attempts') + 1
+        )
+        if not claimed:
+            return False
         
-        # Reset file pointer for multiple reads
-        photo_file.seek(0)
+        photo = Photo.objects.get(pk=photo_id)
+        try:
+            if not photo.content_hash:
+                # Фото поставлено в очередь до хранения по хэшу содержимого
+                with default_storage.open(photo.source_path, 'rb') as source:
+                    photo.content_hash = PhotoService._hash_file(source)
+            
+            key = PhotoService.get_storage_key(photo.content_hash)
+            result = None
+            if PhotoService._find_processed_twin(photo.content_hash) is None:
+                # Декодирование — до блокировки ключа
+                result = PhotoService._render_photo(photo)
+            
+            # Файлы сохраняются (или переиспользуются) и фото ссылается на них в одной
+            # транзакции под блокировкой ключа — release_photo_files их не удалит
+            with PhotoService.lock_storage_key(key):
+                twin = PhotoService._find_processed_twin(photo.content_hash)
+                if twin is not None:
+                    # Такое же фото уже обработано — файлы общие, декодирование не нужно
+                    fields = PhotoService._shared_file_fields(twin)
+                    renditions = PhotoService._copy_renditions(twin, photo_id)
+                else:
+                    if result is None:
+                        # Общие файлы удалены после первой проверки
+                        result = PhotoService._render_photo(photo)
+                    fields, renditions = PhotoService._store_photo_files(key, result)
+                
+                updated = Photo.objects.filter(pk=photo_id, status=Photo.STATUS_PROCESSING).update(
+                    content_hash=photo.content_hash,
+                    status=Photo.STATUS_READY,
+                    source_path=None,
+                    **fields
+                )
+                if updated:
+                    for rendition in renditions:
+                        rendition.photo_id = photo_id
+                    PhotoRendition.objects.bulk_create(renditions)
+        except Exception:
+            logger.exception(f"Ошибка обработки фото {photo_id}")
+            # Повторяем до MAX_ATTEMPTS попыток, затем оставляем исходный файл со статусом failed
+            status = Photo.STATUS_FAILED if photo.processing_attempts >= config['MAX_ATTEMPTS'] else Photo.STATUS_PENDING
+            Photo.objects.filter(pk=photo_id, status=Photo.STATUS_PROCESSING).update(status=status)
+            return False
         
-        # Optimize main image
-        optimized_img, optimized_size = PhotoService._optimize_image(photo_file, image_type='announcement')
-        filename = f"{unique_id}.jpg"
+        if not updated:
+            # Фото удалено во время обработки: файлы удаляются, если на них не ссылаются другие фото
+            PhotoService.release_photo_files(Photo(**fields), [rendition.file_path for rendition in renditions])
+            return False
         
-        # Save optimized image
-        file_path = f"announcement_photos/{filename}"
-        saved_path = default_storage.save(file_path, ContentFile(optimized_img.read()))
+        default_storage.delete(photo.source_path)
+        # Готовое фото может стать главным для карточек в списках
+        PhotoService.refresh_announcement_main_photos(
+            Announcement.objects.filter(pk=photo.announcement_id)
+        )
+        return True
+    
+    @staticmethod
+    def _render_photo(photo):
+        """Decode photo's source once into all renditions and formats"""
+        with default_storage.open(photo.source_path, 'rb') as source:
+            return image_pipeline.render(
+                source, ['full', 'thumbnail', *get_srcset_specs()], formats=get_modern_formats()
+            )
+    
+    @staticmethod
+    def _store_photo_files(key, result):
+        """
+        Store renditions of a pipeline result under content key (call with
+        lock_storage_key held). Returns (Photo field values, unsaved
+        PhotoRendition objects).
+        """
+        full, thumbnail = result['full'], result['thumbnail']
+        saved_path = PhotoService._store_file(f"announcement_photos/{key}.jpg", full.data)
+        saved_thumbnail_path = PhotoService._store_file(
+            f"announcement_photos/thumbnails/{key}_thumb.jpg", thumbnail.data
+        )
+        formats = PhotoService._save_alternate_formats(
+            ((saved_path, full), (saved_thumbnail_path, thumbnail))
+        )
+        fields = {
+            'file_name': os.path.basename(saved_path),
+            'file_path': saved_path,
+            'file_size': full.size,
+            'mime_type': 'image/jpeg',
+            'thumbnail_path': saved_thumbnail_path,
+            'thumbnail_size': thumbnail.size,
+            'width': full.width,
+            'height': full.height,
+            'formats': formats,
+            **duplicates.hash_fields(result.dhash),
+        }
+        return fields, PhotoService._save_srcset_renditions(key, result)
+    
+    # ===== Хранение по хэшу содержимого =====
+    
+    @staticmethod
+    def _hash_file(file):
+        """SHA-256 of an uploaded or stored file, read in chunks"""
+        digest = hashlib.sha256()
+        file.seek(0)
+        for chunk in file.chunks():
+            digest.update(chunk)
+        file.seek(0)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def get_storage_key(content_hash):
+        """
+        File name stem for renditions of a source: hash of its bytes plus
+        signature of rendition settings, so changed settings get new files.
+        """
+        return f"{content_hash[:40]}-{image_pipeline.get_renditions_signature()}"
+    
+    @staticmethod
+    def get_storage_key_of(path):
+        """Storage key of a stored photo file: its name without _thumb/_640w suffix"""
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return re.sub(r'(?:_thumb|_\d+w)$', '', stem)
+    
+    @staticmethod
+    def _acquire_storage_locks(keys):
+        """
+        Lock PhotoFileLock rows of keys until the current transaction ends.
+        The row is locked with UPDATE: a row lock in PostgreSQL, the database
+        write lock in SQLite. Keys are locked in sorted order to avoid deadlocks.
+        """
+        now = timezone.now()
+        for key in sorted(set(keys)):
+            if PhotoFileLock.objects.filter(key=key).update(locked_at=now):
+                continue
+            try:
+                with transaction.atomic():
+                    PhotoFileLock.objects.create(key=key, locked_at=now)
+            except IntegrityError:
+                # Строку создал параллельный процесс — ждем его блокировку
+                PhotoFileLock.objects.filter(key=key).update(locked_at=now)
+    
+    @staticmethod
+    @contextmanager
+    def lock_storage_key(*keys):
+        """
+        Transaction holding the locks of storage keys. Checks that shared files
+        are unused before deleting them, and reuse of those files by new photos,
+        run under it, so a delete cannot slip between a check and a new reference.
+        """
+        with transaction.atomic():
+            PhotoService._acquire_storage_locks(keys)
+            yield
+    
+    @staticmethod
+    def _find_processed_twin(content_hash):
+        """Ready photo with the same bytes processed with current settings, or None"""
+        file_path = f"announcement_photos/{PhotoService.get_storage_key(content_hash)}.jpg"
+        twin = Photo.objects.filter(file_path=file_path, status=Photo.STATUS_READY).first()
+        if twin is None or not default_storage.exists(file_path):
+            return None
+        return twin
+    
+    @staticmethod
+    def _shared_file_fields(photo):
+        """Photo fields describing its stored files, for a photo sharing them"""
+        return {
+            field: getattr(photo, field) for field in (
+                'file_name', 'file_path', 'file_size', 'mime_type', 'thumbnail_path',
+                'thumbnail_size', 'width', 'height', 'formats', 'dhash', *duplicates.SEGMENT_FIELDS
+            )
+        }
+    
+    @staticmethod
+    def _copy_renditions(photo, photo_id):
+        """Unsaved copies of photo's srcset renditions for another photo"""
+        return [
+            PhotoRendition(
+                photo_id=photo_id, width=rendition.width, height=rendition.height,
+                format=rendition.format, file_path=rendition.file_path, file_size=rendition.file_size
+            )
+            for rendition in photo.renditions.all()
+        ]
+    
+    @staticmethod
+    def _store_file(path, data):
+        """
+        Save data under path. A file that already exists under a content-addressed
+        name holds the same rendition, so it is reused instead of written again.
+        """
+        if default_storage.exists(path):
+            return path
+        return default_storage.save(path, ContentFile(data))
+    
+    @staticmethod
+    def release_photo_files(photo, rendition_paths=()):
+        """
+        Delete files of a deleted photo (after commit). Renditions are shared by
+        photos with the same content, so they are deleted only when no other
+        photo references them; the queued source always belongs to one photo.
+        """
+        def release():
+            if photo.source_path:
+                default_storage.delete(photo.source_path)
+            if not photo.file_path or photo.file_path == photo.source_path:
+                return
+            # Под блокировкой ключа: новое фото не сошлется на файлы между проверкой и удалением
+            with PhotoService.lock_storage_key(PhotoService.get_storage_key_of(photo.file_path)):
+                if Photo.objects.filter(file_path=photo.file_path).exists():
+                    return
+                paths = []
+                formats = [image_format for image_format in photo.formats.split(',') if image_format]
+                for path in (photo.file_path, photo.thumbnail_path):
+                    if path:
+                        paths.append(path)
+                        paths.extend(alternate_path(path, image_format) for image_format in formats)
+                still_used = set(
+                    PhotoRendition.objects.filter(file_path__in=rendition_paths).values_list('file_path', flat=True)
+                )
+                paths.extend(path for path in rendition_paths if path not in still_used)
+                for path in paths:
+                    default_storage.delete(path)
         
-        # Reset file pointer for thumbnail creation
-        photo_file.seek(0)
+        transaction.on_commit(release)
+    
+    @staticmethod
+    def release_user_photo_file(photo):
+        """Delete file of a deleted user photo after commit"""
+        transaction.on_commit(lambda: default_storage.delete(photo.file_path))
+    
+    @staticmethod
+    def _save_alternate_formats(saved_renditions):
+        """
+        Save modern-format copies next to saved JPEG renditions.
+        saved_renditions: ((saved_path, Rendition), ...). Returns comma-separated
+        formats available for every rendition, best first ("avif,webp").
+        """
+        formats = None
+        for saved_path, rendition in saved_renditions:
+            saved_formats = [image_format for image_format, _, _ in PhotoService._save_alternates(saved_path, rendition)]
+            formats = saved_formats if formats is None else [f for f in formats if f in saved_formats]
+        return ','.join(formats or [])
+    
+    @staticmethod
+    def _save_alternates(saved_path, rendition):
+        """
+        Save rendition's modern-format copies next to its JPEG.
+        Returns [(format, path, size), ...] for saved copies.
+        """
+        saved = []
+        for image_format, data in rendition.alternates.items():
+            path = alternate_path(saved_path, image_format)
+            if PhotoService._store_file(path, data) != path:
+                # Имя занято — файл формата не найдется по пути JPEG
+                logger.warning(f"Не удалось сохранить {path}: имя занято")
+                continue
+            saved.append((image_format, path, len(data)))
+        return saved
+    
+    @staticmethod
+    def _save_srcset_renditions(unique_id, result):
+        """
+        Save srcset widths (SRCSET_WIDTHS) from a pipeline result with their
+        modern-format copies. Returns unsaved PhotoRendition objects.
+        """
+        renditions = []
+        for spec in get_srcset_specs():
+            rendition = result.renditions.get(spec.name)
+            if rendition is None:
+                # Ширина не меньше full — в srcset попадет само фото
+                continue
+            path = PhotoService._store_file(
+                f"announcement_photos/sizes/{unique_id}_{rendition.width}w.jpg", rendition.data
+            )
+            renditions.append(PhotoRendition(
+                width=rendition.width, height=rendition.height, format='jpeg',
+                file_path=path, file_size=rendition.size
+            ))
+            for image_format, alternate, size in PhotoService._save_alternates(path, rendition):
+                renditions.append(PhotoRendition(
+                    width=rendition.width, height=rendition.height, format=image_format,
+                    file_path=alternate, file_size=size
+                ))
+        return renditions
+    
+    @staticmethod
+    def create_photo_renditions(photo):
+        """
+        Build srcset widths for an existing ready photo from its full-size
+        file (backfill for photos processed before SRCSET_WIDTHS).
+        Replaces previous renditions. Returns created PhotoRendition objects.
+        """
+        renditions = PhotoService.render_photo_renditions(photo)
+        PhotoService.replace_photo_renditions([photo])
+        return renditions
+    
+    @staticmethod
+    def render_photo_renditions(photo):
+        """
+        Write srcset width files for a ready photo without touching the
+        database (safe in worker processes). Sets photo.width/height and
+        photo.new_renditions for replace_photo_renditions.
+        Returns unsaved PhotoRendition objects.
+        """
+        formats = [image_format for image_format in photo.formats.split(',') if image_format]
+        with default_storage.open(photo.file_path, 'rb') as source:
+            result = image_pipeline.render(source, get_srcset_specs(), formats=formats)
         
-        # Create thumbnail
-        thumbnail_img, thumbnail_size = PhotoService._create_thumbnail(photo_file)
-        thumbnail_filename = f"{unique_id}_thumb.jpg"
-        thumbnail_path = f"announcement_photos/thumbnails/{thumbnail_filename}"
-        saved_thumbnail_path = default_storage.save(thumbnail_path, ContentFile(thumbnail_img.read()))
+        unique_id = os.path.splitext(os.path.basename(photo.file_path))[0]
+        renditions = PhotoService._save_srcset_renditions(unique_id, result)
+        for rendition in renditions:
+            rendition.photo_id = photo.pk
+        photo.width, photo.height = result.source_size
+        photo.new_renditions = renditions
+        return renditions
+    
+    @staticmethod
+    def replace_photo_renditions(photos):
+        """
+        Store renditions prepared by render_photo_renditions for many photos:
+        old rows are replaced, width/height saved with one bulk_update.
+        Old files that are no longer referenced are deleted after commit.
+        """
+        keys = [PhotoService.get_storage_key_of(photo.file_path) for photo in photos]
+        with PhotoService.lock_storage_key(*keys):
+            for photo in photos:
+                # Файлы записаны до блокировки: общая копия могла быть удалена вместе с другим фото
+                present = [rendition for rendition in photo.new_renditions if default_storage.exists(rendition.file_path)]
+                if len(present) < len(photo.new_renditions):
+                    logger.warning(
+                        f"Фото {photo.pk}: файлы копий удалены до сохранения, "
+                        f"пропущено {len(photo.new_renditions) - len(present)}"
+                    )
+                    photo.new_renditions = present
+            new_paths = {rendition.file_path for photo in photos for rendition in photo.new_renditions}
+            old_renditions = PhotoRendition.objects.filter(photo__in=[photo.pk for photo in photos])
+            old_paths = [path for path in old_renditions.values_list('file_path', flat=True) if path not in new_paths]
+            old_renditions.delete()
+            PhotoRendition.objects.bulk_create(
+                [rendition for photo in photos for rendition in photo.new_renditions]
+            )
+            Photo.objects.bulk_update(photos, ['width', 'height'])
+            
+            def release():
+                # Копии фото с тем же содержимым общие — удаляются только неиспользуемые
+                with PhotoService.lock_storage_key(*keys):
+                    still_used = set(
+                        PhotoRendition.objects.filter(file_path__in=old_paths).values_list('file_path', flat=True)
+                    )
+                    for path in old_paths:
+                        if path not in still_used:
+                            default_storage.delete(path)
+            
+            # После коммита внешней транзакции: при откате строки ссылались бы на удаленные файлы
+            transaction.on_commit(release)
+    
+    @staticmethod
+    def create_alternate_formats(photo):
+        """
+        Add modern-format copies for an existing ready photo from its stored
+        renditions (backfill for photos processed before MODERN_FORMATS).
+        Returns formats string saved on the photo.
+        """
+        formats = PhotoService.render_alternate_formats(photo)
+        if formats != photo.formats:
+            photo.formats = formats
+            Photo.objects.filter(pk=photo.pk).update(formats=photo.formats)
+            PhotoService.refresh_announcement_main_photos(
+                Announcement.objects.filter(pk=photo.announcement_id)
+            )
+        return photo.formats
+    
+    @staticmethod
+    def render_alternate_formats(photo):
+        """
+        Write missing modern-format copies of photo's full-size file and
+        thumbnail without touching the database (safe in worker processes).
+        Returns the resulting formats string.
+        """
+        existing = [image_format for image_format in photo.formats.split(',') if image_format]
+        modern_formats = [image_format for image_format in get_modern_formats() if image_format not in existing]
+        if not modern_formats:
+            return photo.formats
         
-        # Create photo record
-        photo = Photo.objects.create(
-            announcement=announcement,
-            file_name=filename,
-            file_path=saved_path,
-            file_size=optimized_size,
-            mime_type='image/jpeg',
-            original_name=original_name,
-            thumbnail_path=saved_thumbnail_path,
-            thumbnail_size=thumbnail_size
-        )
+        saved_renditions = []
+        for path in (photo.file_path, photo.thumbnail_path):
+            if not path:
+                continue
+            with default_storage.open(path, 'rb') as source:
+                result = image_pipeline.render(
+                    source, [RenditionSpec('source', 100000, 100000)], formats=modern_formats
+                )
+            saved_renditions.append((path, result['source']))
         
-        return photo
+        available = existing + PhotoService._save_alternate_formats(saved_renditions).split(',')
+        # Порядок как в настройках: лучший формат первым
+        return ','.join(image_format for image_format in get_modern_formats() if image_format in available)
     
     @staticmethod
     def save_user_photo(user, photo_file):
@@ -428,22 +1159,19 @@ class PhotoService:
         unique_id = str(uuid.uuid4())
         
         # Optimize user photo (smaller size for profile pics)
-        optimized_img, optimized_size = PhotoService._optimize_image(
-            photo_file, 
-            image_type='user'
-        )
+        avatar = image_pipeline.render(photo_file, ('avatar',))['avatar']
         filename = f"{unique_id}.jpg"
         
         # Save optimized image
         file_path = f"user_photos/{filename}"
-        saved_path = default_storage.save(file_path, ContentFile(optimized_img.read()))
+        saved_path = default_storage.save(file_path, ContentFile(avatar.data))
         
         # Create photo record
         photo = UserPhoto.objects.create(
             user=user,
             file_name=filename,
             file_path=saved_path,
-            file_size=optimized_size,
+            file_size=avatar.size,
             mime_type='image/jpeg',
             original_name=original_name
         )
@@ -456,11 +1184,263 @@ class PhotoService:
         if is_announcement:
             # Remove main flag from other photos of the same announcement
             Photo.objects.filter(announcement=photo.announcement).update(is_main=False)
-        else:
-            # Remove main flag from other photos of the same user
-            UserPhoto.objects.filter(user=photo.user).update(is_main=False)
+            # update(): фоновая обработка может одновременно менять остальные поля фото
+            Photo.objects.filter(pk=photo.pk).update(is_main=True)
+            photo.is_main = True
+            if photo.is_ready:
+                PhotoService._set_announcement_main_photo(photo.announcement, photo)
+            else:
+                # Пока фото обрабатывается, в карточках остается другое готовое фото
+                PhotoService.refresh_announcement_main_photos(
+                    Announcement.objects.filter(pk=photo.announcement_id)
+                )
+            return photo
         
+        # Remove main flag from other photos of the same user
+        UserPhoto.objects.filter(user=photo.user).update(is_main=False)
         photo.is_main = True
         photo.save()
         return photo
+    
+    @staticmethod
+    def _set_announcement_main_photo(announcement, photo):
+        """Point announcement's denormalized main photo paths at the given photo"""
+        announcement.main_photo_path = photo.file_path
+        announcement.main_thumbnail_path = photo.thumbnail_path
+        announcement.main_photo_formats = photo.formats
+        # update() не меняет updated_at и не перезаписывает остальные поля
+        Announcement.objects.filter(pk=announcement.pk).update(
+            main_photo_path=announcement.main_photo_path,
+            main_thumbnail_path=announcement.main_thumbnail_path,
+            main_photo_formats=announcement.main_photo_formats
+        )
+    
+    @staticmethod
+    def refresh_announcement_main_photos(announcements):
+        """
+        Recalculate denormalized main photo paths for a queryset of announcements
+        in a single UPDATE: the ready photo marked as main, otherwise the first
+        ready one. Returns number of updated announcements.
+        """
+        main_photo = Photo.objects.filter(
+            announcement_id=OuterRef('pk'),
+            status=Photo.STATUS_READY
+        ).order_by('-is_main', 'uploaded_at', 'id')
+        
+        return announcements.update(
+            main_photo_path=Subquery(main_photo.values('file_path')[:1]),
+            main_thumbnail_path=Subquery(main_photo.values('thumbnail_path')[:1]),
+            main_photo_formats=Subquery(main_photo.values('formats')[:1])
+        )
+    
+    @staticmethod
+    def handle_announcement_photo_deleted(photo):
+        """Move main photo paths away from a deleted photo if it was the main one"""
+        return PhotoService.refresh_announcement_main_photos(
+            Announcement.objects.filter(
+                pk=photo.announcement_id,
+                main_photo_path=photo.file_path
+            )
+        )
 
+
+class PhotoUploadService:
+    """
+    Chunked, resumable uploads of announcement photos (settings.PHOTO_UPLOADS).
+    Chunks are streamed from the request straight into a spool file, so a
+    worker holds one read buffer regardless of photo size and count. Completed
+    uploads are verified and handed to PhotoService when the form is saved.
+    """
+    
+    DEFAULT_CONFIG = {
+        'SPOOL_DIR': os.path.join(settings.BASE_DIR, 'uploads'),
+        'CHUNK_SIZE': 1024 * 1024,
+        'EXPIRE_AFTER': 24 * 60 * 60,
+    }
+    
+    # Буфер чтения тела запроса
+    READ_SIZE = 64 * 1024
+    
+    @staticmethod
+    def get_config():
+        return {**PhotoUploadService.DEFAULT_CONFIG, **getattr(settings, 'PHOTO_UPLOADS', {})}
+    
+    @staticmethod
+    def spool_path(upload):
+        return os.path.join(PhotoUploadService.get_config()['SPOOL_DIR'], f"{upload.pk}.part")
+    
+    @staticmethod
+    def start(user, file_name, size, content_type, checksum=''):
+        """Create an upload session and its empty spool file. Raises ValueError for invalid files"""
+        max_size = getattr(settings, 'IMAGE_OPTIMIZATION', {}).get('MAX_FILE_SIZE', 15 * 1024 * 1024)
+        if not isinstance(size, int) or size <= 0:
+            raise ValueError('Не указан размер файла')
+        if size > max_size:
+            raise ValueError(f'Файл {file_name} слишком большой. Максимальный размер: {max_size // (1024 * 1024)}MB')
+        if not (content_type or '').startswith('image/'):
+            raise ValueError(f'Файл {file_name} должен быть изображением')
+        
+        upload = PhotoUpload.objects.create(
+            user=user,
+            file_name=os.path.basename(file_name or 'photo.jpg')[:255],
+            content_type=content_type,
+            size=size,
+            checksum=(checksum or '').lower()
+        )
+        os.makedirs(PhotoUploadService.get_config()['SPOOL_DIR'], exist_ok=True)
+        open(PhotoUploadService.spool_path(upload), 'wb').close()
+        return upload
+    
+    @staticmethod
+    def write_chunk(upload, offset, stream, length, chunk_checksum=None):
+        """
+        Write a chunk of length bytes read from stream at offset. The offset
+        must equal upload.received; the chunk is accepted only if it arrived
+        whole and matches chunk_checksum (SHA-256), so a retry after a broken
+        connection simply rewrites the same range.
+        Raises ValueError if the chunk is rejected. Returns the updated upload.
+        """
+        if length <= 0 or length > PhotoUploadService.get_config()['CHUNK_SIZE']:
+            raise ValueError('Недопустимый размер части')
+        if offset + length > upload.size:
+            raise ValueError('Часть выходит за пределы файла')
+        
+        digest = hashlib.sha256()
+        written = 0
+        with open(PhotoUploadService.spool_path(upload), 'r+b') as spool:
+            spool.seek(offset)
+            while written < length:
+                data = stream.read(min(PhotoUploadService.READ_SIZE, length - written))
+                if not data:
+                    break
+                digest.update(data)
+                spool.write(data)
+                written += len(data)
+        if written != length:
+            raise ValueError('Часть получена не полностью')
+        if chunk_checksum and digest.hexdigest() != chunk_checksum.lower():
+            raise ValueError('Контрольная сумма части не совпадает')
+        
+        # Условный UPDATE: параллельный повтор той же части записал те же байты
+        PhotoUpload.objects.filter(pk=upload.pk, received=offset).update(
+            received=offset + length, updated_at=timezone.now()
+        )
+        upload.refresh_from_db()
+        if upload.received == upload.size and not upload.is_complete:
+            PhotoUploadService._complete(upload)
+        return upload
+    
+    @staticmethod
+    def _complete(upload):
+        """Verify the assembled file: whole-file checksum and image header"""
+        from PIL import Image
+        
+        path = PhotoUploadService.spool_path(upload)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as spool:
+            for data in iter(lambda: spool.read(PhotoUploadService.READ_SIZE), b''):
+                digest.update(data)
+        content_hash = digest.hexdigest()
+        
+        try:
+            if upload.checksum and upload.checksum != content_hash:
+                raise ValueError('Контрольная сумма файла не совпадает')
+            try:
+                # verify() проверяет структуру файла, не декодируя пиксели
+                with Image.open(path) as img:
+                    img.verify()
+            except Exception:
+                raise ValueError(f'Файл {upload.file_name} не является изображением')
+        except ValueError:
+            # Загрузка начинается заново с первого байта
+            PhotoUpload.objects.filter(pk=upload.pk).update(received=0)
+            upload.received = 0
+            raise
+        
+        PhotoUpload.objects.filter(pk=upload.pk).update(
+            status=PhotoUpload.STATUS_COMPLETE, content_hash=content_hash
+        )
+        upload.status = PhotoUpload.STATUS_COMPLETE
+        upload.content_hash = content_hash
+    
+    @staticmethod
+    def save_announcement_photos(announcement, user, upload_ids):
+        """
+        Hand user's completed uploads to PhotoService in the given order.
+        Spool files are streamed to storage and removed after commit.
+        Returns {upload id (str): Photo}.
+        """
+        from django.core.files import File
+        
+        valid_ids = []
+        for upload_id in upload_ids:
+            try:
+                valid_ids.append(uuid.UUID(str(upload_id)))
+            except ValueError:
+                continue
+        uploads = PhotoUpload.objects.in_bulk(valid_ids)
+        
+        photos = {}
+        for upload_id in valid_ids:
+            upload = uploads.get(upload_id)
+            if upload is None or upload.user_id != user.pk or not upload.is_complete:
+                continue
+            path = PhotoUploadService.spool_path(upload)
+            with open(path, 'rb') as spool:
+                photo_file = File(spool, name=upload.file_name)
+                photo_file.content_type = upload.content_type
+                photos[str(upload_id)] = PhotoService.save_announcement_photo(
+                    announcement, photo_file, content_hash=upload.content_hash
+                )
+            PhotoUploadService.delete(upload)
+        return photos
+    
+    @staticmethod
+    def delete(upload):
+        """Delete an upload session; its spool file is removed after commit"""
+        path = PhotoUploadService.spool_path(upload)
+        upload.delete()
+        transaction.on_commit(lambda: PhotoUploadService._remove_spool(path))
+    
+    @staticmethod
+    def delete_expired():
+        """
+        Delete uploads not updated for EXPIRE_AFTER seconds and spool files
+        without a session. Returns (deleted sessions, freed bytes).
+        """
+        config = PhotoUploadService.get_config()
+        expired_before = timezone.now() - timedelta(seconds=config['EXPIRE_AFTER'])
+        expired = PhotoUpload.objects.filter(updated_at__lt=expired_before)
+        
+        freed = 0
+        count = 0
+        for upload in expired.iterator():
+            freed += PhotoUploadService._remove_spool(PhotoUploadService.spool_path(upload))
+            upload.delete()
+            count += 1
+        
+        spool_dir = config['SPOOL_DIR']
+        if os.path.isdir(spool_dir):
+            cutoff = expired_before.timestamp()
+            with os.scandir(spool_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.part') or entry.stat().st_mtime >= cutoff:
+                        continue
+                    upload_id = entry.name[:-len('.part')]
+                    try:
+                        exists = PhotoUpload.objects.filter(pk=uuid.UUID(upload_id)).exists()
+                    except ValueError:
+                        exists = False
+                    if not exists:
+                        freed += PhotoUploadService._remove_spool(entry.path)
+        return count, freed
+    
+    @staticmethod
+    def _remove_spool(path):
+        """Remove a spool file, returning its size (0 if it was already gone)"""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except FileNotFoundError:
+            return 0
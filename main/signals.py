@@ -0,0 +1,128 @@
+"""
+Обработчики сигналов моделей приложения main.
+Подключаются в MainConfig.ready().
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    Address, Agency, Announcement, BuildingType, Landmark, Microdistrict, Photo,
+    RepairType, ResidentialComplex, User, UserPhoto
+)
+from .auth_backends import invalidate_cached_users
+from .autocomplete import bump_autocomplete_version
+from .reference_data import bump_reference_data_version
+from .search_engine import mark_changed, mark_users_changed, search_engine
+from .services import PhotoService
+
+
+@receiver(post_delete, sender=Photo)
+def announcement_photo_deleted(sender, instance, **kwargs):
+    """Переносит ссылку на главное фото объявления, если удалено именно оно"""
+    PhotoService.handle_announcement_photo_deleted(instance)
+
+
+@receiver(pre_delete, sender=Photo)
+def photo_renditions_collected(sender, instance, **kwargs):
+    """Запоминает пути копий srcset: строки PhotoRendition удаляются каскадом раньше фото"""
+    instance.rendition_paths = list(instance.renditions.values_list('file_path', flat=True))
+
+
+@receiver(post_delete, sender=Photo)
+def photo_files_released(sender, instance, **kwargs):
+    """Удаляет файлы фото, если на них больше не ссылаются другие фото"""
+    PhotoService.release_photo_files(instance, getattr(instance, 'rendition_paths', ()))
+
+
+@receiver(post_save, sender=Announcement)
+def announcement_saved(sender, instance, **kwargs):
+    """Создание, изменение и архивация меняют результаты поиска"""
+    mark_changed()
+
+
+@receiver(post_delete, sender=Announcement)
+def announcement_deleted(sender, instance, **kwargs):
+    """Удаляет объявление из результатов поиска"""
+    mark_changed(deleted_ids=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Announcement.landmarks.through)
+def announcement_landmarks_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Опорные точки меняются после save(), поэтому для in-memory индекса
+    обновляем updated_at — по нему дочитываются изменения.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if search_engine.enabled:
+        if not reverse:
+            Announcement.objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+        elif pk_set:
+            Announcement.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
+    mark_changed()
+
+
+@receiver(post_save, sender=Address)
+def address_saved(sender, instance, created, **kwargs):
+    """Микрорайон и ЖК хранятся в адресе — отмечаем связанные объявления измененными"""
+    if instance.complex_name:
+        bump_autocomplete_version()
+    if created:
+        return
+    if search_engine.enabled:
+        Announcement.objects.filter(address=instance).update(updated_at=timezone.now())
+    mark_changed()
+
+
+@receiver(post_save, sender=Microdistrict)
+@receiver(post_save, sender=ResidentialComplex)
+@receiver(post_save, sender=RepairType)
+@receiver(post_save, sender=BuildingType)
+@receiver(post_save, sender=Landmark)
+@receiver(post_save, sender=Agency)
+@receiver(post_delete, sender=Microdistrict)
+@receiver(post_delete, sender=ResidentialComplex)
+@receiver(post_delete, sender=RepairType)
+@receiver(post_delete, sender=BuildingType)
+@receiver(post_delete, sender=Landmark)
+@receiver(post_delete, sender=Agency)
+def reference_data_changed(sender, raw=False, **kwargs):
+    """Справочник изменен (админка, формы) — процессы перечитают реестр"""
+    # Загрузка фикстур и import_reference_data меняют версию один раз в конце
+    if raw:
+        return
+    bump_reference_data_version()
+    if sender in (Agency, ResidentialComplex):
+        bump_autocomplete_version()
+    if sender is Agency and kwargs.get('signal') is post_save:
+        # Название агентства входит в закэшированные снимки пользователей
+        invalidate_cached_users(kwargs['instance'].users.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def agency_members_changed(sender, instance, update_fields=None, **kwargs):
+    """Снимок пользователя для PhoneAuthBackend и число пользователей агентства в подсказках"""
+    invalidate_cached_users([instance.pk])
+    # Частые частичные сохранения (last_login и т.п.) не меняют состав агентств
+    if update_fields is not None and 'agency' not in update_fields:
+        return
+    # И при выходе из агентства (agency=None): у прежнего агентства меняется число пользователей
+    bump_autocomplete_version()
+    if kwargs.get('signal') is post_save:
+        # Агентство автора хранится в in-memory индексе поиска и фасетах
+        mark_users_changed([instance.pk])
+
+
+@receiver(post_delete, sender=UserPhoto)
+def user_photo_file_released(sender, instance, **kwargs):
+    """Удаляет файл фото профиля после коммита"""
+    PhotoService.release_user_photo_file(instance)
+
+
+@receiver(post_save, sender=UserPhoto)
+@receiver(post_delete, sender=UserPhoto)
+def user_photo_changed(sender, instance, **kwargs):
+    """Фото профиля входит в закэшированный снимок пользователя"""
+    invalidate_cached_users([instance.user_id])
@@ -0,0 +1,61 @@
+from django import template
+from django.conf import settings
+from django.utils.html import format_html_join
+
+from main.image_pipeline import MIME_TYPES, alternate_path
+
+register = template.Library()
+
+
+@register.simple_tag
+def photo_sources(path, formats):
+    """
+    Элементы <source> для <picture>: тот же файл в форматах formats ("avif,webp").
+    Браузер берет первый поддерживаемый формат, иначе JPEG из вложенного <img>.
+    """
+    if not path or not formats:
+        return ''
+    return format_html_join(
+        '',
+        '<source type="{}" srcset="{}">',
+        (
+            (MIME_TYPES.get(image_format, f'image/{image_format}'), settings.MEDIA_URL + alternate_path(path, image_format))
+            for image_format in formats.split(',') if image_format
+        )
+    )
+
+
+def _srcset(photo, image_format):
+    """srcset из копий PhotoRendition (prefetch_related('renditions')) и самого фото"""
+    if image_format == 'jpeg':
+        full_path = photo.file_path
+    else:
+        full_path = alternate_path(photo.file_path, image_format)
+    if not photo.width:
+        # Копии еще не созданы (optimize_photos --type sizes)
+        return settings.MEDIA_URL + full_path
+    entries = [
+        f'{settings.MEDIA_URL}{rendition.file_path} {rendition.width}w'
+        for rendition in photo.renditions.all() if rendition.format == image_format
+    ]
+    entries.append(f'{settings.MEDIA_URL}{full_path} {photo.width}w')
+    return ', '.join(entries)
+
+
+@register.simple_tag
+def photo_srcset(photo):
+    """Значение srcset для <img>: JPEG-копии фото объявления по ширинам"""
+    return _srcset(photo, 'jpeg')
+
+
+@register.simple_tag
+def responsive_photo_sources(photo, sizes):
+    """Элементы <source> для <picture> со srcset по ширинам в каждом формате фото"""
+    return format_html_join(
+        '',
+        '<source type="{}" srcset="{}" sizes="{}">',
+        (
+            (MIME_TYPES.get(image_format, f'image/{image_format}'), _srcset(photo, image_format), sizes)
+            for image_format in photo.formats.split(',') if image_format
+        )
+    )
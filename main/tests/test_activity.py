@@ -0,0 +1,84 @@
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from main.activity import ActivityBuffer
+from main.models import UserActivity
+
+from .utils import make_user
+
+
+BUFFER_SETTINGS = {
+    'ENABLED': True,
+    'MAX_QUEUE_SIZE': 100,
+    'BATCH_SIZE': 1000,
+    # Фоновый поток не успевает сработать — записи сохраняются только через flush()
+    'FLUSH_INTERVAL': 60.0,
+    'SHUTDOWN_TIMEOUT': 5.0,
+}
+
+
+def activity(user, action_type='view_page'):
+    return UserActivity(user=user, action_type=action_type, description='test')
+
+
+@override_settings(USER_ACTIVITY_BUFFER=BUFFER_SETTINGS)
+class ActivityBufferTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.buffer = ActivityBuffer()
+        self.addCleanup(self.buffer.shutdown)
+
+    def test_records_are_written_on_flush(self):
+        for _ in range(3):
+            self.assertTrue(self.buffer.enqueue(activity(self.user)))
+        self.assertEqual(UserActivity.objects.count(), 0)
+
+        self.buffer.flush()
+
+        self.assertEqual(UserActivity.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(self.buffer.stats()['written'], 3)
+        self.assertEqual(self.buffer.stats()['queued'], 0)
+
+    @override_settings(USER_ACTIVITY_BUFFER={**BUFFER_SETTINGS, 'MAX_QUEUE_SIZE': 2})
+    def test_full_queue_drops_records(self):
+        with self.assertLogs('main.activity', 'WARNING'):
+            results = [self.buffer.enqueue(activity(self.user)) for _ in range(3)]
+
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(self.buffer.stats()['dropped'], 1)
+        self.buffer.flush()
+        self.assertEqual(UserActivity.objects.count(), 2)
+
+    @override_settings(USER_ACTIVITY_BUFFER={**BUFFER_SETTINGS, 'ENABLED': False})
+    def test_disabled_buffer_saves_synchronously(self):
+        self.assertTrue(self.buffer.enqueue(activity(self.user)))
+        self.assertEqual(UserActivity.objects.count(), 1)
+        self.assertIsNone(self.buffer._thread)
+
+
+class ActivityBufferFallbackTests(TransactionTestCase):
+    """Ошибка пачки: записи сохраняются построчно, некорректная пропускается"""
+
+    def test_failed_batch_is_saved_row_by_row(self):
+        user = make_user()
+        buffer = ActivityBuffer()
+        batch = [activity(user), activity(user, action_type=None), activity(user)]
+
+        with self.assertLogs('main.activity', 'WARNING'):
+            buffer._write_batch(batch)
+
+        self.assertEqual(UserActivity.objects.count(), 2)
+        self.assertEqual(buffer.written, 2)
+        self.assertEqual(buffer.failed, 1)
+
+    def test_bulk_insert_error_falls_back_to_single_inserts(self):
+        user = make_user()
+        buffer = ActivityBuffer()
+
+        with mock.patch.object(UserActivity.objects, 'bulk_create', side_effect=RuntimeError('boom')), \
+                self.assertLogs('main.activity', 'WARNING'):
+            buffer._write_batch([activity(user), activity(user)])
+
+        self.assertEqual(UserActivity.objects.count(), 2)
+        self.assertEqual(buffer.failed, 0)
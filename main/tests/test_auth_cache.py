@@ -0,0 +1,90 @@
+from unittest import mock
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+
+from main.admin import UserAdmin
+from main.auth_backends import PhoneAuthBackend, get_user_cache_key
+from main.models import User, UserPhoto
+
+from .utils import LOCMEM_CACHES, make_agency, make_user
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachedUserTests(TestCase):
+    """Снимок пользователя в кэше сбрасывается при изменении входящих в него данных"""
+
+    def setUp(self):
+        cache.clear()
+        self.backend = PhoneAuthBackend()
+        self.agency = make_agency('Агентство')
+        self.user = make_user(agency=self.agency, first_name='Иван')
+        self.cache_key = get_user_cache_key(self.user.pk)
+
+    def load(self):
+        return self.backend.get_user(self.user.pk)
+
+    def assertCached(self):
+        self.assertIsNotNone(cache.get(self.cache_key))
+
+    def assertNotCached(self):
+        self.assertIsNone(cache.get(self.cache_key))
+
+    def test_snapshot_is_cached(self):
+        user = self.load()
+        self.assertEqual(user.agency.name, 'Агентство')
+        self.assertIsNone(user.profile_photo_path)
+        self.assertCached()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.load().pk, self.user.pk)
+
+    def test_missing_user(self):
+        self.assertIsNone(self.backend.get_user(0))
+
+    def test_profile_change_invalidates(self):
+        self.load()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Петр'
+            self.user.save()
+        self.assertNotCached()
+        self.assertEqual(self.load().first_name, 'Петр')
+
+    def test_agency_change_invalidates(self):
+        self.load()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.agency.name = 'Новое название'
+            self.agency.save()
+        self.assertNotCached()
+        self.assertEqual(self.load().agency.name, 'Новое название')
+
+    def test_photo_change_invalidates(self):
+        self.load()
+        with self.captureOnCommitCallbacks(execute=True):
+            UserPhoto.objects.create(
+                user=self.user, file_name='photo.jpg', file_path='user_photos/photo.jpg',
+                file_size=100, mime_type='image/jpeg', original_name='photo.jpg', is_main=True,
+            )
+        self.assertNotCached()
+        self.assertEqual(self.load().profile_photo_path, 'user_photos/photo.jpg')
+
+    def test_privilege_actions_invalidate(self):
+        model_admin = UserAdmin(User, admin.site)
+        request = RequestFactory().post('/')
+        queryset = User.objects.filter(pk=self.user.pk)
+        self.load()
+
+        with mock.patch.object(model_admin, 'message_user'), self.captureOnCommitCallbacks(execute=True):
+            model_admin.make_superuser(request, queryset)
+        self.assertNotCached()
+        self.assertTrue(self.load().is_superuser)
+        # Администраторы не кэшируются
+        self.assertNotCached()
+
+        with mock.patch.object(model_admin, 'message_user'), self.captureOnCommitCallbacks(execute=True):
+            model_admin.make_regular_user(request, queryset)
+        user = self.load()
+        self.assertFalse(user.is_superuser)
+        self.assertFalse(user.is_staff)
+        self.assertCached()
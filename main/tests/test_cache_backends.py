@@ -0,0 +1,128 @@
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from main.cache_backends import SQLiteCache
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        # Счетчики сохраняем сейчас, чтобы atexit не создал файл заново
+        self.cache._flush_stats()
+        self.cache._connection().close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        return SQLiteCache(Path(self.directory) / 'cache.sqlite3', {'OPTIONS': options})
+
+    def later(self, seconds):
+        """Подменяет time.time() моментом через seconds секунд"""
+        return mock.patch('main.cache_backends.time.time', return_value=time.time() + seconds)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+
+        self.cache.set('key', {'value': [1, 2]})
+        self.assertEqual(self.cache.get('key'), {'value': [1, 2]})
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+
+        self.assertTrue(self.cache.delete('key'))
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_expiry(self):
+        self.cache.set('short', 'value', timeout=10)
+        self.cache.set('forever', 'value', timeout=None)
+        self.assertTrue(self.cache.has_key('short'))
+
+        with self.later(11):
+            self.assertFalse(self.cache.has_key('short'))
+            self.assertIsNone(self.cache.get('short'))
+            self.assertEqual(self.cache.get('forever'), 'value')
+        self.assertEqual(self.cache.stats()['expired'], 1)
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('key', 'first', timeout=10))
+        self.assertFalse(self.cache.add('key', 'second', timeout=10))
+        self.assertEqual(self.cache.get('key'), 'first')
+
+        # Просроченная запись не мешает add()
+        with self.later(11):
+            self.assertTrue(self.cache.add('key', 'third', timeout=10))
+        self.assertEqual(self.cache.get('key'), 'third')
+
+    def test_incr(self):
+        with self.assertRaises(ValueError):
+            self.cache.incr('counter')
+        self.cache.set('counter', 1, None)
+        self.assertEqual(self.cache.incr('counter'), 2)
+        self.assertEqual(self.cache.incr('counter', 5), 7)
+        self.assertEqual(self.cache.get('counter'), 7)
+
+        self.cache.set('expiring', 1, timeout=10)
+        with self.later(11), self.assertRaises(ValueError):
+            self.cache.incr('expiring')
+
+    def test_cull_keeps_size_bounded_and_persistent_keys(self):
+        cache = self.make_cache(MAX_ENTRIES=10, CULL_FREQUENCY=2, CULL_EVERY=1)
+        cache.set('generation', 1, None)
+        for index in range(50):
+            cache.set(f'key-{index}', index, timeout=300)
+
+        stats = cache.stats()
+        self.assertLessEqual(stats['entries'], 11)
+        self.assertGreater(stats['evictions'], 0)
+        self.assertEqual(cache.get('generation'), 1)
+        self.assertEqual(cache.get('key-49'), 49)
+
+    def test_cull_removes_expired_before_evicting(self):
+        cache = self.make_cache(MAX_ENTRIES=10, CULL_EVERY=1)
+        for index in range(10):
+            cache.set(f'old-{index}', index, timeout=10)
+        with self.later(11):
+            cache.set('fresh', 'value', timeout=300)
+
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['evictions'], 0)
+
+    def test_cull_every_skips_count(self):
+        cache = self.make_cache(MAX_ENTRIES=5, CULL_EVERY=100)
+        for index in range(20):
+            cache.set(f'key-{index}', index, timeout=300)
+        self.assertEqual(cache.stats()['entries'], 20)
+
+    def test_access_sampling(self):
+        def accessed():
+            return self.cache._connection().execute(
+                "SELECT accessed FROM cache_entries WHERE key = ?", (self.cache.make_key('key'),)
+            ).fetchone()[0]
+
+        self.cache.set('key', 'value', timeout=300)
+        written = accessed()
+
+        self.cache.access_sample_rate = 0
+        with self.later(5):
+            self.cache.get('key')
+        self.assertEqual(accessed(), written)
+
+        self.cache.access_sample_rate = 1
+        with self.later(5):
+            self.cache.get('key')
+        self.assertGreater(accessed(), written)
+
+        # Запись без срока время доступа не обновляет
+        self.cache.set('key', 'value', timeout=None)
+        written = accessed()
+        with self.later(5):
+            self.cache.get('key')
+        self.assertEqual(accessed(), written)
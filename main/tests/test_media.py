@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from .utils import LOCMEM_CACHES
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+HASHED_NAME = '0123456789abcdef0123456789abcdef01234567-89abcdef'
+CONTENT = bytes(range(256)) * 4
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=LOCMEM_CACHES)
+class ServeMediaTests(TestCase):
+    """Заголовки кэширования, условные запросы и диапазоны serve_media"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for path in (
+            f'announcement_photos/{HASHED_NAME}.jpg',
+            'announcement_photos/legacy-photo.jpg',
+            'announcement_photos/originals/source.jpg',
+        ):
+            full_path = os.path.join(MEDIA_ROOT, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'wb') as file:
+                file.write(CONTENT)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def get(self, path, **headers):
+        return self.client.get(f'{settings.MEDIA_URL}{path}', headers=headers)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_hashed_file_is_immutable(self):
+        response = self.get(f'announcement_photos/{HASHED_NAME}.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{HASHED_NAME}"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.body(response), CONTENT)
+
+    def test_legacy_file_revalidates(self):
+        response = self.get('announcement_photos/legacy-photo.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertTrue(response['ETag'])
+
+    def test_not_modified(self):
+        etag = self.get(f'announcement_photos/{HASHED_NAME}.jpg')['ETag']
+        response = self.get(f'announcement_photos/{HASHED_NAME}.jpg', if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_range(self):
+        response = self.get(f'announcement_photos/{HASHED_NAME}.jpg', range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(CONTENT)}')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), CONTENT[10:20])
+
+        response = self.get(f'announcement_photos/{HASHED_NAME}.jpg', range='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), CONTENT[-5:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(f'announcement_photos/{HASHED_NAME}.jpg', range=f'bytes={len(CONTENT)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(CONTENT)}')
+
+    def test_invalid_range_is_ignored(self):
+        for header in ('bytes=5-3', 'bytes=0-1,5-6', 'items=0-1'):
+            response = self.get(f'announcement_photos/{HASHED_NAME}.jpg', range=header)
+            self.assertEqual(response.status_code, 200, header)
+            self.assertEqual(self.body(response), CONTENT)
+
+    def test_stale_if_range_returns_full_file(self):
+        response = self.get(
+            f'announcement_photos/{HASHED_NAME}.jpg', range='bytes=0-9', if_range='"other"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), CONTENT)
+
+    def test_private_and_missing_files(self):
+        self.assertEqual(self.get('announcement_photos/originals/source.jpg').status_code, 404)
+        self.assertEqual(self.get('announcement_photos/x/../originals/source.jpg').status_code, 404)
+        self.assertEqual(self.get('announcement_photos/missing.jpg').status_code, 404)
+
+    @override_settings(MEDIA_SERVING={'ACCEL_REDIRECT': '/protected-media/'})
+    def test_accel_redirect(self):
+        response = self.get(f'announcement_photos/{HASHED_NAME}.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['X-Accel-Redirect'], f'/protected-media/announcement_photos/{HASHED_NAME}.jpg'
+        )
+        self.assertEqual(response.content, b'')
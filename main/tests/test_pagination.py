@@ -0,0 +1,65 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.test import SimpleTestCase, TestCase
+
+from main.models import Announcement
+from main.pagination import (
+    LAST_PAGE_CURSOR, NEXT, PREVIOUS, KeysetPaginator, decode_cursor, encode_cursor
+)
+
+from .utils import make_announcement, make_user
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        created_at = datetime(2025, 3, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        for direction in (NEXT, PREVIOUS):
+            token = encode_cursor(created_at, 42, direction)
+            self.assertEqual(decode_cursor(token), (created_at, 42, direction))
+
+    def test_invalid_tokens(self):
+        for token in ('', None, 'garbage', encode_cursor(datetime(2025, 1, 1), 1, 'sideways')):
+            self.assertIsNone(decode_cursor(token))
+
+
+class KeysetPaginatorTests(TestCase):
+    """Страницы не теряют и не повторяют строки при одинаковом created_at"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = make_user()
+        for _ in range(7):
+            make_announcement(user)
+        # Четыре объявления с одним created_at: порядок внутри решает id
+        same_time = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        ids = list(Announcement.objects.order_by('id').values_list('id', flat=True))
+        Announcement.objects.filter(id__in=ids[1:5]).update(created_at=same_time)
+        cls.expected = list(Announcement.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def paginator(self):
+        return KeysetPaginator(Announcement.objects.all(), per_page=3)
+
+    def test_forward_pages_cover_all_rows_once(self):
+        seen = []
+        page = self.paginator().page(None)
+        while True:
+            seen.extend(item.pk for item in page)
+            if not page.has_next():
+                break
+            page = self.paginator().page(page.next_cursor)
+        self.assertEqual(seen, self.expected)
+
+    def test_previous_cursor_returns_previous_page(self):
+        first = self.paginator().page(None)
+        second = self.paginator().page(first.next_cursor)
+        back = self.paginator().page(second.previous_cursor)
+
+        self.assertEqual([item.pk for item in back], [item.pk for item in first])
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_last_page(self):
+        page = self.paginator().page(LAST_PAGE_CURSOR)
+        self.assertEqual([item.pk for item in page], self.expected[-3:])
+        self.assertFalse(page.has_next())
+        self.assertTrue(page.has_previous())
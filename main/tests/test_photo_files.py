@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+
+from main.models import Photo, PhotoFileLock
+from main.services import PhotoService
+
+from .utils import LOCMEM_CACHES, make_announcement, make_jpeg, make_user
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES=LOCMEM_CACHES,
+    PHOTO_PROCESSING={'MODE': 'inline', 'WORKERS': 1, 'MAX_ATTEMPTS': 3, 'STALE_AFTER': 600},
+)
+class SharedPhotoFilesTests(TestCase):
+    """Фото с одинаковым содержимым делят файлы; файлы удаляются с последней ссылкой"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        user = make_user()
+        self.first_announcement = make_announcement(user)
+        self.second_announcement = make_announcement(user)
+        self.data = make_jpeg((1200, 900))
+
+    def save_photo(self, announcement):
+        upload = SimpleUploadedFile('photo.jpg', self.data, content_type='image/jpeg')
+        with self.captureOnCommitCallbacks(execute=True):
+            return PhotoService.save_announcement_photo(announcement, upload)
+
+    def stored_paths(self, photo):
+        paths = [photo.file_path, photo.thumbnail_path]
+        paths.extend(photo.renditions.values_list('file_path', flat=True))
+        return paths
+
+    def assertFilesExist(self, paths, exist=True):
+        for path in paths:
+            self.assertEqual(os.path.exists(os.path.join(MEDIA_ROOT, path)), exist, path)
+
+    def test_same_content_shares_files(self):
+        first = self.save_photo(self.first_announcement)
+        second = self.save_photo(self.second_announcement)
+
+        self.assertEqual(first.status, Photo.STATUS_READY)
+        self.assertEqual(second.status, Photo.STATUS_READY)
+        self.assertEqual(first.file_path, second.file_path)
+        self.assertEqual(first.thumbnail_path, second.thumbnail_path)
+        self.assertEqual(
+            sorted(first.renditions.values_list('file_path', flat=True)),
+            sorted(second.renditions.values_list('file_path', flat=True)),
+        )
+        self.assertTrue(first.file_path.startswith('announcement_photos/'))
+        self.assertIsNone(first.source_path)
+
+        key = PhotoService.get_storage_key_of(first.file_path)
+        self.assertEqual(key, PhotoService.get_storage_key(first.content_hash))
+        self.assertTrue(PhotoFileLock.objects.filter(key=key).exists())
+
+    def test_files_deleted_with_last_reference(self):
+        first = self.save_photo(self.first_announcement)
+        second = self.save_photo(self.second_announcement)
+        paths = self.stored_paths(first)
+        self.assertFilesExist(paths)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertFilesExist(paths)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFilesExist(paths, exist=False)
+
+    def test_deleting_announcement_keeps_files_of_other_photo(self):
+        first = self.save_photo(self.first_announcement)
+        self.save_photo(self.second_announcement)
+        paths = self.stored_paths(first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first_announcement.delete()
+        self.assertFilesExist(paths)
+
+    def test_missing_shared_files_are_recreated(self):
+        first = self.save_photo(self.first_announcement)
+        os.remove(os.path.join(MEDIA_ROOT, first.file_path))
+
+        second = self.save_photo(self.second_announcement)
+        self.assertEqual(second.status, Photo.STATUS_READY)
+        self.assertFilesExist([second.file_path])
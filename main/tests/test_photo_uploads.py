@@ -0,0 +1,113 @@
+import hashlib
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .utils import LOCMEM_CACHES, make_jpeg, make_user
+
+
+SPOOL_DIR = tempfile.mkdtemp()
+CHUNK_SIZE = 4096
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    PHOTO_UPLOADS={'SPOOL_DIR': SPOOL_DIR, 'CHUNK_SIZE': CHUNK_SIZE, 'EXPIRE_AFTER': 60},
+)
+class ChunkedUploadTests(TestCase):
+    """Загрузка частями: смещение проверяется сервером, загрузку можно продолжить"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(SPOOL_DIR, ignore_errors=True)
+
+    def setUp(self):
+        # id пользователей повторяются после отката — снимки прошлых тестов не нужны
+        cache.clear()
+        self.client.force_login(make_user())
+        self.data = make_jpeg((400, 300))
+        self.assertGreater(len(self.data), 2 * CHUNK_SIZE)
+
+    def start(self, checksum=''):
+        response = self.client.post(reverse('photo_upload_start'), {
+            'name': 'photo.jpg', 'size': len(self.data), 'type': 'image/jpeg', 'checksum': checksum,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['chunk_size'], CHUNK_SIZE)
+        return reverse('photo_upload_chunk', args=[response.json()['id']])
+
+    def put(self, url, offset, data=None, checksum=None):
+        if data is None:
+            data = self.data[offset:offset + CHUNK_SIZE]
+        headers = {'Upload-Offset': str(offset)}
+        if checksum:
+            headers['Upload-Checksum'] = checksum
+        return self.client.put(url, data, content_type='application/octet-stream', headers=headers)
+
+    def upload_from(self, url, offset):
+        while True:
+            response = self.put(url, offset)
+            self.assertEqual(response.status_code, 200, response.content)
+            offset = response.json()['offset']
+            if response.json()['complete']:
+                return response
+
+    def test_complete_upload(self):
+        url = self.start(checksum=hashlib.sha256(self.data).hexdigest())
+        self.upload_from(url, 0)
+
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {
+            'success': True, 'id': response.json()['id'], 'offset': len(self.data), 'complete': True,
+        })
+
+    def test_offset_mismatch_and_resume(self):
+        url = self.start()
+        self.assertEqual(self.put(url, 0).json()['offset'], CHUNK_SIZE)
+
+        # Повтор уже принятой части и пропуск части отклоняются с offset сервера
+        for offset in (0, 2 * CHUNK_SIZE):
+            response = self.put(url, offset)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json()['offset'], CHUNK_SIZE)
+            self.assertFalse(response.json()['complete'])
+
+        # После обрыва клиент узнает offset и продолжает с него
+        response = self.client.get(url)
+        self.assertEqual(response.json()['offset'], CHUNK_SIZE)
+        self.upload_from(url, response.json()['offset'])
+
+        response = self.put(url, len(self.data) - 1, data=b'x')
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(response.json()['complete'])
+
+    def test_chunk_checksum_mismatch(self):
+        url = self.start()
+        chunk = self.data[:CHUNK_SIZE]
+
+        response = self.put(url, 0, checksum=hashlib.sha256(b'other').hexdigest())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['offset'], 0)
+
+        response = self.put(url, 0, checksum=hashlib.sha256(chunk).hexdigest())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['offset'], CHUNK_SIZE)
+
+    def test_file_checksum_mismatch_restarts_upload(self):
+        url = self.start(checksum=hashlib.sha256(b'other').hexdigest())
+        offset = 0
+        while offset + CHUNK_SIZE < len(self.data):
+            offset = self.put(url, offset).json()['offset']
+
+        response = self.put(url, offset)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).json()['offset'], 0)
+
+    def test_other_users_upload_not_found(self):
+        url = self.start()
+        self.client.force_login(make_user())
+        self.assertEqual(self.client.get(url).status_code, 404)
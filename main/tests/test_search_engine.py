@@ -0,0 +1,88 @@
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.test import TestCase, override_settings
+
+from main.models import Announcement
+from main.search_engine import SearchEngine, np
+from main.services import AnnouncementService
+
+from .utils import LOCMEM_CACHES, make_agency, make_announcement, make_user
+
+
+@skipUnless(np is not None, 'NumPy не установлен')
+@override_settings(
+    SEARCH_ENGINE={'BACKEND': 'memory', 'SYNC_INTERVAL': 0},
+    CACHES=LOCMEM_CACHES,
+)
+class SearchEngineSyncTests(TestCase):
+    """Результаты in-memory индекса совпадают с запросом к БД после изменений"""
+
+    def setUp(self):
+        self.engine = SearchEngine()
+        self.agency = make_agency('Первое')
+        self.other_agency = make_agency('Второе')
+        self.user = make_user(agency=self.agency)
+        self.other_user = make_user(agency=self.other_agency)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cheap = make_announcement(self.user, price=20000000)
+            self.middle = make_announcement(self.user, price=35000000)
+            self.expensive = make_announcement(self.other_user, price=50000000, microdistrict='Есиль')
+
+    def engine_ids(self, filters):
+        result = self.engine.search(Announcement.objects.all(), filters)
+        self.assertIsNotNone(result)
+        return [int(pk) for pk in result.ids]
+
+    def orm_ids(self, filters):
+        queryset = AnnouncementService.filter_announcements(
+            Announcement.objects.filter(is_archived=False), filters
+        )
+        return list(queryset.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def assertMatchesOrm(self, filters):
+        self.assertEqual(self.engine_ids(filters), self.orm_ids(filters))
+
+    def test_matches_orm_after_changes(self):
+        filters_list = [{}, {'price_from': 30000000}, {'microdistrict': 'Есиль'}, {'agency': self.agency.pk}]
+        for filters in filters_list:
+            self.assertMatchesOrm(filters)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cheap.price = 40000000
+            self.cheap.save()
+            self.middle.is_archived = True
+            self.middle.save()
+            make_announcement(self.other_user, price=31000000)
+        for filters in filters_list:
+            self.assertMatchesOrm(filters)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.expensive.delete()
+        for filters in filters_list:
+            self.assertMatchesOrm(filters)
+        self.assertNotIn(self.expensive.pk, self.engine_ids({}))
+
+    def test_sync_picks_up_rows_committed_late(self):
+        """Строка с updated_at раньше последней синхронизации (долгая транзакция) не теряется"""
+        self.engine_ids({})
+        late = self.engine._synced_until - timedelta(seconds=60)
+        Announcement.objects.filter(pk=self.cheap.pk).update(price=60000000, updated_at=late)
+
+        self.assertIn(self.cheap.pk, self.engine_ids({'price_from': 55000000}))
+        self.assertMatchesOrm({'price_from': 55000000})
+
+    def test_sync_without_changes_keeps_store(self):
+        self.engine_ids({})
+        store = self.engine._store
+        self.engine_ids({})
+        self.assertIs(self.engine._store, store)
+
+    def test_agency_change_is_synced(self):
+        self.assertEqual(self.engine_ids({'agency': self.other_agency.pk}), [self.expensive.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.agency = self.other_agency
+            self.user.save()
+        self.assertMatchesOrm({'agency': self.other_agency.pk})
+        self.assertEqual(self.engine_ids({'agency': self.agency.pk}), [])
@@ -0,0 +1,46 @@
+"""Общие данные и настройки тестов приложения main"""
+import io
+import itertools
+
+from PIL import Image
+
+from main.models import Address, Agency, Announcement, User
+
+
+# Тесты не трогают общий файловый кэш хоста (SQLiteCache)
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+_phones = itertools.count(700000001)
+
+
+def make_agency(name='Агентство'):
+    return Agency.objects.create(name=name)
+
+
+def make_user(agency=None, **fields):
+    if agency is None:
+        agency = make_agency()
+    return User.objects.create_user(
+        phone=f'+7{next(_phones)}', password='password', agency=agency, **fields
+    )
+
+
+def make_announcement(user, microdistrict='Центр', complex_name=None, **fields):
+    address = Address.objects.create(microdistrict=microdistrict, complex_name=complex_name)
+    values = {'rooms_count': 2, 'price': 30000000, 'area': 60}
+    values.update(fields)
+    return Announcement.objects.create(user=user, address=address, **values)
+
+
+def make_jpeg(size=(640, 480), color=(40, 120, 200)):
+    """Байты JPEG: градиент, чтобы у изображения был осмысленный dHash"""
+    image = Image.new('RGB', size, color)
+    pixels = image.load()
+    for x in range(size[0]):
+        for y in range(0, size[1], 4):
+            pixels[x, y] = (x % 256, y % 256, (x + y) % 256)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
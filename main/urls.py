@@ -29,6 +29,9 @@ urlpatterns = [
     path('ajax/create-collection/', views.create_collection_ajax, name='create_collection_ajax'),
     path('ajax/announcement-collections/<int:announcement_id>/', views.get_announcement_collections, name='get_announcement_collections'),
     
+    # AJAX URL for search filter facet counts
+    path('ajax/announcement-facets/', views.announcement_facets, name='announcement_facets'),
+    
     # AJAX URLs for agency autocomplete
     path('ajax/agency-autocomplete/', views.agency_autocomplete, name='agency_autocomplete'),
     
@@ -39,5 +42,7 @@ urlpatterns = [
     path('account/', views.AccountView.as_view(), name='account'),
     path('account/delete/', views.account_delete, name='account_delete'),
     path('ajax/upload-user-photo/', views.upload_user_photo, name='upload_user_photo'),
+    path('ajax/photo-uploads/', views.photo_upload_start, name='photo_upload_start'),
+    path('ajax/photo-uploads/<uuid:upload_id>/', views.photo_upload_chunk, name='photo_upload_chunk'),
 ]
 
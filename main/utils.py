@@ -1,13 +1,16 @@
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.conf import settings
-from .models import Photo, UserPhoto
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from .models import Photo, PhotoRendition, UserPhoto
 import os
 from PIL import Image
 import io
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from django.db import transaction
 from .models import UserActivity
+from .activity import activity_buffer
 import logging
 
 
@@ -17,56 +20,29 @@ logger = logging.getLogger(__name__)
 
 def get_photo_stats():
     """
-    Get statistics about photo optimization
+    Get statistics about photo optimization.
+    One aggregate query per table: rows are not loaded into Python.
     """
-    stats = {
-        'announcement_photos': {
-            'count': 0,
-            'total_size': 0,
-            'optimized_count': 0,
-            'thumbnails_count': 0,
-            'average_size': 0
-        },
-        'user_photos': {
-            'count': 0,
-            'total_size': 0,
-            'optimized_count': 0,
-            'average_size': 0
-        }
-    }
-    
-    # Announcement photos stats
-    announcement_photos = Photo.objects.all()
-    for photo in announcement_photos:
-        stats['announcement_photos']['count'] += 1
-        stats['announcement_photos']['total_size'] += photo.file_size or 0
-        
-        if photo.thumbnail_path:
-            stats['announcement_photos']['thumbnails_count'] += 1
-            
-        if photo.mime_type == 'image/jpeg':
-            stats['announcement_photos']['optimized_count'] += 1
-    
-    if stats['announcement_photos']['count'] > 0:
-        stats['announcement_photos']['average_size'] = (
-            stats['announcement_photos']['total_size'] / stats['announcement_photos']['count']
-        )
-    
-    # User photos stats
-    user_photos = UserPhoto.objects.all()
-    for photo in user_photos:
-        stats['user_photos']['count'] += 1
-        stats['user_photos']['total_size'] += photo.file_size or 0
-        
-        if photo.mime_type == 'image/jpeg':
-            stats['user_photos']['optimized_count'] += 1
-    
-    if stats['user_photos']['count'] > 0:
-        stats['user_photos']['average_size'] = (
-            stats['user_photos']['total_size'] / stats['user_photos']['count']
-        )
+    announcement = Photo.objects.aggregate(
+        count=Count('id'),
+        total_size=Coalesce(Sum('file_size'), 0),
+        optimized_count=Count('id', filter=Q(mime_type='image/jpeg')),
+        thumbnails_count=Count('id', filter=Q(thumbnail_path__isnull=False)),
+        thumbnails_size=Coalesce(Sum('thumbnail_size'), 0),
+        pending_count=Count('id', filter=~Q(status=Photo.STATUS_READY)),
+    )
+    user = UserPhoto.objects.aggregate(
+        count=Count('id'),
+        total_size=Coalesce(Sum('file_size'), 0),
+        optimized_count=Count('id', filter=Q(mime_type='image/jpeg')),
+    )
+    for stats in (announcement, user):
+        stats['average_size'] = stats['total_size'] / stats['count'] if stats['count'] else 0
     
-    return stats
+    return {
+        'announcement_photos': announcement,
+        'user_photos': user,
+    }
 
 
 def format_file_size(size_bytes):
@@ -84,11 +60,12 @@ def format_file_size(size_bytes):
     return f"{size_bytes:.1f} TB"
 
 
-def estimate_storage_savings():
+def estimate_storage_savings(stats=None):
     """
     Estimate storage savings from optimization
     """
-    stats = get_photo_stats()
+    if stats is None:
+        stats = get_photo_stats()
     
     # Estimate unoptimized size (assuming 3MB average for announcement photos, 1MB for user photos)
     estimated_unoptimized_announcement = stats['announcement_photos']['count'] * 3 * 1024 * 1024  # 3MB each
@@ -111,6 +88,93 @@ def estimate_storage_savings():
     }
 
 
+STORAGE_REPORT_CACHE_KEY = 'storage_report'
+STORAGE_REPORT_TIMEOUT = 600  # сек.
+
+
+def get_storage_report(refresh=False, users_limit=20):
+    """
+    Отчет о хранилище фото для manage.py storage_report: итоги по таблицам,
+    по видам файлов (полное фото, миниатюра, ширины srcset по форматам) и
+    пользователи с наибольшим объемом. Все суммы считаются агрегатными
+    запросами с GROUP BY; отчет кэшируется на STORAGE_REPORT_TIMEOUT.
+    """
+    cache_key = f'{STORAGE_REPORT_CACHE_KEY}_{users_limit}'
+    if not refresh:
+        report = cache.get(cache_key)
+        if report is not None:
+            return report
+    
+    stats = get_photo_stats()
+    
+    # Фото с одинаковым содержимым ссылаются на одни файлы: на диске каждый путь один раз
+    stored = Photo.objects.filter(status=Photo.STATUS_READY).order_by().values(
+        'file_path', 'file_size', 'thumbnail_size'
+    ).distinct().aggregate(
+        files=Count('file_path'),
+        size=Coalesce(Sum('file_size'), 0),
+        thumbnails_size=Coalesce(Sum('thumbnail_size'), 0),
+    )
+    
+    renditions = [
+        {'name': 'full', 'count': stats['announcement_photos']['count'],
+         'total_size': stats['announcement_photos']['total_size']},
+        {'name': 'thumbnail', 'count': stats['announcement_photos']['thumbnails_count'],
+         'total_size': stats['announcement_photos']['thumbnails_size']},
+    ]
+    renditions.extend(
+        {'name': f"{row['width']}w {row['format']}", **row}
+        for row in PhotoRendition.objects.order_by('width', 'format').values('width', 'format').annotate(
+            count=Count('id'),
+            files=Count('file_path', distinct=True),
+            total_size=Sum('file_size'),
+        )
+    )
+    
+    users = list(
+        Photo.objects.order_by().values(user_id=F('announcement__user_id')).annotate(
+            photos=Count('id'),
+            photos_size=Coalesce(Sum('file_size'), 0),
+            thumbnails_size=Coalesce(Sum('thumbnail_size'), 0),
+        ).order_by('-photos_size')[:users_limit]
+    )
+    user_ids = [row['user_id'] for row in users]
+    renditions_size = dict(
+        PhotoRendition.objects.filter(photo__announcement__user_id__in=user_ids).order_by().values_list(
+            'photo__announcement__user_id'
+        ).annotate(size=Sum('file_size'))
+    )
+    profile_size = dict(
+        UserPhoto.objects.filter(user_id__in=user_ids).order_by().values_list('user_id').annotate(
+            size=Sum('file_size')
+        )
+    )
+    names = {
+        row['id']: row for row in User.objects.filter(pk__in=user_ids).values(
+            'id', 'first_name', 'last_name', 'phone'
+        )
+    }
+    for row in users:
+        user = names.get(row['user_id'], {})
+        row['name'] = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip() or user.get('phone', '')
+        row['renditions_size'] = renditions_size.get(row['user_id'], 0)
+        row['user_photos_size'] = profile_size.get(row['user_id'], 0)
+        row['total_size'] = (
+            row['photos_size'] + row['thumbnails_size'] + row['renditions_size'] + row['user_photos_size']
+        )
+    
+    report = {
+        'generated_at': timezone.now(),
+        'photos': stats,
+        'stored': stored,
+        'renditions': renditions,
+        'users': users,
+        'savings': estimate_storage_savings(stats),
+    }
+    cache.set(cache_key, report, STORAGE_REPORT_TIMEOUT)
+    return report
+
+
 def validate_image_file(file):
     """
     Validate uploaded image file
@@ -186,30 +250,32 @@ def log_user_activity(user, action_type, description=None, metadata=None,
         error_message: Сообщение об ошибке (если есть)
     """
     try:
-        with transaction.atomic():
-            activity_data = {
-                'user': user,
-                'action_type': action_type,
-                'description': description,
-                'metadata': metadata,
-                'related_announcement': related_announcement,
-                'related_collection': related_collection,
-                'is_successful': is_successful,
-                'error_message': error_message,
-                'timestamp': timezone.now()
-            }
-            
-            # Добавляем данные из запроса если он предоставлен
-            if request:
-                activity_data.update({
-                    'ip_address': get_client_ip(request),
-                    'user_agent': request.META.get('HTTP_USER_AGENT', ''),
-                    'session_key': request.session.session_key if hasattr(request, 'session') else None,
-                    'page_url': request.build_absolute_uri() if hasattr(request, 'build_absolute_uri') else None,
-                    'referrer': request.META.get('HTTP_REFERER', ''),
-                })
-            
-            UserActivity.objects.create(**activity_data)
+        # Связанные объекты передаем по id: запись сохраняется позже фоновым
+        # потоком, когда объект в памяти уже может быть удален
+        activity_data = {
+            'user_id': user.pk,
+            'action_type': action_type,
+            'description': description,
+            'metadata': metadata,
+            'related_announcement_id': related_announcement.pk if related_announcement else None,
+            'related_collection_id': related_collection.pk if related_collection else None,
+            'is_successful': is_successful,
+            'error_message': error_message,
+            'timestamp': timezone.now()
+        }
+        
+        # Добавляем данные из запроса если он предоставлен
+        if request:
+            activity_data.update({
+                'ip_address': get_client_ip(request),
+                'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+                'session_key': request.session.session_key if hasattr(request, 'session') else None,
+                'page_url': request.build_absolute_uri() if hasattr(request, 'build_absolute_uri') else None,
+                'referrer': request.META.get('HTTP_REFERER', ''),
+            })
+        
+        # Запись уходит в очередь и сохраняется пачкой в фоне (см. main.activity)
+        activity_buffer.enqueue(UserActivity(**activity_data))
             
     except Exception as e:
         logger.error(f"Ошибка при логировании активности пользователя: {e}")
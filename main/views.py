@@ -6,7 +6,7 @@ from django.contrib import messages
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.views import View
 from django.urls import reverse_lazy, reverse
-from django.db.models import Q, F
+from django.db.models import prefetch_related_objects
 from django.http import JsonResponse, Http404
 from django.core.paginator import Paginator
 from django.views.decorators.csrf import csrf_exempt
@@ -14,15 +14,19 @@ from django.utils.decorators import method_decorator
 from django.conf import settings
 import json
 
-from .models import Announcement, Collection, User, Agency, Photo
+from .models import Announcement, Collection, User, Agency, Photo, PhotoUpload
 from .forms import (
     UserRegistrationForm, PhoneLoginForm, AnnouncementForm, 
     CollectionForm, SearchForm
 )
 from .services import (
     UserService, AnnouncementService, CollectionService, 
-    AgencyService, PhotoService, UserSessionService, PageViewService
+    AgencyService, PhotoService, PhotoUploadService, UserSessionService, PageViewService
 )
+from .autocomplete import search_agencies, search_complexes
+from .duplicates import find_duplicate_announcements
+from .pagination import KeysetPaginator
+from .search_engine import get_listings_generation
 from .utils import (
     log_login, log_logout, log_announcement_action, 
     log_collection_action, log_search_action, log_filter_action,
@@ -35,17 +39,8 @@ def agency_autocomplete(request):
     if request.method == 'GET':
         query = request.GET.get('query', '').strip()
         if len(query) >= 1:  # Начинаем поиск с первого символа
-            agencies = Agency.objects.filter(
-                name__icontains=query
-            )[:10]  # Ограничиваем результат 10 агентствами
-            
-            suggestions = []
-            for agency in agencies:
-                suggestions.append({
-                    'id': agency.id,
-                    'name': agency.name,
-                    'users_count': agency.users.count()  # Количество пользователей в агентстве
-                })
+            # Индекс в памяти с заранее посчитанным числом пользователей, без запросов к БД
+            suggestions = search_agencies(query, limit=10)
             
             return JsonResponse({
                 'suggestions': suggestions,
@@ -60,20 +55,8 @@ def complex_autocomplete(request):
     if request.method == 'GET':
         query = request.GET.get('query', '').strip()
         if len(query) >= 1:  # Начинаем поиск с первого символа
-            from .models import Address
-            # Получаем уникальные названия жилых комплексов
-            complexes = Address.objects.filter(
-                complex_name__icontains=query,
-                complex_name__isnull=False
-            ).exclude(
-                complex_name__exact=''
-            ).values_list('complex_name', flat=True).distinct()[:10]
-            
-            suggestions = []
-            for complex_name in complexes:
-                suggestions.append({
-                    'name': complex_name,
-                })
+            # Справочник ЖК и уникальные названия из адресов — индекс в памяти
+            suggestions = search_complexes(query, limit=10)
             
             return JsonResponse({
                 'suggestions': suggestions,
@@ -179,7 +162,7 @@ class UserRegistrationView(View):
                 )
                 
                 # Авторизуем пользователя с указанием backend
-                user.backend = 'django.contrib.auth.backends.ModelBackend'
+                user.backend = 'main.auth_backends.PhoneAuthBackend'
                 login(request, user)
                 UserSessionService.create_session(user, request.session.session_key)
                 
@@ -211,118 +194,15 @@ class AnnouncementListView(ListView):
     paginate_by = 12
 
     def get_queryset(self):
-        queryset = AnnouncementService.get_all_announcements()
-        
         # Handle search with new advanced filters
         form = SearchForm(self.request.GET)
-        if form.is_valid():
-            # Количество комнат (множественный выбор)
-            rooms_count = form.cleaned_data.get('rooms_count')
-            if rooms_count:
-                room_filters = Q()
-                for room in rooms_count:
-                    if room == '5+':
-                        room_filters |= Q(rooms_count__gte=5)
-                    else:
-                        room_filters |= Q(rooms_count=int(room))
-                queryset = queryset.filter(room_filters)
-            
-            # Цена
-            price_from = form.cleaned_data.get('price_from')
-            price_to = form.cleaned_data.get('price_to')
-            if price_from:
-                queryset = queryset.filter(price__gte=price_from)
-            if price_to:
-                queryset = queryset.filter(price__lte=price_to)
-            
-            # Цена за м² (вычисляемое поле)
-            price_per_sqm_from = form.cleaned_data.get('price_per_sqm_from')
-            price_per_sqm_to = form.cleaned_data.get('price_per_sqm_to')
-            if price_per_sqm_from:
-                # price / area >= price_per_sqm_from
-                # price >= price_per_sqm_from * area
-                queryset = queryset.extra(
-                    where=["price / area >= %s"],
-                    params=[price_per_sqm_from]
-                )
-            if price_per_sqm_to:
-                # price / area <= price_per_sqm_to
-                queryset = queryset.extra(
-                    where=["price / area <= %s"],
-                    params=[price_per_sqm_to]
-                )
-            
-            # Микрорайон
-            microdistrict = form.cleaned_data.get('microdistrict')
-            if microdistrict:
-                queryset = queryset.filter(address__microdistrict=microdistrict)
-            
-            # Тип дома
-            building_type = form.cleaned_data.get('building_type')
-            if building_type:
-                queryset = queryset.filter(building_type=building_type)
-            
-            # Год постройки
-            year_built_from = form.cleaned_data.get('year_built_from')
-            year_built_to = form.cleaned_data.get('year_built_to')
-            if year_built_from:
-                queryset = queryset.filter(year_built__gte=year_built_from)
-            if year_built_to:
-                queryset = queryset.filter(year_built__lte=year_built_to)
-            
-            # Жилой комплекс
-            complex_name = form.cleaned_data.get('complex_name')
-            if complex_name:
-                queryset = queryset.filter(address__complex_name__exact=complex_name)
-            
-            # Площадь
-            area_from = form.cleaned_data.get('area_from')
-            area_to = form.cleaned_data.get('area_to')
-            if area_from:
-                queryset = queryset.filter(area__gte=area_from)
-            if area_to:
-                queryset = queryset.filter(area__lte=area_to)
-            
-            # Этаж
-            floor_from = form.cleaned_data.get('floor_from')
-            floor_to = form.cleaned_data.get('floor_to')
-            if floor_from:
-                queryset = queryset.filter(floor__gte=floor_from)
-            if floor_to:
-                queryset = queryset.filter(floor__lte=floor_to)
-            
-            # Не первый этаж
-            not_first_floor = form.cleaned_data.get('not_first_floor')
-            if not_first_floor:
-                queryset = queryset.filter(floor__gt=1)
-            
-            # Не последний этаж
-            not_last_floor = form.cleaned_data.get('not_last_floor')
-            if not_last_floor:
-                queryset = queryset.exclude(floor=F('total_floors'))
-            
-            # Только новостройки
-            is_new_building = form.cleaned_data.get('is_new_building')
-            if is_new_building:
-                queryset = queryset.filter(is_new_building=True)
-            
-            # Только предложения от агентства
-            agency_only = form.cleaned_data.get('agency_only')
-            if agency_only:
-                # Показываем только объявления где партнер дополнительно платит вознаграждение
-                # Это третий вариант комиссии: 'buyer' - "Я беру с продавца, вы - с покупателя и я дополнительно доплачиваю вам"
-                queryset = queryset.filter(commission_type='buyer')
-            
-            # Фильтр по агентству
-            agency = form.cleaned_data.get('agency')
-            if agency:
-                queryset = queryset.filter(user__agency=agency)
-            
-            # Фильтр по опорным точкам
-            landmarks = form.cleaned_data.get('landmarks')
-            if landmarks:
-                queryset = queryset.filter(landmarks__in=landmarks)
-            
+        filters = form.cleaned_data if form.is_valid() else {}
+        self.search_filters = filters
+        
+        # QuerySet или SearchResult in-memory движка — оба пагинируются одинаково
+        queryset = AnnouncementService.search_announcements(filters)
+        
+        if filters:
             # Log search/filter activity
             if self.request.user.is_authenticated:
                 search_params = {}
@@ -336,15 +216,46 @@ class AnnouncementListView(ListView):
         
         return queryset
 
+    def get_pagination_mode(self):
+        """
+        Режим пагинации: 'keyset' (по курсору) или 'offset' (номер страницы).
+        Старые ссылки с ?page= продолжают работать в режиме offset.
+        """
+        if 'page' in self.request.GET and 'cursor' not in self.request.GET:
+            return 'offset'
+        return getattr(settings, 'ANNOUNCEMENT_LIST_PAGINATION', {}).get('MODE', 'keyset')
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.get_pagination_mode() != 'keyset':
+            return super().paginate_queryset(queryset, page_size)
+        
+        # Keyset: страница выбирается по (created_at, id) без OFFSET и COUNT(*).
+        # Оценка количества кэшируется по фильтрам и поколению объявлений
+        paginator = KeysetPaginator(
+            queryset,
+            page_size,
+            approximate_total=getattr(settings, 'ANNOUNCEMENT_LIST_PAGINATION', {}).get('APPROXIMATE_TOTAL', True),
+            total_cache_key=(
+                f"announcement_count_estimate_{get_listings_generation()}_"
+                f"{AnnouncementService.get_filters_signature(self.search_filters)}"
+            ),
+        )
+        page = paginator.page(self.request.GET.get('cursor'))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search_form'] = SearchForm(self.request.GET)
+        context['pagination_mode'] = self.get_pagination_mode()
+        # Количество результатов по значениям фильтров (кэшируется по набору фильтров)
+        context['facets'] = AnnouncementService.get_facet_counts(self.search_filters)
         
-        # Добавляем информацию о коллекциях для каждого объявления
+        # Добавляем информацию о коллекциях для каждого объявления (один запрос на страницу)
         if self.request.user.is_authenticated:
             announcements = context['announcements']
+            collections_map = CollectionService.get_announcements_collections_map(announcements, self.request.user)
             for announcement in announcements:
-                announcement.user_collections = CollectionService.get_announcement_collections(announcement, self.request.user)
+                announcement.user_collections = collections_map[announcement.pk]
         
         return context
 
@@ -360,6 +271,8 @@ class AnnouncementDetailView(DetailView):
         announcement = AnnouncementService.get_announcement_by_id(self.kwargs['pk'])
         if announcement is None:
             raise Http404("Announcement does not exist")
+        # Фото с копиями для srcset — одним запросом на каждую таблицу
+        prefetch_related_objects([announcement], 'photos__renditions')
         return announcement
 
     def get_context_data(self, **kwargs):
@@ -372,6 +285,8 @@ class AnnouncementDetailView(DetailView):
             context['user_collections'] = CollectionService.get_user_collections(self.request.user)
             # Добавляем информацию о том, в каких коллекциях уже находится объявление
             context['announcement_collections'] = CollectionService.get_announcement_collections(self.object, self.request.user)
+            # Объявления других агентов с теми же фото — по индексу перцептивных хэшей
+            context['possible_duplicates'] = find_duplicate_announcements(self.object)
         
         # Log announcement view
         if self.request.user.is_authenticated:
@@ -416,8 +331,13 @@ class AnnouncementCreateView(LoginRequiredMixin, CreateView):
             # Save the announcement using the form's save method (handles ManyToMany fields correctly)
             announcement = form.save()
             
+            # Фото, загруженные частями (photo_upload_chunk), — в порядке на форме
+            uploaded_photos = PhotoUploadService.save_announcement_photos(
+                announcement, self.request.user, self.request.POST.getlist('photo_uploads')
+            )
+            
             # Handle photo uploads with error handling
-            photo_objects = []
+            photo_objects = list(uploaded_photos.values())
             for i, photo in enumerate(photos):
                 try:
                     photo_obj = PhotoService.save_announcement_photo(announcement, photo)
@@ -428,19 +348,23 @@ class AnnouncementCreateView(LoginRequiredMixin, CreateView):
             
             # Handle setting main photo
             main_photo_id = self.request.POST.get('main_photo_id')
-            if main_photo_id and main_photo_id.startswith('new_'):
+            if main_photo_id and main_photo_id.startswith('upload_'):
+                main_photo = uploaded_photos.get(main_photo_id.replace('upload_', ''))
+                if main_photo is not None:
+                    PhotoService.set_main_photo(main_photo)
+                elif photo_objects:
+                    PhotoService.set_main_photo(photo_objects[0])
+            elif main_photo_id and main_photo_id.startswith('new_'):
                 # This is a new photo
                 try:
                     index = int(main_photo_id.replace('new_', ''))
                     if index < len(photo_objects):
-                        photo_objects[index].is_main = True
-                        photo_objects[index].save()
+                        PhotoService.set_main_photo(photo_objects[index])
                 except (ValueError, IndexError):
                     pass
             elif photo_objects:
                 # If no main photo is selected, make the first one main
-                photo_objects[0].is_main = True
-                photo_objects[0].save()
+                PhotoService.set_main_photo(photo_objects[0])
             
             # Log announcement creation
             log_announcement_action(
@@ -451,6 +375,13 @@ class AnnouncementCreateView(LoginRequiredMixin, CreateView):
             )
             
             messages.success(self.request, 'Объявление создано успешно!')
+            # Фото, уже загруженные с другими объявлениями, готовы сразу — по ним видно дубликаты
+            duplicates = find_duplicate_announcements(announcement)
+            if duplicates:
+                messages.warning(
+                    self.request,
+                    f'Найдены объявления с похожими фото ({len(duplicates)}) — проверьте, не дубликат ли это'
+                )
             return redirect('announcement_detail', pk=announcement.pk)
             
         except Exception as e:
@@ -488,9 +419,12 @@ class AnnouncementUpdateView(LoginRequiredMixin, UpdateView):
                 setattr(self.object.address, field, value)
             self.object.address.save()
             
-            # Handle new photo uploads
+            # Handle new photo uploads: chunked uploads first, then plain files
+            uploaded_photos = PhotoUploadService.save_announcement_photos(
+                self.object, self.request.user, self.request.POST.getlist('photo_uploads')
+            )
             photos = self.request.FILES.getlist('photos')
-            new_photos = []
+            new_photos = list(uploaded_photos.values())
             for photo in photos:
                 photo_obj = PhotoService.save_announcement_photo(self.object, photo)
                 new_photos.append(photo_obj)
@@ -498,21 +432,23 @@ class AnnouncementUpdateView(LoginRequiredMixin, UpdateView):
             # Handle setting main photo
             main_photo_id = self.request.POST.get('main_photo_id')
             if main_photo_id:
-                # Сначала убираем отметку главного со всех фото
-                self.object.photos.update(is_main=False)
-                
-                if main_photo_id.startswith('new_'):
+                # set_main_photo снимает отметку главного с остальных фото
+                # и обновляет ссылку на главное фото в self.object
+                if main_photo_id.startswith('upload_'):
+                    # Новое фото, загруженное частями
+                    photo = uploaded_photos.get(main_photo_id.replace('upload_', ''))
+                    if photo is not None:
+                        PhotoService.set_main_photo(photo)
+                elif main_photo_id.startswith('new_'):
                     # Это новое фото
                     index = int(main_photo_id.replace('new_', ''))
                     if index < len(new_photos):
-                        new_photos[index].is_main = True
-                        new_photos[index].save()
+                        PhotoService.set_main_photo(new_photos[index])
                 else:
                     # Это существующее фото
                     try:
                         photo = self.object.photos.get(id=main_photo_id)
-                        photo.is_main = True
-                        photo.save()
+                        PhotoService.set_main_photo(photo)
                     except Photo.DoesNotExist:
                         pass
             
@@ -586,12 +522,22 @@ class CollectionDetailView(LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         
         # Get active and archived announcements separately
-        active_announcements = CollectionService.get_active_collection_announcements(self.object)
-        archived_announcements = CollectionService.get_archived_collection_announcements(self.object)
+        active_announcements = list(CollectionService.get_active_collection_announcements(self.object))
+        archived_announcements = list(CollectionService.get_archived_collection_announcements(self.object))
+        
+        # Другие коллекции пользователя, где есть эти объявления (один запрос на страницу)
+        collections_map = CollectionService.get_announcements_collections_map(
+            active_announcements + archived_announcements, self.request.user
+        )
+        for announcement in active_announcements + archived_announcements:
+            announcement.user_collections = [
+                collection for collection in collections_map[announcement.pk]
+                if collection.pk != self.object.pk
+            ]
         
         context['active_announcements'] = active_announcements
         context['archived_announcements'] = archived_announcements
-        context['total_announcements'] = active_announcements.count() + archived_announcements.count()
+        context['total_announcements'] = len(active_announcements) + len(archived_announcements)
         
         return context
 
@@ -774,6 +720,22 @@ def add_to_collection(request):
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 
+@login_required
+def announcement_facets(request):
+    """AJAX view to get result counts per filter value for the current filters"""
+    form = SearchForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'message': 'Invalid filters', 'errors': form.errors})
+    
+    try:
+        return JsonResponse({
+            'success': True,
+            'facets': AnnouncementService.get_facet_counts(form.cleaned_data)
+        })
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': str(e)})
+
+
 @login_required
 def get_announcement_collections(request, announcement_id):
     """AJAX view to get collections that contain this announcement"""
@@ -964,7 +926,7 @@ def account_delete(request):
         for announcement in announcements:
             # Удаляем все фотографии объявления
             for photo in announcement.photos.all():
-                photo.delete()  # Это также удалит файл из файловой системы
+                photo.delete()  # Файлы удаляются сигналом после коммита (см. main.signals)
             announcement.delete()
         
         # Удаляем все коллекции пользователя
@@ -973,7 +935,7 @@ def account_delete(request):
         
         # Удаляем все фотографии пользователя
         for photo in user.photos.all():
-            photo.delete()  # Это также удалит файл из файловой системы
+            photo.delete()  # Файлы удаляются сигналом после коммита (см. main.signals)
         
         # Завершаем сеанс пользователя
         if hasattr(request, 'session') and request.session.session_key:
@@ -1036,6 +998,80 @@ def upload_user_photo(request):
     return JsonResponse({'success': False, 'message': 'Неверный запрос'})
 
 
+@login_required
+def photo_upload_start(request):
+    """AJAX endpoint: start a chunked upload of an announcement photo"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Неверный запрос'}, status=405)
+    
+    try:
+        size = int(request.POST.get('size', 0))
+    except ValueError:
+        size = 0
+    try:
+        upload = PhotoUploadService.start(
+            request.user,
+            request.POST.get('name', ''),
+            size,
+            request.POST.get('type', ''),
+            request.POST.get('checksum', '')
+        )
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'id': str(upload.pk),
+        'offset': 0,
+        'chunk_size': PhotoUploadService.get_config()['CHUNK_SIZE'],
+    })
+
+
+@login_required
+def photo_upload_chunk(request, upload_id):
+    """
+    AJAX endpoint for a chunked upload: GET returns the received offset to
+    resume from, PUT writes a chunk starting at the Upload-Offset header
+    (optional Upload-Checksum: SHA-256 of the chunk), DELETE cancels it.
+    The request body is streamed to the spool file and never read into memory.
+    """
+    upload = get_object_or_404(PhotoUpload, pk=upload_id, user=request.user)
+    
+    if request.method == 'DELETE':
+        PhotoUploadService.delete(upload)
+        return JsonResponse({'success': True})
+    
+    if request.method == 'PUT':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            return JsonResponse({'success': False, 'message': 'Неверный запрос'}, status=400)
+        
+        if upload.is_complete or offset != upload.received:
+            # Клиент продолжает с offset из ответа
+            return JsonResponse({
+                'success': False,
+                'offset': upload.received,
+                'complete': upload.is_complete,
+            }, status=409)
+        try:
+            upload = PhotoUploadService.write_chunk(
+                upload, offset, request, length, request.headers.get('Upload-Checksum')
+            )
+        except ValueError as e:
+            return JsonResponse({'success': False, 'message': str(e), 'offset': upload.received}, status=400)
+    elif request.method != 'GET':
+        return JsonResponse({'success': False, 'message': 'Неверный запрос'}, status=405)
+    
+    return JsonResponse({
+        'success': True,
+        'id': str(upload.pk),
+        'offset': upload.received,
+        'complete': upload.is_complete,
+    })
+
+
 @login_required
 def archive_announcement(request, pk):
     """Archive an announcement"""
@@ -134,17 +134,55 @@ else:
 
 
 # Кэширование для производительности
+# Общий для всех воркеров кэш в файле SQLite (main.cache_backends.SQLiteCache):
+# справочники прогреваются один раз на хост, cache_management --stats видит реальный кэш
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': config('CACHE_BACKEND', default='main.cache_backends.SQLiteCache'),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'cache' / 'django_cache.sqlite3')),
         'TIMEOUT': 300,  # 5 минут
         'OPTIONS': {
-            'MAX_ENTRIES': 1000,
+            'MAX_ENTRIES': 5000,
+            'CULL_EVERY': 50,  # проверка размера раз в N записей процесса
+            'ACCESS_SAMPLE_RATE': 0.1,  # доля чтений, обновляющих время доступа (LRU)
         }
     }
 }
 
+# Буферизованная запись активности пользователей (main.activity):
+# записи копятся в очереди процесса и сохраняются пачками фоновым потоком
+USER_ACTIVITY_BUFFER = {
+    'ENABLED': config('USER_ACTIVITY_BUFFER_ENABLED', default=True, cast=bool),
+    'MAX_QUEUE_SIZE': 10000,  # сверх этого записи отбрасываются (счетчик dropped)
+    'BATCH_SIZE': 200,        # размер пачки bulk_create
+    'FLUSH_INTERVAL': 2.0,    # секунды между сбросами очереди
+    'SHUTDOWN_TIMEOUT': 10.0, # ожидание сброса при остановке воркера
+}
+
+# Пагинация списка объявлений (main.pagination):
+# 'keyset' — по курсору (created_at, id), без OFFSET и COUNT(*); 'offset' — классическая
+ANNOUNCEMENT_LIST_PAGINATION = {
+    'MODE': config('ANNOUNCEMENT_PAGINATION_MODE', default='keyset'),
+    'APPROXIMATE_TOTAL': True,  # оценка количества по плану PostgreSQL
+}
+
+# Поиск объявлений (main.search_engine): 'database' — фильтрация в БД;
+# 'memory' — колонки NumPy в памяти процесса (нужен numpy), из БД читается только страница
+SEARCH_ENGINE = {
+    'BACKEND': config('SEARCH_BACKEND', default='database'),
+    'SYNC_INTERVAL': 5.0,  # сек. между проверками измененных объявлений
+    'REBUILD_INTERVAL': 900.0,  # полная перестройка индекса, сек.
+    'SYNC_OVERLAP': 300.0,  # не меньше самой долгой транзакции с объявлениями, сек.
+}
+
+# Кэш результатов поиска в БД: упорядоченные id по сигнатуре фильтров.
+# Сбрасывается счетчиком поколения объявлений (main.search_engine.mark_changed)
+SEARCH_RESULT_CACHE = {
+    'ENABLED': config('SEARCH_RESULT_CACHE', default=True, cast=bool),
+    'TIMEOUT': 300,  # сек.
+    'MAX_IDS': 10000,  # более объемные выборки не кэшируются
+}
+
 # Время жизни сессий (для стабильности используем базу данных)
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'  # Используем БД вместо кэша
 SESSION_COOKIE_AGE = 432000  # 5 дней (5 * 24 * 60 * 60 = 432000 секунд)
@@ -174,6 +212,10 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
 
+# Снимок пользователя (с агентством и фото профиля) в общем кэше, сек.
+# Сбрасывается при изменении профиля, агентства или фото (main.signals)
+AUTH_USER_CACHE_TIMEOUT = 300
+
 # Custom user model
 AUTH_USER_MODEL = 'main.User'
 
@@ -205,13 +247,27 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Раздача фото из MEDIA_ROOT (main.media): файлы с хэшем содержимого в имени кэшируются
+# браузером как immutable. Если /media/ отдает nginx напрямую, ENABLED можно выключить;
+# ACCEL_REDIRECT — префикс internal location nginx для отдачи файла через X-Accel-Redirect
+MEDIA_SERVING = {
+    'ENABLED': config('MEDIA_SERVING_ENABLED', default=True, cast=bool),
+    'MAX_AGE': 24 * 60 * 60,  # сек., для файлов без хэша в имени
+    'IMMUTABLE_MAX_AGE': 365 * 24 * 60 * 60,
+    'ACCEL_REDIRECT': config('MEDIA_ACCEL_REDIRECT', default='') or None,
+}
+
 # Image optimization settings
+# Варианты фото строит main.image_pipeline за одно декодирование исходника
 IMAGE_OPTIMIZATION = {
     'ANNOUNCEMENT_PHOTOS': {
         'MAX_WIDTH': 1600,  # Уменьшено с 1920
         'MAX_HEIGHT': 900,  # Уменьшено с 1080
         'QUALITY': 80,      # Уменьшено с 85 для лучшего сжатия
         'THUMBNAIL_SIZE': (400, 300),
+        'THUMBNAIL_QUALITY': 80,
+        # Уменьшенные копии для srcset (PhotoRendition); ширины не меньше MAX_WIDTH не создаются
+        'SRCSET_WIDTHS': (320, 640, 960, 1600),
     },
     'USER_PHOTOS': {
         'MAX_WIDTH': 600,   # Уменьшено с 800
@@ -219,6 +275,36 @@ IMAGE_OPTIMIZATION = {
         'QUALITY': 85,      # Уменьшено с 90
     },
     'MAX_FILE_SIZE': 15 * 1024 * 1024,  # Увеличено до 15MB для больших исходных файлов
+    # Копии фото объявлений в современных форматах рядом с JPEG (отдаются через <picture>).
+    # Порядок — приоритет для браузера; формат без поддержки в Pillow пропускается
+    'MODERN_FORMATS': {
+        'avif': {'QUALITY': 55, 'SPEED': 8},
+        'webp': {'QUALITY': 75, 'METHOD': 4},
+    },
+}
+
+# Обработка загруженных фото объявлений (main.photo_queue): 'background' — пул потоков
+# процесса после ответа, 'queue' — только воркер manage.py process_photos, 'inline' — в запросе
+PHOTO_PROCESSING = {
+    'MODE': config('PHOTO_PROCESSING_MODE', default='background'),
+    'WORKERS': 2,  # потоков на процесс
+    'MAX_ATTEMPTS': 3,  # после стольких ошибок фото получает статус failed
+    'STALE_AFTER': 600,  # сек.: зависшая обработка захватывается заново
+}
+
+# Загрузка фото объявлений частями (PhotoUploadService): части пишутся сразу во
+# временный файл на диске, в памяти воркера — не больше одного буфера чтения
+PHOTO_UPLOADS = {
+    'SPOOL_DIR': config('PHOTO_UPLOAD_SPOOL_DIR', default=str(BASE_DIR / 'uploads')),
+    'CHUNK_SIZE': 1024 * 1024,  # максимальный размер части
+    'EXPIRE_AFTER': 24 * 60 * 60,  # сек.: незавершенные и неиспользованные загрузки удаляет cleanup_media
+}
+
+# Поиск дубликатов объявлений по перцептивному хэшу фото (main.duplicates)
+PHOTO_DUPLICATES = {
+    'MAX_DISTANCE': 7,  # бит из 64; до 7 — один вариант на сегмент, до 11 — радиус 2
+    'MAX_PHOTOS': 20,  # фото объявления, участвующих в поиске
+    'LIMIT': 5,  # дубликатов на странице объявления
 }
 
 # Default primary key field type
@@ -228,10 +314,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Session settings
 SESSION_COOKIE_AGE = 432000  # 5 days (5 * 24 * 60 * 60 = 432000 seconds)
-SESSION_SAVE_EVERY_REQUEST = True
+# Сессия сохраняется только при изменении: UserSessionMiddleware продлевает ее
+# и отмечает активность не чаще раза в SESSION_TRACKING['ACTIVITY_INTERVAL']
+SESSION_SAVE_EVERY_REQUEST = False
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False  # Сессия не истекает при закрытии браузера
 SESSION_COOKIE_SECURE = False  # Для разработки, в продакшене должно быть True
 
+SESSION_TRACKING = {
+    'ACTIVITY_INTERVAL': config('SESSION_ACTIVITY_INTERVAL', default=300, cast=int),  # сек.
+}
+
 # Login URLs
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
@@ -252,7 +344,9 @@ if not DEBUG:
 CSRF_TRUSTED_ORIGINS = config('CSRF_TRUSTED_ORIGINS', default='').split(',') if config('CSRF_TRUSTED_ORIGINS', default='') else []
 
 # File upload settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 15 * 1024 * 1024  # 15MB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 15 * 1024 * 1024  # 15MB
+# Фото объявлений загружаются частями (PHOTO_UPLOADS), поэтому в памяти держатся только
+# небольшие файлы: остальные Django пишет во временный файл
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB (значение Django по умолчанию)
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 1000
 